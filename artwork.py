@@ -0,0 +1,173 @@
+"""Cover art lookup for tracks: embedded artwork first, web search last.
+
+Most files already carry a cover in their tags (ID3 APIC frames, FLAC
+PICTURE blocks, MP4 `covr` atoms, Vorbis/Opus METADATA_BLOCK_PICTURE), so
+`find_cover` tries that before anything touches the network. Extracted art is
+resized to a thumbnail once and kept under the MusicDom cache directory,
+keyed by file and mtime, so later page loads only open a small JPEG. Only
+when a track has no embedded art does it fall back to `image_search` through
+the persistent `cover_cache`.
+"""
+from __future__ import annotations
+
+import base64
+import glob
+import io
+import os
+import threading
+from typing import Optional, Union
+
+import cover_cache
+import image_search
+import metrics
+import storage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMB_SIZE = 512
+# APIC / FLAC picture type for the front cover
+_FRONT_COVER = 3
+
+
+def _pick(pictures) -> Optional[bytes]:
+    pictures = [p for p in pictures if getattr(p, "data", None)]
+    if not pictures:
+        return None
+    front = [p for p in pictures if getattr(p, "type", None) == _FRONT_COVER]
+    return (front or pictures)[0].data
+
+
+def extract_embedded(filepath: str) -> Optional[bytes]:
+    """Return the raw bytes of the cover embedded in `filepath`, if any."""
+    import mutagen
+    try:
+        audio = mutagen.File(filepath)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+
+    # FLAC keeps pictures outside the Vorbis comment
+    data = _pick(getattr(audio, "pictures", None) or [])
+    if data:
+        return data
+
+    tags = audio.tags
+    if not tags:
+        return None
+    if hasattr(tags, "getall"):
+        # ID3 (MP3, and WAV/AIFF files with an ID3 chunk)
+        return _pick(tags.getall("APIC"))
+    try:
+        if "covr" in tags:
+            # MP4 / M4A
+            return bytes(tags["covr"][0])
+        if "metadata_block_picture" in tags:
+            # Ogg Vorbis / Opus
+            from mutagen.flac import Picture
+            pictures = []
+            for value in tags["metadata_block_picture"]:
+                try:
+                    pictures.append(Picture(base64.b64decode(value)))
+                except Exception:
+                    continue
+            return _pick(pictures)
+    except Exception:
+        return None
+    return None
+
+
+def _thumbnail(data: bytes) -> bytes:
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=85)
+            return out.getvalue()
+    except Exception:
+        return data
+
+
+def embedded_thumbnail(filepath: str) -> Optional[str]:
+    """Return the path of a cached thumbnail of the embedded cover, or None.
+
+    The cache entry is keyed by file and mtime; a marker file records tracks
+    without embedded art so they are not re-parsed on every page load.
+    """
+    try:
+        mtime_ns = os.stat(filepath).st_mtime_ns
+    except OSError:
+        return None
+    prefix = os.path.join(storage.data_dir("thumbnails"), storage.path_key(filepath))
+    thumb, marker = f"{prefix}-{mtime_ns}.jpg", f"{prefix}-{mtime_ns}.none"
+    if os.path.exists(thumb):
+        metrics.cache("thumbnail", hit=True)
+        return thumb
+    if os.path.exists(marker):
+        metrics.cache("thumbnail", hit=True)
+        return None
+    metrics.cache("thumbnail", hit=False)
+
+    # Drop entries of older versions of this file (not the temporary files
+    # of concurrent writers)
+    current = f"{prefix}-{mtime_ns}."
+    for stale in glob.glob(f"{glob.escape(prefix)}-*"):
+        if stale.endswith(".tmp") or stale.startswith(current):
+            continue
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+    data = extract_embedded(filepath)
+    target = thumb if data else marker
+    tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_thumbnail(data) if data else b"")
+        os.replace(tmp, target)
+    except OSError:
+        # Another writer got there first, or the cache is not writable
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return thumb if os.path.exists(thumb) else None
+    return thumb if data else None
+
+
+def find_cover(filepath: str, artist: str, album: str, query: str) -> Union[str, bytes, None]:
+    """Resolve a cover for a track: embedded art, then cached web search.
+
+    Returns a local thumbnail path, image bytes or an image URL (anything
+    `st.image` accepts), or None when nothing was found.
+    """
+    thumb = embedded_thumbnail(filepath)
+    if thumb:
+        return thumb
+    return cover_cache.get_or_fetch(
+        artist, album, lambda: image_search.fetch_image_url(query, min_size=40 * 1024)
+    )
+
+
+def cover_query(title: str, artist: str, album: str, year: str) -> str:
+    return " ".join(filter(None, [title, artist, album, year])) + " album cover"
+
+
+def cover_for_track(root: str, track: dict) -> Union[str, bytes, None]:
+    """`find_cover` for an index row of `library_index`.
+
+    Without an album the title identifies the cover (e.g. singles).
+    """
+    title = track["title"] or os.path.splitext(track["name"])[0]
+    artist = track["artist"] or "Desconhecido"
+    return find_cover(
+        os.path.join(root, track["relpath"]), artist, track["album"] or title,
+        cover_query(title, artist, track["album"], track["date"]),
+    )
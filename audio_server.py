@@ -0,0 +1,433 @@
+"""Local HTTP endpoint that streams library files to the browser.
+
+Streamlit has no way to serve large files with `Range` support from a page,
+so MusicDom runs a small threaded HTTP server next to it (started once per
+server process by `ensure_running`). The player points its `<audio>` element
+at `track_url(root, relpath)` and the browser fetches the file in chunks as
+it plays, instead of receiving the whole track base64-encoded in the page.
+`peaks_url` serves the track's precomputed waveform (see `peaks`) as JSON
+for any time window, so the player can zoom without a Streamlit rerun, and
+`cover_url` its cover, so the player can switch tracks of its queue without
+one either. A `profile` query on a track URL streams it transcoded (see
+`stream_cache`). `/metrics` (Prometheus text) and `/metrics.json` expose the
+process totals of `metrics` for scraping.
+
+Only files inside library roots registered through `track_url` are served;
+URLs name a root by `storage.path_key` (a hash of its path, which anyone who
+knows the path can compute) rather than by the path itself.
+
+The URLs are built for the browser that loaded the page, given by the
+headers of its Streamlit request (`st.context.headers`): a browser on the
+server machine uses the loopback address, one on another machine reaches
+the server under the host name it used for Streamlit when the server listens
+on all interfaces. When the browser cannot reach the server at all (the
+default bind address with a remote browser) the URL functions raise
+`Unreachable` and the player falls back to `st.audio`.
+
+Responses allow cross-origin reads (needed for the player's WebAudio gain
+and peak requests) only from the origins of the Streamlit pages that built
+URLs, never from any site.
+
+Configuration (environment variables):
+- `MUSICDOM_STREAM_HOST` / `MUSICDOM_STREAM_PORT`: bind address
+  (default 127.0.0.1:8765, or an ephemeral port if that one is taken);
+  use 0.0.0.0 to stream to other machines.
+- `MUSICDOM_STREAM_URL`: public base URL the browser should use, when the
+  server sits behind a proxy.
+"""
+from __future__ import annotations
+
+import email.utils
+import json
+import mimetypes
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Mapping, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse, urlsplit
+
+import artwork
+import library_service
+import metrics
+import peaks
+import storage
+import stream_cache
+
+CHUNK_SIZE = 64 * 1024
+
+MIME_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".oga": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".mp4": "audio/mp4",
+    ".aac": "audio/aac",
+    ".flac": "audio/flac",
+    ".wma": "audio/x-ms-wma",
+}
+
+_roots: Dict[str, str] = {}
+# Origins of the Streamlit pages URLs were built for (see `_url`)
+_origins: Set[str] = set()
+_server: Optional[ThreadingHTTPServer] = None
+_lock = threading.Lock()
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_LOOPBACK = ("localhost", "127.0.0.1", "::1")
+_ANY_ADDRESS = ("0.0.0.0", "::", "")
+
+
+class Unreachable(OSError):
+    """The streaming server cannot be reached from the page's browser."""
+
+
+def mime_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into inclusive (start, end).
+
+    Returns None when the header is absent or invalid, e.g. `bytes=5-2`
+    (RFC 9110 §14.1.1: serve the whole file), and raises ValueError when the
+    range cannot be satisfied.
+    """
+    m = _RANGE_RE.match(header.strip()) if header else None
+    if not m or not any(m.groups()):
+        return None
+    start, end = m.groups()
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self, route: str = "track") -> Optional[str]:
+        # /<route>/<root key>/<relative path>
+        parts = urlparse(self.path).path.split("/", 3)
+        if len(parts) != 4 or parts[1] != route:
+            return None
+        root = _roots.get(parts[2])
+        if not root:
+            return None
+        filepath = os.path.realpath(os.path.join(root, unquote(parts[3])))
+        if os.path.commonpath([filepath, os.path.realpath(root)]) != os.path.realpath(root):
+            return None
+        return filepath if os.path.isfile(filepath) else None
+
+    def _send_cors(self) -> None:
+        # Only the MusicDom pages may read responses from scripts
+        origin = self.headers.get("Origin")
+        if origin and origin in _origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+
+    def do_HEAD(self):
+        self._route(head=True)
+
+    def do_GET(self):
+        self._route(head=False)
+
+    def _route(self, head: bool) -> None:
+        route = urlparse(self.path).path
+        if route in ("/metrics", "/metrics.json"):
+            self._serve_metrics(route.endswith(".json"), head)
+        elif route.startswith("/peaks/"):
+            self._serve_peaks(head)
+        elif route.startswith("/cover/"):
+            self._serve_cover(head)
+        else:
+            self._serve(head)
+
+    def _serve_metrics(self, as_json: bool, head: bool) -> None:
+        # Scrape target for Prometheus (or JSON for ad-hoc tooling)
+        if as_json:
+            body, kind = json.dumps(metrics.snapshot()).encode(), "application/json"
+        else:
+            body, kind = metrics.prometheus_text().encode(), "text/plain; version=0.0.4; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve_cover(self, head: bool) -> None:
+        # Same lookup as the player page (embedded art, then cached web
+        # search); thumbnails and cached images are sent, web URLs redirected
+        filepath = self._resolve("cover")
+        cover = None
+        if filepath:
+            key, relpath = urlparse(self.path).path.split("/", 3)[2:]
+            root = _roots[key]
+            track = library_service.get(root).track(unquote(relpath).replace("/", os.sep))
+            try:
+                cover = artwork.cover_for_track(root, track) if track else None
+            except Exception:
+                cover = None
+        if isinstance(cover, str) and cover.startswith(("http://", "https://")):
+            self.send_response(302)
+            self.send_header("Location", cover)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if isinstance(cover, str):
+            try:
+                with open(cover, "rb") as f:
+                    cover = f.read()
+            except OSError:
+                cover = None
+        if not cover:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png" if cover.startswith(b"\x89PNG") else "image/jpeg")
+        self.send_header("Content-Length", str(len(cover)))
+        self.send_header("Cache-Control", "private, max-age=3600")
+        self.end_headers()
+        if not head:
+            self.wfile.write(cover)
+
+    def _serve_peaks(self, head: bool) -> None:
+        # ?columns=N&start=S&end=E (seconds) -> {"duration", "peaks": [[min, max], ...]}
+        filepath = self._resolve("peaks")
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            columns = min(4096, int(query.get("columns", ["800"])[0]))
+            start = float(query.get("start", ["0"])[0])
+            end = float(query["end"][0]) if "end" in query else None
+        except ValueError:
+            self.send_error(400)
+            return
+        try:
+            data = peaks.load(filepath, columns, start, end) if filepath else None
+        except (OSError, ValueError):
+            data = None
+        if data is None:
+            self.send_error(404)
+            return
+        body = json.dumps({"duration": peaks.duration(filepath), "peaks": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self._send_cors()
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve(self, head: bool) -> None:
+        filepath = self._resolve()
+        if not filepath:
+            self.send_error(404)
+            return
+        profile = parse_qs(urlparse(self.path).query).get("profile", [stream_cache.ORIGINAL])[0]
+        if profile in stream_cache.PROFILES and stream_cache.should_transcode(filepath, profile):
+            if head:
+                # Never start an encode just to answer HEAD
+                self._head_stream(filepath, profile)
+                return
+            stream = stream_cache.open_stream(filepath, profile)
+            if isinstance(stream, str):
+                self._serve_file(stream, head, stream_cache.PROFILES[profile].mime)
+            else:
+                self._serve_encoding(stream)
+            return
+        self._serve_file(filepath, head, mime_type(filepath))
+
+    def _head_stream(self, filepath: str, profile: str) -> None:
+        cached = stream_cache.cached(filepath, profile)
+        if cached:
+            self._serve_file(cached, True, stream_cache.PROFILES[profile].mime)
+            return
+        # Headers of the chunked response a GET would get; HEAD has no body
+        self.send_response(200)
+        self.send_header("Content-Type", stream_cache.PROFILES[profile].mime)
+        self.send_header("Accept-Ranges", "none")
+        self.send_header("Cache-Control", "no-cache")
+        self._send_cors()
+        self.end_headers()
+
+    def _serve_encoding(self, encoding: "stream_cache.Encoding") -> None:
+        # Length unknown until the encode finishes: chunked, no ranges (the
+        # next request for this stream gets the cached file, with ranges)
+        self.send_response(200)
+        self.send_header("Content-Type", encoding.profile.mime)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Accept-Ranges", "none")
+        self.send_header("Cache-Control", "no-cache")
+        self._send_cors()
+        self.end_headers()
+        try:
+            for chunk in encoding.chunks():
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except RuntimeError:
+            # Encode failed midway: drop the connection so the browser errors out
+            self.close_connection = True
+
+    def _serve_file(self, filepath: str, head: bool, content_type: str) -> None:
+        st = os.stat(filepath)
+        size = st.st_size
+        etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            byte_range = parse_range(self.headers.get("Range", ""), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range and self.headers.get("If-Range") not in (None, etag):
+            byte_range = None
+
+        start, end = byte_range or (0, size - 1)
+        length = max(0, end - start + 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True))
+        self.send_header("Cache-Control", "private, max-age=3600")
+        # Lets the player route the audio through WebAudio (loudness gain)
+        self._send_cors()
+        self.end_headers()
+        if head or not length:
+            return
+
+        with open(filepath, "rb") as f:
+            f.seek(start)
+            remaining = length
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # The browser aborts requests freely while seeking
+                pass
+
+
+def ensure_running() -> ThreadingHTTPServer:
+    """Start the streaming server on first use and return it."""
+    global _server
+    with _lock:
+        if _server is None:
+            host = os.getenv("MUSICDOM_STREAM_HOST", "127.0.0.1")
+            port = int(os.getenv("MUSICDOM_STREAM_PORT", 8765))
+            try:
+                server = ThreadingHTTPServer((host, port), _Handler)
+            except OSError:
+                server = ThreadingHTTPServer((host, 0), _Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="musicdom-audio-server", daemon=True).start()
+            _server = server
+        return _server
+
+
+def _host_name(headers: Optional[Mapping[str, str]]) -> str:
+    # Host name the browser used for the Streamlit page (no headers: a
+    # caller on the server machine)
+    host = (headers or {}).get("Host") or (headers or {}).get("host")
+    if not host:
+        return "127.0.0.1"
+    return (urlsplit(f"//{host}").hostname or "127.0.0.1").lower()
+
+
+def base_url(headers: Optional[Mapping[str, str]] = None) -> str:
+    """Return the base URL of the server for the browser that sent `headers`.
+
+    Raises `Unreachable` when that browser cannot connect to it.
+    """
+    configured = os.getenv("MUSICDOM_STREAM_URL")
+    if configured:
+        return configured.rstrip("/")
+    host, port = ensure_running().server_address[:2]
+    browser = _host_name(headers)
+    if browser in _LOOPBACK:
+        if host in _ANY_ADDRESS:
+            host = "127.0.0.1"
+    elif host in _ANY_ADDRESS:
+        host = browser
+    elif host != browser:
+        raise Unreachable(f"{host}:{port} is not reachable from a browser on {browser}")
+    return f"http://[{host}]:{port}" if ":" in host else f"http://{host}:{port}"
+
+
+def _page_origin(headers: Mapping[str, str]) -> Optional[str]:
+    origin = headers.get("Origin") or headers.get("origin")
+    if origin:
+        return origin
+    host = headers.get("Host") or headers.get("host")
+    return f"http://{host}" if host else None
+
+
+def _url(route: str, root: str, relpath: str, headers: Optional[Mapping[str, str]]) -> str:
+    base = base_url(headers)
+    origin = _page_origin(headers) if headers else None
+    if origin:
+        _origins.add(origin)
+    key = storage.path_key(root)
+    _roots[key] = os.path.abspath(root)
+    return f"{base}/{route}/{key}/{quote(relpath.replace(os.sep, '/'))}"
+
+
+def track_url(root: str, relpath: str, profile: str = stream_cache.ORIGINAL,
+              headers: Optional[Mapping[str, str]] = None) -> str:
+    """Return the URL the browser should use to stream `relpath` of `root`.
+
+    Any other `profile` than the original (see `stream_cache.PROFILES`)
+    streams a transcoded version when it is smaller. `headers` are those of
+    the page request (see `base_url`).
+    """
+    url = _url("track", root, relpath, headers)
+    return url if profile == stream_cache.ORIGINAL else f"{url}?profile={profile}"
+
+
+def cover_url(root: str, relpath: str, headers: Optional[Mapping[str, str]] = None) -> str:
+    """Return the URL of the cover image of a track (404 when there is none)."""
+    return _url("cover", root, relpath, headers)
+
+
+def peaks_url(root: str, relpath: str, headers: Optional[Mapping[str, str]] = None) -> str:
+    """Return the URL of the waveform peaks (JSON, see `peaks.load`) of a track."""
+    return _url("peaks", root, relpath, headers)
+
+
+def metrics_url(as_json: bool = False) -> str:
+    """Return the URL of the metrics export (Prometheus text, or JSON)."""
+    return f"{base_url()}/metrics{'.json' if as_json else ''}"
@@ -0,0 +1,48 @@
+"""Compare two benchmark result files written by `run.py`.
+
+    python benchmarks/compare.py old.json new.json [--threshold 0.15]
+
+Prints the best time of every benchmark in both runs and the change; exits
+with status 1 when any benchmark got slower by more than `--threshold`.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two MusicDom benchmark runs.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown (0.15 = 15 %%)")
+    args = parser.parse_args(argv)
+
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{'benchmark':32s} {old['meta'].get('commit') or 'old':>10s} {new['meta'].get('commit') or 'new':>10s}   change")
+    regressions = []
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        if name == "generate":
+            continue
+        a, b = old["results"].get(name), new["results"].get(name)
+        if not a or not b:
+            cells = [f"{r['min_s'] * 1000:.1f}" if r else "-" for r in (a, b)]
+            print(f"{name:32s} {cells[0]:>10s} {cells[1]:>10s}")
+            continue
+        change = b["min_s"] / a["min_s"] - 1 if a["min_s"] else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  << slower"
+            regressions.append(name)
+        print(f"{name:32s} {a['min_s'] * 1000:10.1f} {b['min_s'] * 1000:10.1f}   {change:+7.1%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
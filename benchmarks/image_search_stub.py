@@ -0,0 +1,136 @@
+"""Local stand-in for the image search engines and image hosts.
+
+`Stub` runs a few HTTP servers on 127.0.0.1 (one per engine and
+`image_hosts` image hosts, so each gets its own `image_search` host limiter
+like the real sites) serving:
+
+- `/bing/<scenario>` and `/google/<scenario>`: result pages shaped like the
+  ones `image_search` parses (Bing `a.iusc` elements with an `m` JSON
+  attribute, Google `imgres?imgurl=` links);
+- `/img/<n>?size=&delay=&status=&type=`: an image host answering HEAD/GET
+  after `delay` seconds with `status`, `type` and a `size`-byte body.
+
+A scenario decides what the result pages link to (`SCENARIOS`), so the same
+`fetch_image_url` call can be timed against fast, slow or failing hosts.
+`use(scenario)` points `image_search` at the stub and gives the stub's
+engine hosts the same limits as Bing and Google.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, quote, urlparse
+
+import image_search
+
+# scenario -> engine page latency and, per result, (size, delay, status, type)
+SCENARIOS: Dict[str, dict] = {
+    # Every candidate is a large image answering at once
+    "fast": {"page_delay": 0.05, "images": [(120_000, 0.0, 200, "image/jpeg")] * 20},
+    # First results are slow or small; a good one comes late
+    "slow_hosts": {
+        "page_delay": 0.2,
+        "images": [(20_000, 0.8, 200, "image/jpeg"), (150_000, 1.5, 200, "image/jpeg")]
+        + [(10_000, 0.3, 200, "image/png")] * 6 + [(90_000, 0.1, 200, "image/jpeg")] * 4,
+    },
+    # Broken hosts: errors, HTML instead of images, one stalled host
+    "failing_hosts": {
+        "page_delay": 0.1,
+        "images": [(0, 0.0, 500, "text/html"), (0, 0.0, 404, "text/html"),
+                   (5_000, 0.0, 200, "text/html"), (100_000, 3.0, 200, "image/jpeg")]
+        + [(0, 0.0, 503, "text/html")] * 4 + [(80_000, 0.2, 200, "image/jpeg")] * 2,
+    },
+    # Nothing reaches the minimum size: the largest image wins
+    "small_only": {"page_delay": 0.05, "images": [(8_000 + 1_000 * i, 0.05, 200, "image/jpeg") for i in range(12)]},
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _image_urls(self, scenario: str) -> List[str]:
+        hosts = self.server.stub.image_hosts
+        return [
+            f"{_base_url(hosts[n % len(hosts)])}/img/{n}?size={size}&delay={delay}&status={status}&type={quote(kind)}"
+            for n, (size, delay, status, kind) in enumerate(SCENARIOS[scenario]["images"])
+        ]
+
+    def _page(self, engine: str, scenario: str) -> str:
+        urls = self._image_urls(scenario)
+        if engine == "bing":
+            items = "".join(
+                f"<a class=\"iusc\" m='{json.dumps({'murl': u})}' href=\"#\"></a>" for u in urls
+            )
+        else:
+            # Google is stricter; give it the second half so engines overlap
+            items = "".join(f'<a href="/imgres?imgurl={quote(u, safe="")}&amp;x=1"></a>' for u in urls[len(urls) // 2:])
+        return f"<html><body>{items}</body></html>"
+
+    def _send(self, status: int, kind: str, body: bytes, head: bool = False, length: int = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve(self, head: bool) -> None:
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if len(parts) == 2 and parts[0] in ("bing", "google") and parts[1] in SCENARIOS:
+            time.sleep(SCENARIOS[parts[1]]["page_delay"])
+            self._send(200, "text/html; charset=utf-8", self._page(parts[0], parts[1]).encode(), head)
+        elif len(parts) == 2 and parts[0] == "img":
+            time.sleep(float(query.get("delay", 0)))
+            size = int(query.get("size", 0))
+            status = int(query.get("status", 200))
+            self._send(status, query.get("type", "image/jpeg"), b"\0" * size, head, length=size)
+        else:
+            self._send(404, "text/plain", b"not found", head)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+
+def _base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+class Stub:
+    """The stub servers, running on background threads until `close()`."""
+
+    def __init__(self, image_hosts: int = 4):
+        self.bing = self._start()
+        self.google = self._start()
+        self.image_hosts = [self._start() for _ in range(image_hosts)]
+
+    def _start(self) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        server.daemon_threads = True
+        server.stub = self
+        threading.Thread(target=server.serve_forever, name="image-search-stub", daemon=True).start()
+        return server
+
+    def use(self, scenario: str) -> None:
+        """Point `image_search` at `scenario`."""
+        image_search.BING_URL = f"{_base_url(self.bing)}/bing/{scenario}"
+        image_search.GOOGLE_URL = f"{_base_url(self.google)}/google/{scenario}"
+        for server, real in ((self.bing, "www.bing.com"), (self.google, "www.google.com")):
+            netloc = urlparse(_base_url(server)).netloc
+            image_search.HOST_LIMITS[netloc] = image_search.HOST_LIMITS.get(real, image_search.DEFAULT_HOST_LIMIT)
+
+    def close(self) -> None:
+        for server in [self.bing, self.google, *self.image_hosts]:
+            server.shutdown()
+            server.server_close()
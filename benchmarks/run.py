@@ -0,0 +1,242 @@
+"""MusicDom benchmark runner.
+
+Generates a synthetic library (see `synthetic_library`) and times the hot
+paths of the app against it:
+
+- `scan_cold` / `scan_warm` / `scan_incremental`: `library_index.sync` on a
+  fresh index, with nothing changed, and after retagging 1 % of the files
+  (the list page's scan and mutagen metadata parse);
+- `list_page`: one page of the shared `library_service` library, as the
+  list renders (`list_page_sql`: the same page straight from SQLite);
+- `search_build` / `search_query`: building `search_index` and answering
+  prefix, accent-folded and misspelled queries;
+- `player_payload`: the player's queue payload for the whole list
+  (`play_queue.build` + `play_queue.entries` + JSON);
+- `tag_save`: `tag_writer.apply_edit` on single tracks (tags, index update);
+- `image_search_<scenario>`: `image_search.fetch_image_url` against the local
+  stub (`image_search_stub.SCENARIOS`).
+
+Results are written as JSON (`--output`) together with the commit, Python
+version and parameters, and can be compared with `compare.py`:
+
+    python benchmarks/run.py --count 5000 --layout nested --output new.json
+    python benchmarks/compare.py old.json new.json
+
+Everything runs in a temporary directory (library and MusicDom cache)
+unless `--library` is given.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = (
+    "scan", "list_page", "search", "player_payload", "tag_save", "image_search",
+)
+QUERIES = ("amor", "coracao", "saudade mar", "cancao samba", "estrla", "bossa 1")
+
+
+def timed(fn: Callable[[], object], repeat: int = 1, items: int = 1) -> Dict[str, float]:
+    """Run `fn` `repeat` times; returns timing statistics in seconds."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    best = min(runs)
+    return {
+        "repeat": repeat,
+        "items": items,
+        "min_s": best,
+        "median_s": statistics.median(runs),
+        "max_s": max(runs),
+        "per_item_ms": best / items * 1000 if items else 0.0,
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_scan(library: str, results: dict, recursive: bool) -> None:
+    import library_index
+    import tag_writer
+
+    db = library_index.db_path(library)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db + suffix):
+            os.remove(db + suffix)
+    count = len(library_index._scan(library, recursive))
+    results["scan_cold"] = timed(lambda: library_index.sync(library, recursive), items=count)
+    results["scan_warm"] = timed(lambda: library_index.sync(library, recursive), repeat=3, items=count)
+
+    tracks = library_index.list_tracks(library, recursive=recursive)
+    changed = tracks[::100]
+    for t in changed:
+        tag_writer.write_tags(os.path.join(library, t["relpath"]), {"genre": "Benchmark"})
+    results["scan_incremental"] = timed(lambda: library_index.sync(library, recursive), items=max(1, len(changed)))
+
+
+def bench_list_page(library: str, results: dict, recursive: bool) -> None:
+    import library_index
+    import library_service
+
+    shared = library_service.get(library)
+    total = shared.count(recursive=recursive)
+    offset = max(0, total // 2 - 25)
+    results["list_page"] = timed(
+        lambda: shared.page(limit=50, offset=offset, recursive=recursive), repeat=20, items=50,
+    )
+    results["list_page_sql"] = timed(
+        lambda: library_index.list_tracks(library, limit=50, offset=offset, recursive=recursive),
+        repeat=20, items=50,
+    )
+
+
+def bench_search(library: str, results: dict, recursive: bool) -> None:
+    import library_index
+    import search_index
+
+    total = library_index.count_tracks(library, recursive=recursive)
+    search_index._indexes.clear()
+    results["search_build"] = timed(lambda: search_index.get(library), items=total)
+    index = search_index.get(library)
+    results["search_query"] = timed(
+        lambda: [index.search(q, recursive=recursive) for q in QUERIES], repeat=10, items=len(QUERIES),
+    )
+
+
+def bench_player_payload(library: str, results: dict, recursive: bool) -> None:
+    import library_index
+    import play_queue
+
+    track = library_index.list_tracks(library, limit=1, offset=0, recursive=recursive)[0]
+
+    def payload():
+        relpaths, start = play_queue.build(library, track, play_queue.LIST, recursive=recursive)
+        rows = library_index.get_tracks(library, relpaths)
+        return json.dumps({"fila": play_queue.entries(library, rows), "inicio": start})
+
+    size = len(payload())
+    results["player_payload"] = timed(payload, repeat=5, items=1)
+    results["player_payload"]["bytes"] = size
+
+
+def bench_tag_save(library: str, results: dict, recursive: bool, count: int = 100) -> None:
+    import library_index
+    import tag_writer
+
+    tracks = library_index.list_tracks(library, recursive=recursive)[:count]
+
+    def save():
+        for i, t in enumerate(tracks):
+            tag_writer.apply_edit(library, t["relpath"], {"genre": f"Benchmark {i}", "title": t["title"]})
+
+    results["tag_save"] = timed(save, items=len(tracks))
+
+
+def bench_image_search(results: dict, queries: int) -> None:
+    import image_search
+    import image_search_stub
+
+    stub = image_search_stub.Stub()
+    try:
+        for scenario in image_search_stub.SCENARIOS:
+            stub.use(scenario)
+            found = []
+
+            def lookups():
+                for i in range(queries):
+                    found.append(image_search.fetch_image_url(f"{scenario} album {i}", min_size=40 * 1024, budget=5.0))
+
+            results[f"image_search_{scenario}"] = timed(lookups, items=queries)
+            results[f"image_search_{scenario}"]["found"] = sum(1 for url in found if url)
+    finally:
+        stub.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Time MusicDom hot paths on a synthetic library.")
+    parser.add_argument("--count", type=int, default=2000, help="tracks in the synthetic library")
+    parser.add_argument("--layout", choices=("flat", "nested"), default="nested")
+    parser.add_argument("--formats", default="mp3,flac,ogg,m4a")
+    parser.add_argument("--library", help="use/create the library here instead of a temporary one")
+    parser.add_argument("--only", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--image-queries", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    args = parser.parse_args(argv)
+
+    selected = set(args.only.split(",")) if args.only else set(BENCHMARKS)
+    workdir = tempfile.mkdtemp(prefix="musicdom-bench-")
+    os.environ.setdefault("MUSICDOM_CACHE_DIR", os.path.join(workdir, "cache"))
+    library = args.library or os.path.join(workdir, "library")
+    recursive = args.layout == "nested"
+
+    import synthetic_library
+
+    results: Dict[str, dict] = {}
+    if not os.path.isdir(library) or not os.listdir(library):
+        start = time.perf_counter()
+        written = synthetic_library.generate(library, args.count, args.layout, args.formats.split(","))
+        results["generate"] = {"min_s": time.perf_counter() - start, "items": sum(written.values()), "formats": written}
+
+    if "scan" in selected:
+        bench_scan(library, results, recursive)
+    elif any(b in selected for b in ("list_page", "search", "player_payload", "tag_save")):
+        import library_index
+        library_index.sync(library, recursive)
+    if "list_page" in selected:
+        bench_list_page(library, results, recursive)
+    if "search" in selected:
+        bench_search(library, results, recursive)
+    if "player_payload" in selected:
+        bench_player_payload(library, results, recursive)
+    if "tag_save" in selected:
+        bench_tag_save(library, results, recursive)
+    if "image_search" in selected:
+        bench_image_search(results, args.image_queries)
+
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "count": args.count,
+            "layout": args.layout,
+            "formats": args.formats,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    for name, r in results.items():
+        print(f"{name:32s} {r['min_s'] * 1000:10.1f} ms  {r.get('per_item_ms', 0):8.3f} ms/item")
+    if args.keep:
+        print(f"Files kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
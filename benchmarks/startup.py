@@ -0,0 +1,161 @@
+"""Cold-start report: page import times and time to first render.
+
+Every measurement runs in a fresh interpreter, like a new server process:
+
+- `import`: the module-level imports of each page (`streamlit_app.py`,
+  `list.py`, `player.py`, `downloader.py`), read from the page source and
+  timed together, with Streamlit itself already imported (it is loaded
+  before any page runs);
+- `heavy`: which of the heavy dependencies (mutagen, requests, bs4,
+  tkinter, yt_dlp, numpy) those imports loaded;
+- `first_render`: a fresh process running `streamlit_app.py` once through
+  Streamlit's `AppTest` (imports included), when Streamlit is installed.
+
+`--baseline REV` measures another revision too (checked out in a temporary
+git worktree) and prints both side by side:
+
+    python benchmarks/startup.py --baseline HEAD~1 --output startup.json
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ("streamlit_app.py", "list.py", "player.py", "downloader.py")
+HEAVY = ("mutagen", "requests", "bs4", "tkinter", "yt_dlp", "numpy")
+
+_IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {tree!r})
+try:
+    import streamlit, streamlit.components.v1
+except ImportError:
+    pass
+before = set(sys.modules)
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+loaded = {{m.split(".")[0] for m in set(sys.modules) - before}}
+print(json.dumps({{"seconds": elapsed, "heavy": sorted(loaded & set({heavy!r}))}}))
+"""
+
+_RENDER_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {tree!r})
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=120)
+app.run()
+print(json.dumps({{"seconds": time.perf_counter() - start, "exceptions": len(app.exception)}}))
+"""
+
+
+def page_imports(path: str) -> str:
+    """Module-level import statements of a page (including those in try blocks).
+
+    Imports of streamlit are left out: Streamlit is loaded before any page.
+    """
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    statements = []
+
+    def visit(body) -> None:
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                names = [a.name for a in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+                if not any(n.split(".")[0] == "streamlit" for n in names):
+                    statements.append(ast.get_source_segment(source, node))
+            elif isinstance(node, ast.Try):
+                visit(node.body)
+    visit(tree.body)
+    return "\n".join(
+        f"try:\n    {s}\nexcept ImportError:\n    pass" for s in statements if "__future__" not in s
+    )
+
+
+def _probe(code: str, tree: str, env: Dict[str, str]) -> dict:
+    out = subprocess.run([sys.executable, "-c", code], cwd=tree, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip()[-2000:])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(tree: str, repeat: int) -> Dict[str, dict]:
+    """Best of `repeat` fresh-process runs for every page of `tree`."""
+    env = dict(os.environ, MUSICDOM_WARMUP="0", PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("MUSICDOM_CACHE_DIR", tempfile.mkdtemp(prefix="musicdom-startup-"))
+    results: Dict[str, dict] = {}
+    for page in PAGES:
+        path = os.path.join(tree, page)
+        if not os.path.exists(path):
+            continue
+        code = _IMPORT_PROBE.format(tree=tree, imports=page_imports(path), heavy=HEAVY)
+        runs = [_probe(code, tree, env) for _ in range(repeat)]
+        results[f"import:{page}"] = {"seconds": min(r["seconds"] for r in runs), "heavy": runs[0]["heavy"]}
+    try:
+        import streamlit  # noqa: F401
+    except ImportError:
+        return results
+    code = _RENDER_PROBE.format(tree=tree, app=os.path.join(tree, "streamlit_app.py"))
+    runs = [_probe(code, tree, env) for _ in range(repeat)]
+    results["first_render"] = {"seconds": min(r["seconds"] for r in runs), "heavy": []}
+    return results
+
+
+def _worktree(rev: str) -> str:
+    path = tempfile.mkdtemp(prefix="musicdom-baseline-")
+    subprocess.run(["git", "-C", ROOT, "worktree", "add", "--detach", path, rev],
+                   check=True, capture_output=True)
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure MusicDom cold start.")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+              "current": measure(ROOT, args.repeat)}
+    if args.baseline:
+        tree = _worktree(args.baseline)
+        try:
+            report["baseline"] = {"rev": args.baseline, **measure(tree, args.repeat)}
+        finally:
+            subprocess.run(["git", "-C", ROOT, "worktree", "remove", "--force", tree], capture_output=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = report.get("baseline", {})
+    header = f"{'measurement':28s} {'current':>10s}"
+    if baseline:
+        header += f" {args.baseline:>10s}   change"
+    print(header)
+    for name, r in report["current"].items():
+        line = f"{name:28s} {r['seconds'] * 1000:8.1f}ms"
+        old = baseline.get(name)
+        if old:
+            line += f" {old['seconds'] * 1000:8.1f}ms   {r['seconds'] / old['seconds'] - 1:+7.1%}"
+        print(line)
+        heavy = sorted(set(r["heavy"]) | set(old["heavy"] if old else []))
+        if heavy:
+            print(f"{'':28s} heavy: now {', '.join(r['heavy']) or '-'}"
+                  + (f"; before {', '.join(old['heavy']) or '-'}" if old else ""))
+    if "first_render" not in report["current"]:
+        print("(first render not measured: Streamlit is not installed)")
+
+
+if __name__ == "__main__":
+    main()
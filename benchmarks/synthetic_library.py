@@ -0,0 +1,147 @@
+"""Synthetic music libraries for the benchmarks.
+
+`generate` writes `count` small tagged files (MP3, FLAC, OGG, M4A) in a
+flat folder or a nested `Artist/Album/NN - Title.ext` layout. One short seed
+file per format is encoded with ffmpeg when it is available; without it
+MP3 (silent MPEG frames) and FLAC (STREAMINFO only) seeds are built by hand
+and the other formats are skipped. Every file is a copy of its seed with its
+own tags, written through `tag_writer.write_tags` like the editor does.
+
+Usable on its own:
+
+    python benchmarks/synthetic_library.py /tmp/lib --count 5000 --layout nested
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+from typing import Dict, Iterable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tag_writer  # noqa: E402
+import transcode  # noqa: E402
+
+FORMATS = ("mp3", "flac", "ogg", "m4a")
+LAYOUTS = ("flat", "nested")
+
+# Accented words so searches exercise accent folding
+_WORDS = (
+    "amor coração saudade mar céu sol lua noite dia vento chuva estrela "
+    "canção samba bossa rio cidade sertão menina tempo água fogo terra flor "
+    "caminho sonho luz saudação maré verão inverno alegria lágrima"
+).split()
+_GENRES = ("MPB", "Samba", "Bossa Nova", "Forró", "Rock", "Pop", "Jazz", "Choro")
+
+_FFMPEG_CODECS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "128k"],
+    "flac": ["-c:a", "flac"],
+    "ogg": ["-c:a", "libvorbis", "-q:a", "2"],
+    "m4a": ["-c:a", "aac", "-b:a", "128k"],
+}
+
+
+def _handmade_mp3(seconds: float) -> bytes:
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono: 417-byte frames of silence
+    frame = b"\xff\xfb\x90\xc0" + b"\x00" * 413
+    return frame * max(1, int(seconds * 44100 / 1152))
+
+
+def _handmade_flac(seconds: float) -> bytes:
+    samples = int(seconds * 44100)
+    info = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    info += ((44100 << 44) | (1 << 41) | (15 << 36) | samples).to_bytes(8, "big")
+    info += b"\x00" * 16  # MD5
+    return b"fLaC" + bytes([0x80]) + len(info).to_bytes(3, "big") + info
+
+
+def make_seeds(directory: str, formats: Iterable[str] = FORMATS, seconds: float = 1.0) -> Dict[str, str]:
+    """Create one seed file per format; returns format -> path."""
+    os.makedirs(directory, exist_ok=True)
+    seeds = {}
+    for fmt in formats:
+        path = os.path.join(directory, f"seed.{fmt}")
+        if transcode.ffmpeg_available():
+            cmd = [
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+                "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                *_FFMPEG_CODECS[fmt], path,
+            ]
+            if subprocess.run(cmd, capture_output=True).returncode == 0:
+                seeds[fmt] = path
+                continue
+        if fmt == "mp3":
+            data = _handmade_mp3(seconds)
+        elif fmt == "flac":
+            data = _handmade_flac(seconds)
+        else:
+            continue
+        with open(path, "wb") as f:
+            f.write(data)
+        seeds[fmt] = path
+    return seeds
+
+
+def _title(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4))).capitalize()
+
+
+def generate(root: str, count: int, layout: str = "flat", formats: Iterable[str] = FORMATS,
+             seed: int = 0, tracks_per_album: int = 12, albums_per_artist: int = 4) -> Dict[str, int]:
+    """Fill `root` with `count` tagged tracks; returns files written per format."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}")
+    rng = random.Random(seed)
+    seeds = make_seeds(os.path.join(root, ".seeds"), formats)
+    if not seeds:
+        raise RuntimeError("no seed file could be created (install ffmpeg)")
+    kinds = sorted(seeds)
+    written = {fmt: 0 for fmt in kinds}
+    os.makedirs(root, exist_ok=True)
+    for i in range(count):
+        album_no, track_no = divmod(i, tracks_per_album)
+        artist_no = album_no // albums_per_artist
+        fmt = kinds[i % len(kinds)]
+        artist = f"{_title(random.Random(artist_no * 7919 + seed))} {artist_no}"
+        album = f"{_title(random.Random(album_no * 104729 + seed))} {album_no}"
+        title = _title(rng)
+        name = f"{track_no + 1:02d} - {tag_writer.sanitize_filename(title)}.{fmt}"
+        if layout == "nested":
+            directory = os.path.join(root, tag_writer.sanitize_filename(artist), tag_writer.sanitize_filename(album))
+        else:
+            directory = root
+            name = f"{i:06d} {name}"
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        shutil.copyfile(seeds[fmt], path)
+        tag_writer.write_tags(path, {
+            "title": title,
+            "artist": artist,
+            "album": album,
+            "date": str(1960 + album_no % 60),
+            "genre": _GENRES[artist_no % len(_GENRES)],
+            "tracknumber": f"{track_no + 1}/{tracks_per_album}",
+        })
+        written[fmt] += 1
+    return written
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--layout", choices=LAYOUTS, default="flat")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    written = generate(args.root, args.count, args.layout, args.formats.split(","), args.seed)
+    print(", ".join(f"{n} {fmt}" for fmt, n in written.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Persistent cover-art cache shared by every session of the server.
+
+Resolving a cover through `image_search` costs several seconds of scraping,
+so results are stored in a SQLite database under the MusicDom cache
+directory (`covers.db`) and survive restarts. Entries are keyed by the
+normalized (artist, album) pair, hold the resolved image URL and, optionally,
+the downloaded image bytes so later page loads need no network at all.
+Lookups that found nothing are remembered too, for a shorter time; lookups
+that failed (no search engine answered) are not cached.
+
+The cache is bounded by total size (least recently used entries are evicted
+first) and by age. Configuration (environment variables):
+- `MUSICDOM_COVER_CACHE_MB`: size cap in megabytes (default 200).
+- `MUSICDOM_COVER_CACHE_DAYS`: maximum entry age in days (default 30).
+- `MUSICDOM_COVER_STORE_IMAGES`: set to 0 to keep URLs only.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from contextlib import closing
+from typing import Callable, Optional
+
+import image_search
+import metrics
+import storage
+
+MAX_BYTES = int(float(os.getenv("MUSICDOM_COVER_CACHE_MB", 200)) * 1024 * 1024)
+MAX_AGE = float(os.getenv("MUSICDOM_COVER_CACHE_DAYS", 30)) * 86400
+STORE_IMAGES = os.getenv("MUSICDOM_COVER_STORE_IMAGES", "1") != "0"
+# Lookups that found nothing are retried after this many seconds
+NEGATIVE_TTL = 86400
+# Larger images are cached by URL only
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS covers (
+    key         TEXT PRIMARY KEY,
+    url         TEXT,
+    image       BLOB,
+    size        INTEGER NOT NULL,
+    created     REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS covers_last_access ON covers (last_access);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(os.path.join(storage.data_dir(), "covers.db"), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def cover_key(artist: str, album: str) -> str:
+    return f"{normalize(artist)}\x1f{normalize(album)}"
+
+
+def get(artist: str, album: str) -> Optional[dict]:
+    """Return the cached entry ({"url", "image"}) or None on a miss.
+
+    A cached failed lookup is returned as an entry whose url is None.
+    """
+    key = cover_key(artist, album)
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        row = conn.execute("SELECT url, image, created FROM covers WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            metrics.cache("cover", hit=False)
+            return None
+        ttl = MAX_AGE if row["url"] else NEGATIVE_TTL
+        if now - row["created"] > ttl:
+            conn.execute("DELETE FROM covers WHERE key = ?", (key,))
+            metrics.cache("cover", hit=False)
+            return None
+        conn.execute("UPDATE covers SET last_access = ? WHERE key = ?", (now, key))
+    metrics.cache("cover", hit=True)
+    return {"url": row["url"], "image": row["image"]}
+
+
+def put(artist: str, album: str, url: Optional[str], image: Optional[bytes] = None) -> None:
+    """Store a lookup result (url None records a failed lookup) and evict."""
+    now = time.time()
+    size = len(image or b"") + len(url or "")
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO covers (key, url, image, size, created, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (cover_key(artist, album), url, image, size, now, now),
+        )
+        _evict(conn, now)
+
+
+def _evict(conn: sqlite3.Connection, now: float) -> None:
+    conn.execute("DELETE FROM covers WHERE created < ?", (now - MAX_AGE,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM covers").fetchone()[0]
+    if total <= MAX_BYTES:
+        return
+    for row in conn.execute("SELECT key, size FROM covers ORDER BY last_access").fetchall():
+        conn.execute("DELETE FROM covers WHERE key = ?", (row["key"],))
+        total -= row["size"]
+        if total <= MAX_BYTES:
+            break
+
+
+def download(url: str) -> Optional[bytes]:
+    """Fetch image bytes for caching; None if too large or not an image."""
+    try:
+        with image_search.request("GET", url, timeout=8, stream=True) as r:
+            if r.status_code != 200 or not r.headers.get("content-type", "").startswith("image"):
+                return None
+            data = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > MAX_IMAGE_BYTES:
+                    return None
+            return bytes(data)
+    except Exception:
+        return None
+
+
+def get_or_fetch(artist: str, album: str, fetch_url: Callable[[], Optional[str]]):
+    """Return cached image bytes or URL for (artist, album), resolving misses.
+
+    `fetch_url` is only called on a cache miss. Returns None when no cover
+    could be found (that result is cached as well) or when the lookup failed
+    with `image_search.LookupFailed` (not cached, retried on the next call).
+    """
+    cached = get(artist, album)
+    if cached is None:
+        try:
+            url = fetch_url()
+        except image_search.LookupFailed:
+            return None
+        image = download(url) if url and STORE_IMAGES else None
+        put(artist, album, url, image)
+        cached = {"url": url, "image": image}
+    return cached["image"] or cached["url"]
@@ -0,0 +1,60 @@
+"""Background cover-art prefetching for the library list.
+
+`prefetch(root, tracks)` queues cover resolution (`artwork.cover_for_track`)
+for a batch of index rows on a process-wide worker pool and returns at once,
+so by the time a track is opened in the player its cover is already in the
+thumbnail or `cover_cache` and no scraping happens on the page. Tracks that
+share a cover key (same artist and album) are resolved once, and requests
+already queued or running are not queued again. Rate limiting towards the
+search engines is handled per host by `image_search`.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Set
+
+import artwork
+import cover_cache
+
+PREFETCH_WORKERS = int(os.getenv("MUSICDOM_PREFETCH_WORKERS", 4))
+
+_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="cover-prefetch")
+_in_flight: Set[str] = set()
+_lock = threading.Lock()
+
+
+def _key(track: dict) -> str:
+    title = track["title"] or os.path.splitext(track["name"])[0]
+    return cover_cache.cover_key(track["artist"] or "Desconhecido", track["album"] or title)
+
+
+def _resolve(root: str, track: dict, key: str) -> None:
+    try:
+        artwork.cover_for_track(root, track)
+    except Exception:
+        pass
+    finally:
+        with _lock:
+            _in_flight.discard(key)
+
+
+def prefetch(root: str, tracks: Iterable[dict]) -> int:
+    """Queue cover resolution for `tracks`; returns how many were queued."""
+    queued = 0
+    for track in tracks:
+        key = _key(track)
+        with _lock:
+            if key in _in_flight:
+                continue
+            _in_flight.add(key)
+        _pool.submit(_resolve, root, track, key)
+        queued += 1
+    return queued
+
+
+def pending() -> int:
+    """Number of cover lookups queued or running."""
+    with _lock:
+        return len(_in_flight)
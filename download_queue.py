@@ -0,0 +1,346 @@
+"""Server-side download queue for the downloader page.
+
+Downloads run on a pool of worker threads owned by the server process
+(`DOWNLOAD_WORKERS`, configurable through `MUSICDOM_DOWNLOAD_WORKERS`), not
+inside the Streamlit script run, so they keep going while the user switches
+pages or reloads. Each submitted URL becomes a `Job`; playlists are expanded
+into one job per entry. Progress is reported through yt-dlp progress and
+postprocessor hooks and can be read at any time with `jobs()`.
+
+Already downloaded items are skipped before any network extraction: every
+finished download (after its conversion succeeded) is recorded in an archive
+file in the target directory (`ARCHIVE_NAME`, in yt-dlp's download-archive
+format) and its source id is written into the file's tags
+(`library_index.SOURCE_FIELD`), so a track is still recognized through the
+library index after being renamed or copied. Re-submitting a large playlist
+only costs one flat playlist listing.
+
+Conversion is not done by yt-dlp: once a file is downloaded the job is handed
+to `transcode`, which remuxes or re-encodes it on its own CPU-bound pool
+while the download worker moves on to the next item.
+"""
+from __future__ import annotations
+
+import importlib.util
+import itertools
+import os
+import queue
+import re
+import threading
+import time
+from typing import List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+import library_index
+import transcode
+
+DOWNLOAD_WORKERS = int(os.getenv("MUSICDOM_DOWNLOAD_WORKERS", 2))
+# Finished jobs kept for display
+MAX_FINISHED = 200
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PROCESSING = "processing"
+DONE = "done"
+ERROR = "error"
+SKIPPED = "skipped"
+
+ARCHIVE_NAME = ".musicdom-archive.txt"
+
+_YOUTUBE_ID = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([0-9A-Za-z_-]{11})"
+)
+
+_ids = itertools.count(1)
+_queue: "queue.Queue[Job]" = queue.Queue()
+_jobs: List["Job"] = []
+_lock = threading.Lock()
+_workers: List[threading.Thread] = []
+
+
+class Job:
+    def __init__(self, url: str, out_dir: str, title: Optional[str] = None,
+                 audio_format: str = transcode.MP3):
+        self.id = next(_ids)
+        self.url = url
+        self.out_dir = out_dir
+        self.audio_format = audio_format
+        self.title = title or url
+        self.status = QUEUED
+        # 0.0 - 1.0 of the current download
+        self.progress = 0.0
+        self.speed: Optional[float] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.source_id = source_id_from_url(url)
+        self.filepath: Optional[str] = None
+        self.acodec: Optional[str] = None
+        # Entry of an expanded playlist: downloaded straight from its URL
+        self.from_playlist = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, ERROR, SKIPPED)
+
+
+def source_id_from_url(url: str) -> Optional[str]:
+    """Archive-style id ("youtube <id>") derived from the URL alone.
+
+    Only single-video URLs have one: a watch URL with a `list=` parameter
+    stands for the whole playlist, whose entries are checked one by one
+    once it is expanded.
+    """
+    if "list" in parse_qs(urlparse(url).query):
+        return None
+    m = _YOUTUBE_ID.search(url)
+    return f"youtube {m.group(1)}" if m else None
+
+
+def _archive_path(out_dir: str) -> str:
+    return os.path.join(out_dir, ARCHIVE_NAME)
+
+
+_archive_cache: dict = {}
+_archive_lock = threading.Lock()
+
+
+def _archive_ids(out_dir: str) -> Set[str]:
+    path = _archive_path(out_dir)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return set()
+    cached = _archive_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, encoding="utf-8") as f:
+        ids = {line.strip() for line in f if line.strip()}
+    _archive_cache[path] = (mtime, ids)
+    return ids
+
+
+def _record_archive(out_dir: str, source_id: str) -> None:
+    """Append `source_id` to the download archive of `out_dir`."""
+    with _archive_lock:
+        try:
+            if source_id not in _archive_ids(out_dir):
+                with open(_archive_path(out_dir), "a", encoding="utf-8") as f:
+                    f.write(source_id + "\n")
+        except OSError:
+            # The source id in the file's tags still identifies it
+            pass
+
+
+def already_downloaded(source_id: Optional[str], out_dir: str) -> bool:
+    """Check the download archive and the library index for `source_id`."""
+    if not source_id:
+        return False
+    if source_id in _archive_ids(out_dir):
+        return True
+    try:
+        return os.path.isdir(out_dir) and library_index.has_source(out_dir, source_id)
+    except Exception:
+        return False
+
+
+def _tag_source(filepath: str, source_id: str) -> None:
+    """Store the source id in the downloaded file's tags."""
+    try:
+        audio = library_index.load_mutagen().File(filepath, easy=True)
+        if audio is None:
+            return
+        if audio.tags is None:
+            audio.add_tags()
+        audio[library_index.SOURCE_FIELD] = [source_id]
+        audio.save()
+    except Exception:
+        pass
+
+
+def _ydl_opts(job: Job) -> dict:
+    def on_progress(d):
+        if d.get("status") == "downloading":
+            job.status = DOWNLOADING
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if total:
+                job.progress = min(1.0, d.get("downloaded_bytes", 0) / total)
+            job.speed = d.get("speed")
+        elif d.get("status") == "finished":
+            job.progress = 1.0
+            info = d.get("info_dict") or {}
+            job.filepath = d.get("filename") or job.filepath
+            job.acodec = info.get("acodec") or job.acodec
+            if info.get("extractor_key") and info.get("id"):
+                job.source_id = f"{info['extractor_key'].lower()} {info['id']}"
+
+    def on_postprocess(d):
+        if d.get("status") == "started":
+            job.status = PROCESSING
+        elif d.get("status") == "finished":
+            # The last postprocessor to finish reports the final file
+            info = d.get("info_dict") or {}
+            job.filepath = info.get("filepath") or job.filepath
+            job.acodec = info.get("acodec") or job.acodec
+            if info.get("extractor_key") and info.get("id"):
+                job.source_id = f"{info['extractor_key'].lower()} {info['id']}"
+
+    return {
+        'format': 'bestaudio/best',
+        'outtmpl': f"{job.out_dir}/%(title)s.%(ext)s",
+        'progress_hooks': [on_progress],
+        'postprocessor_hooks': [on_postprocess],
+        'quiet': True,
+        'noprogress': True,
+    }
+
+
+def _expand(job: Job, ydl) -> Optional[dict]:
+    """Split a playlist job into one job per entry.
+
+    Returns the extracted info of a single video, to be downloaded with
+    `ydl.process_ie_result` without extracting it again, or None when the
+    job was a playlist (or nothing was found).
+    """
+    info = ydl.extract_info(job.url, download=False)
+    if not info or info.get("_type") != "playlist":
+        if info and info.get("title"):
+            job.title = info["title"]
+        return info
+    # The playlist itself is never recorded; its entries are
+    job.source_id = None
+    entries = [e for e in info.get("entries") or [] if e]
+    skipped = 0
+    for entry in entries:
+        url = entry.get("url") or entry.get("webpage_url")
+        if not url:
+            continue
+        source_id = None
+        if entry.get("ie_key") and entry.get("id"):
+            source_id = f"{entry['ie_key'].lower()} {entry['id']}"
+        if already_downloaded(source_id or source_id_from_url(url), job.out_dir):
+            skipped += 1
+            continue
+        entry_job = Job(url, job.out_dir, entry.get("title"), job.audio_format)
+        entry_job.source_id = source_id or entry_job.source_id
+        entry_job.from_playlist = True
+        _enqueue(entry_job)
+    job.title = f"Playlist: {info.get('title') or job.url} ({len(entries)} itens"
+    job.title += f", {skipped} já baixados)" if skipped else ")"
+    job.progress = 1.0
+    job.status = DONE
+    return None
+
+
+def _run(job: Job) -> None:
+    try:
+        # Fast path: known video, no network at all
+        if already_downloaded(job.source_id, job.out_dir):
+            job.progress = 1.0
+            job.status = SKIPPED
+            return
+        from yt_dlp import YoutubeDL
+        with YoutubeDL({**_ydl_opts(job), 'extract_flat': 'in_playlist'}) as ydl:
+            if job.from_playlist:
+                # Flat entry of a playlist: one extraction, by the download
+                job.status = DOWNLOADING
+                ydl.download([job.url])
+            else:
+                # One extraction for both the playlist check and the download
+                info = _expand(job, ydl)
+                if info is None:
+                    return
+                if info.get("extractor_key") and info.get("id"):
+                    job.source_id = f"{info['extractor_key'].lower()} {info['id']}"
+                    if already_downloaded(job.source_id, job.out_dir):
+                        job.progress = 1.0
+                        job.status = SKIPPED
+                        return
+                job.status = DOWNLOADING
+                ydl.process_ie_result(info, download=True)
+        if not job.filepath:
+            # Nothing was downloaded (e.g. yt-dlp found the file already there)
+            job.progress = 1.0
+            job.status = SKIPPED
+            return
+        job.status = PROCESSING
+        transcode.submit(job.filepath, job.audio_format, job.acodec).add_done_callback(
+            lambda future: _finish(job, future)
+        )
+    except Exception as e:
+        job.error = str(e)
+        job.status = ERROR
+
+
+def _finish(job: Job, future) -> None:
+    try:
+        job.filepath = future.result()
+        if job.source_id:
+            _tag_source(job.filepath, job.source_id)
+            # Only now: a failed conversion must not mark the item as downloaded
+            _record_archive(job.out_dir, job.source_id)
+        job.progress = 1.0
+        job.status = DONE
+    except Exception as e:
+        job.error = str(e)
+        job.status = ERROR
+
+
+def _worker() -> None:
+    while True:
+        job = _queue.get()
+        try:
+            _run(job)
+        finally:
+            _queue.task_done()
+
+
+def _enqueue(job: Job) -> None:
+    with _lock:
+        _jobs.append(job)
+        finished = [j for j in _jobs if j.finished]
+        for old in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            _jobs.remove(old)
+        while len(_workers) < DOWNLOAD_WORKERS:
+            t = threading.Thread(target=_worker, name=f"musicdom-download-{len(_workers) + 1}", daemon=True)
+            t.start()
+            _workers.append(t)
+    _queue.put(job)
+
+
+def available() -> bool:
+    """Whether yt-dlp is installed (checked without importing it).
+
+    yt-dlp takes a long time to import, so it is only loaded by the download
+    workers, once a download actually starts.
+    """
+    return importlib.util.find_spec("yt_dlp") is not None
+
+
+def submit(urls: List[str], out_dir: str = '.', audio_format: str = transcode.MP3) -> List[Job]:
+    """Queue one job per URL (playlists are expanded by the workers).
+
+    `audio_format` is `transcode.MP3` or `transcode.NATIVE` (keep the source
+    codec, remux only).
+    """
+    if not available():
+        raise RuntimeError("Pacote 'yt-dlp' não está instalado. Instale com 'pip install yt-dlp'.")
+    urls = [u.strip() for u in urls if u and u.strip()]
+    if not urls:
+        raise ValueError("URL vazia")
+    submitted = []
+    for url in urls:
+        job = Job(url, out_dir, audio_format=audio_format)
+        _enqueue(job)
+        submitted.append(job)
+    return submitted
+
+
+def jobs() -> List[Job]:
+    """All known jobs, most recent first."""
+    with _lock:
+        return list(reversed(_jobs))
+
+
+def clear_finished() -> None:
+    with _lock:
+        _jobs[:] = [j for j in _jobs if not j.finished]
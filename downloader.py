@@ -1,41 +1,47 @@
 import streamlit as st
 import shutil
+import download_queue
+import transcode
 
-try:
-    from yt_dlp import YoutubeDL
-except ImportError:
-    YoutubeDL = None
+STATUS_LABELS = {
+    download_queue.QUEUED: "Na fila",
+    download_queue.DOWNLOADING: "Baixando",
+    download_queue.PROCESSING: "Convertendo",
+    download_queue.DONE: "Concluído",
+    download_queue.ERROR: "Erro",
+    download_queue.SKIPPED: "Já baixado",
+}
 
 
-def download_audio(yt_url: str, out_dir: str = '.') -> None:
-    if not YoutubeDL:
-        raise RuntimeError("Pacote 'yt-dlp' não está instalado. Instale com 'pip install yt-dlp'.")
-    if not yt_url:
-        raise ValueError("URL vazia")
+# Lista de downloads, atualizada a cada segundo sem recarregar a página
+@st.fragment(run_every=1)
+def download_list():
+    jobs = download_queue.jobs()
+    if not jobs:
+        st.caption("Nenhum download na fila.")
+        return
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': f"{out_dir}/%(title)s.%(ext)s",
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-    }
+    ativos = sum(1 for j in jobs if not j.finished)
+    header_cols = st.columns([4, 1])
+    header_cols[0].subheader(f"Downloads ({ativos} em andamento)" if ativos else "Downloads")
+    if header_cols[1].button("Limpar concluídos", use_container_width=True):
+        download_queue.clear_finished()
+        st.rerun(scope="fragment")
 
-    if not shutil.which("ffmpeg"):
-        st.warning("FFmpeg não encontrado no PATH. A conversão para MP3 pode falhar; instale FFmpeg se precisar de MP3.")
-
-    with YoutubeDL(ydl_opts) as ydl:
-        ydl.download([yt_url])
+    for job in jobs:
+        label = STATUS_LABELS.get(job.status, job.status)
+        if job.status == download_queue.DOWNLOADING and job.speed:
+            label += f" · {job.speed / 1024:.0f} KB/s"
+        st.progress(job.progress, text=f"**{job.title}** — {label}")
+        if job.error:
+            st.error(job.error)
 
 
 st.set_page_config(layout="wide")
 st.title("Baixador de músicas")
 
-yt_url = st.text_input(
-    "Copie a url da música que deseja baixar (apenas YouTube atualmente)",
+yt_urls = st.text_area(
+    "Cole as urls das músicas ou playlists que deseja baixar, uma por linha (apenas YouTube atualmente)",
     placeholder="ex: https://www.youtube.com/watch?v=dQw4w9WgXcQ",
 )
 
@@ -43,15 +49,28 @@ yt_url = st.text_input(
 default_dir = st.session_state.get("path", ".")
 out_dir = st.text_input("Salvar em (diretório)", value=default_dir)
 
+audio_format = st.radio(
+    "Formato",
+    [transcode.NATIVE, transcode.MP3],
+    format_func=lambda f: {
+        transcode.NATIVE: "Original (sem recodificar, mais rápido)",
+        transcode.MP3: "MP3 192 kbps",
+    }[f],
+    horizontal=True,
+)
+
+if not shutil.which("ffmpeg"):
+    st.warning("FFmpeg não encontrado no PATH. A conversão pode falhar; instale FFmpeg para converter ou remuxar o áudio.")
+
 if st.button("Baixar"):
-    if not yt_url:
+    if not yt_urls.strip():
         st.warning("Cole a URL antes de clicar em 'Baixar'.")
     else:
         try:
-            st.write("Você pode trocar de página durante o download.")
-            with st.spinner("Iniciando download..."):
-                download_audio(yt_url, out_dir=out_dir)
-            st.success("Download concluído com sucesso.")
+            jobs = download_queue.submit(yt_urls.splitlines(), out_dir=out_dir, audio_format=audio_format)
+            st.success(f"{len(jobs)} download{'s' if len(jobs) != 1 else ''} adicionado{'s' if len(jobs) != 1 else ''} à fila. Você pode trocar de página durante o download.")
         except Exception as e:
             st.error(f"Erro ao baixar: {e}")
-            st.exception(e)
\ No newline at end of file
+            st.exception(e)
+
+download_list()
@@ -0,0 +1,284 @@
+"""Duplicate track detection by audio payload.
+
+Copies of the same recording often differ only in their tags or file name
+(re-downloads, retagged or renamed copies), so files are compared by their
+audio payload alone: `payload_ranges` locates the audio data of a file and
+skips ID3v2/ID3v1/APEv2 tags, FLAC metadata blocks, Ogg header pages (Vorbis
+comments, which also carry cover art), the MP4 atoms around `mdat` and the
+RIFF chunks around a WAV `data` chunk. Ogg page headers are left out too,
+since their sequence numbers and checksums change when the comment packet
+grows.
+
+Candidates are narrowed in three stages, each only over the files that
+still collide:
+
+1. payload size;
+2. a partial hash of the first and last `PARTIAL_BYTES` of the payload;
+3. a hash of the whole payload.
+
+Files are read through mmap on a thread pool (`HASH_WORKERS`); hashlib
+releases the GIL while hashing, and no process is forked from the
+Streamlit server while its other threads run.
+Every value computed is cached per file in the library index database,
+keyed by path, size and mtime, so later runs only read new or changed
+files; a renamed file (a path that vanished, replaced by one with the same
+size and mtime) keeps its cached values.
+"""
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from itertools import repeat
+from typing import Dict, Iterator, List, Tuple
+
+import library_index
+
+HASH_WORKERS = int(os.getenv("MUSICDOM_HASH_WORKERS", os.cpu_count() or 1))
+PARTIAL_BYTES = 64 * 1024
+
+# Cached per-file results; NULL until the stage that computes it has run.
+# payload_size is -1 for files that could not be read.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_hashes (
+    relpath      TEXT PRIMARY KEY,
+    size         INTEGER NOT NULL,
+    mtime_ns     INTEGER NOT NULL,
+    payload_size INTEGER,
+    partial      TEXT,
+    full         TEXT
+);
+"""
+
+Ranges = List[Tuple[int, int]]
+
+
+def _id3v2_end(data, pos: int = 0) -> int:
+    """Skip (possibly repeated) ID3v2 tags starting at `pos`."""
+    while len(data) >= pos + 10 and data[pos:pos + 3] == b"ID3":
+        b = data[pos + 6:pos + 10]
+        size = (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+        footer = 10 if data[pos + 5] & 0x10 else 0
+        pos += 10 + size + footer
+    return min(pos, len(data))
+
+
+def _trailing_tags_start(data, start: int) -> int:
+    """Offset where ID3v1/APEv2 tags at the end of the file begin."""
+    end = len(data)
+    while end > start:
+        if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+            end -= 128
+        elif end - start >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+            size = int.from_bytes(data[end - 20:end - 16], "little")
+            flags = int.from_bytes(data[end - 12:end - 8], "little")
+            end -= size + (32 if flags & 0x80000000 else 0)
+        else:
+            break
+    return max(end, start)
+
+
+def _flac_ranges(data, pos: int) -> Ranges:
+    pos += 4
+    while pos + 4 <= len(data):
+        header = data[pos]
+        pos += 4 + int.from_bytes(data[pos + 1:pos + 4], "big")
+        if header & 0x80:
+            break
+    pos = min(pos, len(data))
+    return [(pos, _trailing_tags_start(data, pos))]
+
+
+def _ogg_ranges(data) -> Ranges:
+    # Header packets end on a page with granule position 0 (or -1 for pages
+    # a long comment packet continues over); audio starts with the first
+    # page carrying a positive granule position.
+    ranges, pos, in_audio = [], 0, False
+    while pos + 27 <= len(data) and data[pos:pos + 4] == b"OggS":
+        granule = int.from_bytes(data[pos + 6:pos + 14], "little", signed=True)
+        segments = data[pos + 26]
+        body = pos + 27 + segments
+        end = min(body + sum(data[pos + 27:body]), len(data))
+        in_audio = in_audio or granule > 0
+        if in_audio and end > body:
+            ranges.append((body, end))
+        pos = end
+    return ranges
+
+
+def _mp4_ranges(data) -> Ranges:
+    ranges, pos = [], 0
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos:pos + 4], "big")
+        kind = data[pos + 4:pos + 8]
+        header = 8
+        if size == 1 and pos + 16 <= len(data):
+            size, header = int.from_bytes(data[pos + 8:pos + 16], "big"), 16
+        elif size == 0:
+            size = len(data) - pos
+        if size < header:
+            break
+        if kind == b"mdat":
+            ranges.append((pos + header, min(pos + size, len(data))))
+        pos += size
+    return ranges
+
+
+def _wav_ranges(data) -> Ranges:
+    pos = 12
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos + 4:pos + 8], "little")
+        if data[pos:pos + 4] == b"data":
+            return [(pos + 8, min(pos + 8 + size, len(data)))]
+        pos += 8 + size + (size & 1)
+    return []
+
+
+def payload_ranges(data) -> Ranges:
+    """Return the (start, end) byte ranges holding the audio of a file.
+
+    `data` is the whole file as a bytes-like object (typically an mmap).
+    Unknown layouts fall back to the file minus any ID3/APE tags.
+    """
+    start = _id3v2_end(data)
+    magic = data[start:start + 4]
+    ranges = None
+    if magic == b"fLaC":
+        ranges = _flac_ranges(data, start)
+    elif magic == b"OggS":
+        ranges = _ogg_ranges(data)
+    elif data[4:8] == b"ftyp":
+        ranges = _mp4_ranges(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        ranges = _wav_ranges(data)
+    if not ranges:
+        ranges = [(start, _trailing_tags_start(data, start))]
+    return [(a, b) for a, b in ranges if b > a]
+
+
+def _pieces(ranges: Ranges, start: int, stop: int) -> Iterator[Tuple[int, int]]:
+    """File ranges covering payload offsets [start, stop)."""
+    offset = 0
+    for a, b in ranges:
+        lo, hi = max(start, offset), min(stop, offset + b - a)
+        if lo < hi:
+            yield a + lo - offset, a + hi - offset
+        offset += b - a
+
+
+def _digest(filepath: str, stage: str):
+    """Compute one stage value ("payload_size", "partial" or "full")."""
+    try:
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return -1 if stage == "payload_size" else None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ranges = payload_ranges(mm)
+                total = sum(b - a for a, b in ranges)
+                if stage == "payload_size":
+                    return total
+                if stage == "partial":
+                    head = _pieces(ranges, 0, PARTIAL_BYTES)
+                    tail = _pieces(ranges, max(PARTIAL_BYTES, total - PARTIAL_BYTES), total)
+                    pieces = [*head, *tail]
+                else:
+                    pieces = ranges
+                h = hashlib.blake2b(digest_size=16)
+                with memoryview(mm) as view:
+                    for a, b in pieces:
+                        h.update(view[a:b])
+                return h.hexdigest()
+    except (OSError, ValueError):
+        return -1 if stage == "payload_size" else None
+
+
+def _fill(root: str, entries: Dict[str, dict], relpaths: List[str], stage: str) -> None:
+    """Compute `stage` for the given entries that do not have it cached."""
+    todo = [r for r in relpaths if entries[r][stage] is None]
+    paths = [os.path.join(root, r) for r in todo]
+    if len(todo) <= 1 or HASH_WORKERS <= 1:
+        results = [_digest(p, stage) for p in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="musicdom-hash") as pool:
+            results = list(pool.map(_digest, paths, repeat(stage)))
+    for relpath, value in zip(todo, results):
+        entries[relpath][stage] = value
+
+
+def _collisions(entries: Dict[str, dict], relpaths: List[str], *fields: str) -> List[List[str]]:
+    buckets: Dict[tuple, List[str]] = {}
+    for relpath in relpaths:
+        key = tuple(entries[relpath][f] for f in fields)
+        if None not in key:
+            buckets.setdefault(key, []).append(relpath)
+    return [group for group in buckets.values() if len(group) > 1]
+
+
+def _connect(root: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(library_index.db_path(root), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def find_duplicates(root: str, recursive: bool = True) -> List[List[dict]]:
+    """Group the indexed tracks of `root` whose audio payload is identical.
+
+    Returns lists of index rows (see `library_index.list_tracks`), each with
+    at least two tracks, largest groups first.
+    """
+    tracks = {t["relpath"]: t for t in library_index.list_tracks(root, recursive=recursive)}
+    with closing(_connect(root)) as conn:
+        cached = {r["relpath"]: dict(r) for r in conn.execute("SELECT * FROM audio_hashes")}
+        # Rows of files that no longer exist, by (size, mtime): a new file
+        # with the same signature is taken as renamed (as in
+        # `library_index.sync`). Files that still exist never lend their
+        # values, since equal size and mtime alone do not mean equal audio.
+        vanished = {
+            (r["size"], r["mtime_ns"]): r for relpath, r in cached.items()
+            if relpath not in tracks and not os.path.exists(os.path.join(root, relpath))
+        }
+        entries = {}
+        for relpath, t in tracks.items():
+            signature = (t["size"], t["mtime_ns"])
+            row = cached.get(relpath)
+            if row is None:
+                row = vanished.pop(signature, None)
+            elif (row["size"], row["mtime_ns"]) != signature:
+                row = None
+            entries[relpath] = {
+                "size": t["size"], "mtime_ns": t["mtime_ns"],
+                "payload_size": row["payload_size"] if row else None,
+                "partial": row["partial"] if row else None,
+                "full": row["full"] if row else None,
+            }
+
+        candidates = list(entries)
+        _fill(root, entries, candidates, "payload_size")
+        candidates = [
+            r for group in _collisions(entries, candidates, "payload_size")
+            for r in group if entries[r]["payload_size"] > 0
+        ]
+        _fill(root, entries, candidates, "partial")
+        candidates = [r for group in _collisions(entries, candidates, "payload_size", "partial") for r in group]
+        _fill(root, entries, candidates, "full")
+        groups = _collisions(entries, candidates, "payload_size", "full")
+
+        with conn:
+            if recursive:
+                conn.execute("DELETE FROM audio_hashes")
+            conn.executemany(
+                "INSERT OR REPLACE INTO audio_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                [(r, e["size"], e["mtime_ns"], e["payload_size"], e["partial"], e["full"])
+                 for r, e in entries.items()],
+            )
+
+    result = [
+        sorted((tracks[r] for r in group), key=lambda t: (t["dir"].lower(), t["name"].lower()))
+        for group in groups
+    ]
+    result.sort(key=lambda g: (-len(g), g[0]["dir"].lower(), g[0]["name"].lower()))
+    return result
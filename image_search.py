@@ -4,23 +4,146 @@ Provides a single function `fetch_image_url(query, min_size=...)` that tries
 multiple search engines (Bing and Google image search) to collect candidate
 image URLs and picks a high-quality candidate by validating image headers
 (Content-Type + Content-Length) with lightweight HEAD requests.
+
+All engines in `ENGINES` are queried concurrently and every candidate they
+yield goes straight to validation, which runs on a small shared thread pool
+(each worker reusing keep-alive connections through its own
+`requests.Session`). A single latency budget covers the whole call. More
+sources can be plugged in by appending a `fn(query, timeout)` generator of
+image URLs to `ENGINES`; earlier engines are preferred on ties.
+
+Every outgoing request passes through a per-host limiter (`HOST_LIMITS`)
+that caps concurrent requests and spaces them out, so bulk lookups such as
+the cover prefetcher do not get us blocked by the search engines.
+
+`requests` and BeautifulSoup are imported on the first lookup rather than
+with this module, which every page imports through the cover cache.
+
+A lookup where no engine answered at all (timeouts, DNS errors, HTTP 429...)
+raises `LookupFailed` instead of returning None, so callers can tell it
+apart from a search that simply found nothing and avoid caching it.
 """
 from __future__ import annotations
 
 import json
+import queue
+import threading
 import time
-import requests
-from bs4 import BeautifulSoup as bs
-from typing import Iterable, Optional
-from urllib.parse import urlparse, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse, unquote
+
+import metrics
+
+if TYPE_CHECKING:
+    import requests
 
 # Reasonable default headers to avoid immediate blocking
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
 
-def _candidates_from_bing(query: str) -> Iterable[str]:
+BING_URL = "https://www.bing.com/images/search"
+GOOGLE_URL = "https://www.google.com/search"
+
+# Concurrent HEAD requests across all lookups
+VALIDATION_WORKERS = 8
+# Seconds a whole fetch_image_url call may take, engines plus validation
+DEFAULT_BUDGET = 15.0
+# Upper bound for a single engine request
+ENGINE_TIMEOUT = 8.0
+
+_validation_pool = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix="image-validate")
+_engine_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="image-engine")
+_local = threading.local()
+
+# host -> (max concurrent requests, min seconds between request starts)
+HOST_LIMITS: Dict[str, Tuple[int, float]] = {
+    "www.bing.com": (2, 1.0),
+    "www.google.com": (1, 2.0),
+}
+DEFAULT_HOST_LIMIT = (4, 0.0)
+
+
+class LookupFailed(Exception):
+    """No search engine answered; the query may succeed later."""
+
+
+class _HostLimiter:
+    def __init__(self, concurrency: int, interval: float):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._slots.acquire()
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc):
+        self._slots.release()
+
+
+_limiters: Dict[str, _HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter(url: str) -> _HostLimiter:
+    host = urlparse(url).netloc.lower()
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = _HostLimiter(*HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT))
+        return limiter
+
+
+def _session() -> requests.Session:
+    """Per-thread session so HEAD requests reuse pooled connections."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request through the pooled session and the host's limiter.
+
+    The time spent waiting for the limiter and the request latency are
+    recorded per host in `metrics`.
+    """
+    host = urlparse(url).netloc.lower()
+    queued = time.perf_counter()
+    with _limiter(url):
+        start = time.perf_counter()
+        metrics.observe("http_wait_seconds", start - queued, host=host)
+        status = "error"
+        try:
+            response = _session().request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - start, host=host, method=method)
+            metrics.count("http_requests_total", host=host, status=status)
+
+
+def _candidates_from_bing(query: str, timeout: float = ENGINE_TIMEOUT) -> Iterable[str]:
+    # Request errors propagate: they tell a failed engine from an empty result
+    r = request("GET", BING_URL, params={"q": query}, timeout=timeout)
+    r.raise_for_status()
     try:
-        params = {"q": query}
-        r = requests.get("https://www.bing.com/images/search", params=params, headers=HEADERS, timeout=8)
+        from bs4 import BeautifulSoup as bs
         soup = bs(r.content, "html.parser")
         # Bing stores metadata in a JSON 'm' attribute on <a class="iusc"> elements
         for a in soup.select("a.iusc"):
@@ -43,10 +166,11 @@ def _candidates_from_bing(query: str) -> Iterable[str]:
         return
 
 
-def _candidates_from_google(query: str) -> Iterable[str]:
+def _candidates_from_google(query: str, timeout: float = ENGINE_TIMEOUT) -> Iterable[str]:
+    r = request("GET", GOOGLE_URL, params={"q": query, "tbm": "isch"}, timeout=timeout)
+    r.raise_for_status()
     try:
-        params = {"q": query, "tbm": "isch"}
-        r = requests.get("https://www.google.com/search", params=params, headers=HEADERS, timeout=8)
+        from bs4 import BeautifulSoup as bs
         soup = bs(r.content, "html.parser")
         # Try common attributes that may contain full-size image URLs
         for img in soup.select("img"):
@@ -76,7 +200,7 @@ def _validate_image(url: str, min_size: int = 30 * 1024) -> Optional[int]:
     content-types.
     """
     try:
-        head = requests.head(url, headers=HEADERS, timeout=8, allow_redirects=True)
+        head = request("HEAD", url, timeout=8, allow_redirects=True)
         ct = head.headers.get("content-type", "")
         if not ct.startswith("image"):
             return None
@@ -96,46 +220,136 @@ def _validate_image(url: str, min_size: int = 30 * 1024) -> Optional[int]:
         return None
 
 
-def fetch_image_url(query: str, min_size: int = 30 * 1024, max_candidates: int = 40) -> Optional[str]:
+# Candidate sources, in order of preference
+ENGINES: List[Callable[..., Iterable[str]]] = [_candidates_from_bing, _candidates_from_google]
+
+
+def fetch_image_url(query: str, min_size: int = 30 * 1024, max_candidates: int = 40,
+                    budget: float = DEFAULT_BUDGET) -> Optional[str]:
     """Return a high-quality image URL for the given query or None.
 
     Strategy:
-    - Query Bing first (often provides full-size URLs via JSON) then Google.
-    - Validate candidates via HEAD; prefer first with content-length >= min_size.
+    - Query every engine in `ENGINES` at once (Bing first in preference, as it
+      often provides full-size URLs via JSON, then Google).
+    - Validate candidates via HEAD as soon as they are parsed; prefer the
+      first (engine order, then result order) with content-length >= min_size.
     - If none meet min_size but some are images, choose the largest available.
+    - After `budget` seconds return the best answer found so far.
+
+    `max_candidates` is split evenly across the engines (earlier engines get
+    any remainder), so a fast engine cannot crowd out a preferred slower one.
+
+    Raises `LookupFailed` when nothing was found and no engine answered.
     """
     if not query:
         return None
+    with metrics.phase("image_search"):
+        return _fetch_image_url(query, min_size, max_candidates, budget)
+
+
+def _fetch_image_url(query: str, min_size: int, max_candidates: int, budget: float) -> Optional[str]:
+    deadline = time.monotonic() + budget
+    engines = list(ENGINES)
+    events: queue.Queue = queue.Queue()
+    cancelled = threading.Event()
+
+    def run_engine(i: int, engine) -> None:
+        answered = False
+        try:
+            timeout = min(ENGINE_TIMEOUT, max(0.1, deadline - time.monotonic()))
+            for url in engine(query, timeout=timeout):
+                if cancelled.is_set():
+                    break
+                events.put(("candidate", i, url))
+            answered = True
+        except Exception:
+            pass
+        finally:
+            events.put(("engine_done", i, answered))
+
+    for i, engine in enumerate(engines):
+        _engine_pool.submit(run_engine, i, engine)
 
     seen = set()
-    candidates = []
+    # (engine index, position within engine, url)
+    candidates: List[tuple] = []
+    futures = []
+    sizes: dict = {}
+    engines_done = [False] * len(engines)
+    engines_answered = [False] * len(engines)
+    per_engine = [0] * len(engines)
+    # Candidate slots reserved per engine
+    quota = [
+        max_candidates // len(engines) + (1 if i < max_candidates % len(engines) else 0)
+        for i in range(len(engines))
+    ]
+
+    def winner() -> Optional[str]:
+        for n in sorted(range(len(candidates)), key=lambda n: candidates[n][:2]):
+            if n not in sizes:
+                return None
+            size = sizes[n]
+            if size and size >= min_size:
+                engine = candidates[n][0]
+                return candidates[n][2] if all(engines_done[:engine]) else None
+        return None
 
-    # Collect candidates from multiple sources
-    for fn in (_candidates_from_bing, _candidates_from_google):
-        for url in fn(query):
-            if len(candidates) >= max_candidates:
+    try:
+        while True:
+            best = winner()
+            if best:
+                return best
+            if all(engines_done) and len(sizes) == len(candidates):
                 break
-            if not url or url in seen:
-                continue
-            seen.add(url)
-            candidates.append(url)
-        if len(candidates) >= max_candidates:
-            break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                kind, i, value = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if kind == "engine_done":
+                engines_done[i] = True
+                engines_answered[i] = value
+            elif kind == "validated":
+                sizes[i] = value
+            elif kind == "candidate":
+                url = value
+                if not url or url in seen or per_engine[i] >= quota[i]:
+                    continue
+                seen.add(url)
+                n = len(candidates)
+                candidates.append((i, per_engine[i], url))
+                per_engine[i] += 1
+                future = _validation_pool.submit(_validate_image, url, min_size)
+                future.add_done_callback(
+                    lambda f, n=n: events.put(("validated", n, None if f.cancelled() else f.result()))
+                )
+                futures.append(future)
+    finally:
+        cancelled.set()
+        for f in futures:
+            f.cancel()
+
+    # Budget exhausted or nothing met min_size: best answer among what resolved
+    ranked = sorted(range(len(candidates)), key=lambda n: candidates[n][:2])
+    for n in ranked:
+        size = sizes.get(n)
+        if size and size >= min_size:
+            return candidates[n][2]
 
     best_unknown = None
     best_size = 0
-
-    for url in candidates:
-        size = _validate_image(url, min_size=min_size)
-        if size and size >= min_size:
-            return url
+    for n in ranked:
+        size = sizes.get(n)
         if size and size > best_size:
-            best_unknown = url
+            best_unknown = candidates[n][2]
             best_size = size
-
-    # If none passed size threshold, return the largest/first acceptable image
     if best_unknown:
         return best_unknown
 
     # As a last resort, return the first http candidate
-    return next((u for u in candidates if u.startswith("http")), None)
\ No newline at end of file
+    url = next((candidates[n][2] for n in ranked if candidates[n][2].startswith("http")), None)
+    if url is None and not any(engines_answered):
+        raise LookupFailed(query)
+    return url
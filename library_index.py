@@ -0,0 +1,439 @@
+"""Persistent metadata index for MusicDom libraries.
+
+Reading tags with mutagen is by far the most expensive part of listing a
+library, so the results are kept in a small SQLite database stored next to
+the music (`.musicdom.db`). Each track is keyed by its path relative to the
+library root and carries the tag fields used by the UI plus the file size
+and mtime observed when it was parsed. `sync(root)` only re-reads files
+whose size or mtime changed since the last run and drops rows for files
+that disappeared; the pages read everything else straight from the index.
+
+Libraries laid out as `Artist/Album/...` can be scanned recursively; the
+mutagen parsing of changed files is then spread over a thread or process
+pool (`SCAN_WORKERS`, `SCAN_EXECUTOR`) while a process-wide semaphore caps
+how many files are open at once (`MAX_OPEN_FILES`), so cold scans of large
+network shares are bounded by I/O parallelism rather than run one by one.
+
+If the library directory is not writable the database is kept under the
+MusicDom cache directory instead (see `storage.data_dir`).
+
+In-process consumers that mirror the index (such as `search_index`) can
+`add_listener` to be told about every row that is written, renamed or
+removed, instead of re-reading the whole table.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+import metrics
+import storage
+
+DB_NAME = ".musicdom.db"
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma')
+TAG_FIELDS = ("title", "artist", "album", "date", "genre")
+
+# Origin of downloaded tracks as "<extractor> <id>" (the yt-dlp download
+# archive format), stored in the file so renamed copies are still recognized.
+# Vorbis comments accept any key; ID3 and MP4 need it registered (see
+# `load_mutagen`).
+SOURCE_FIELD = "source_id"
+_INDEXED_FIELDS = TAG_FIELDS + (SOURCE_FIELD,)
+
+# Parallel parsing settings for `sync`
+SCAN_WORKERS = int(os.getenv("MUSICDOM_SCAN_WORKERS", min(32, (os.cpu_count() or 1) * 4)))
+SCAN_EXECUTOR = os.getenv("MUSICDOM_SCAN_EXECUTOR", "thread")  # "thread" or "process"
+MAX_OPEN_FILES = int(os.getenv("MUSICDOM_MAX_OPEN_FILES", 64))
+# Rows written per transaction while a scan is in progress
+_BATCH_SIZE = 500
+
+_open_files = threading.BoundedSemaphore(MAX_OPEN_FILES)
+
+# Bump whenever the table layout changes; older databases are rebuilt since
+# everything in them can be recomputed from the files.
+_SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    relpath  TEXT PRIMARY KEY,
+    dir      TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    ext      TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    title    TEXT NOT NULL DEFAULT '',
+    artist   TEXT NOT NULL DEFAULT '',
+    album    TEXT NOT NULL DEFAULT '',
+    date     TEXT NOT NULL DEFAULT '',
+    genre    TEXT NOT NULL DEFAULT '',
+    source_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS tracks_dir ON tracks (dir);
+CREATE INDEX IF NOT EXISTS tracks_source ON tracks (source_id);
+"""
+
+
+def db_path(root: str) -> str:
+    """Return the location of the index database for `root`."""
+    if os.access(root, os.W_OK):
+        return os.path.join(root, DB_NAME)
+    return os.path.join(storage.data_dir("indexes"), f"{storage.path_key(root)}.db")
+
+
+def _connect(root: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path(root), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != _SCHEMA_VERSION:
+        conn.execute("DROP TABLE IF EXISTS tracks")
+        conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def is_audio_file(name: str) -> bool:
+    if name.lower().endswith("desktop.ini"):
+        return False
+    return os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS
+
+
+_mutagen_ready = False
+
+
+def load_mutagen():
+    """Import mutagen on first use and register `SOURCE_FIELD`.
+
+    mutagen is only needed once files are parsed or edited, so it stays out
+    of the pages' import time. Everything reading or writing easy tags goes
+    through this function.
+    """
+    global _mutagen_ready
+    import mutagen
+    if not _mutagen_ready:
+        from mutagen.easyid3 import EasyID3
+        from mutagen.easymp4 import EasyMP4Tags
+        EasyID3.RegisterTXXXKey(SOURCE_FIELD, "MUSICDOM_SOURCE")
+        EasyMP4Tags.RegisterFreeformKey(SOURCE_FIELD, "MUSICDOM_SOURCE")
+        _mutagen_ready = True
+    return mutagen
+
+
+def read_tags(filepath: str) -> Dict[str, str]:
+    """Read the indexed tag fields (plus the source id) from `filepath`.
+
+    Missing tags become ''.
+    """
+    mutagen = load_mutagen()
+    try:
+        with metrics.phase("tag_parse"):
+            meta = mutagen.File(filepath, easy=True)
+    except Exception:
+        meta = None
+    tags = {}
+    for field in _INDEXED_FIELDS:
+        try:
+            tags[field] = meta.get(field, [""])[0] if meta else ""
+        except Exception:
+            tags[field] = ""
+    return tags
+
+
+def _scan(root: str, recursive: bool = False,
+          skipped: Optional[List[str]] = None) -> Dict[str, os.stat_result]:
+    """Map relative path -> stat for every audio file under `root`.
+
+    Hidden directories (such as `.git` or caches) and symlinked directories
+    (which may loop back into the library) are skipped when recursing.
+    Subdirectories that cannot be read are skipped too and their relative
+    paths appended to `skipped`.
+    """
+    found = {}
+    pending = [""]
+    with metrics.phase("scandir"):
+        while pending:
+            reldir = pending.pop()
+            try:
+                with os.scandir(os.path.join(root, reldir)) as it:
+                    for entry in it:
+                        relpath = os.path.join(reldir, entry.name)
+                        if entry.is_file() and is_audio_file(entry.name):
+                            found[relpath] = entry.stat()
+                        elif (recursive and entry.is_dir(follow_symlinks=False)
+                              and not entry.name.startswith(".")):
+                            pending.append(relpath)
+            except OSError:
+                if not reldir:
+                    raise
+                if skipped is not None:
+                    skipped.append(reldir)
+    return found
+
+
+def _parse(root: str, relpath: str, size: int, mtime_ns: int) -> tuple:
+    """Build an index row for one file; runs inside the scan worker pool."""
+    name = os.path.basename(relpath)
+    if SCAN_EXECUTOR == "process":
+        tags = read_tags(os.path.join(root, relpath))
+    else:
+        with _open_files:
+            tags = read_tags(os.path.join(root, relpath))
+    return (
+        relpath, os.path.dirname(relpath), name, os.path.splitext(name)[1].lower(), size, mtime_ns,
+        *(tags[f] for f in _INDEXED_FIELDS),
+    )
+
+
+def _row(root: str, relpath: str, st: os.stat_result) -> tuple:
+    return _parse(root, relpath, st.st_size, st.st_mtime_ns)
+
+
+_COLUMNS = ("relpath", "dir", "name", "ext", "size", "mtime_ns") + _INDEXED_FIELDS
+_UPSERT = (
+    f"INSERT OR REPLACE INTO tracks ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_COLUMNS))})"
+)
+
+# Change listeners: fn(root, event, data) with event "upsert" (data: row
+# dict), "delete" (data: relpath) or "rename" (data: (old, new))
+Listener = Callable[[str, str, object], None]
+_listeners: List[Listener] = []
+
+
+def add_listener(fn: Listener) -> None:
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def _notify(root: str, event: str, data) -> None:
+    for fn in _listeners:
+        try:
+            fn(root, event, data)
+        except Exception:
+            pass
+
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def _parse_many(root: str, todo: List[tuple], conn: sqlite3.Connection,
+                progress: Optional[ProgressCallback]) -> None:
+    """Parse `todo` ((relpath, size, mtime_ns) tuples) on the worker pool.
+
+    Rows are committed in batches as they complete, so a long cold scan
+    shows up in the index progressively and survives being interrupted.
+    """
+    total = len(todo)
+    if progress:
+        progress(0, total)
+    if not todo:
+        return
+    if total == 1 or SCAN_WORKERS <= 1:
+        pool = None
+        results = (_parse(root, *item) for item in todo)
+    else:
+        if SCAN_EXECUTOR == "process":
+            # Each worker process holds at most one file open at a time
+            pool = ProcessPoolExecutor(max_workers=min(SCAN_WORKERS, MAX_OPEN_FILES))
+        else:
+            pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="musicdom-scan")
+        results = (f.result() for f in as_completed([pool.submit(_parse, root, *item) for item in todo]))
+    try:
+        batch = []
+        for done, row in enumerate(results, 1):
+            batch.append(row)
+            if len(batch) >= _BATCH_SIZE or done == total:
+                with conn:
+                    conn.executemany(_UPSERT, batch)
+                for r in batch:
+                    _notify(root, "upsert", dict(zip(_COLUMNS, r)))
+                batch = []
+            if progress:
+                progress(done, total)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+
+def sync(root: str, recursive: bool = False, progress: Optional[ProgressCallback] = None) -> int:
+    """Bring the index for `root` up to date with the files on disk.
+
+    Only files whose size or mtime differ from the indexed values are parsed
+    again. A file that vanished while a new one with the same size and mtime
+    appeared is treated as a rename and keeps its indexed tags. Without
+    `recursive` only the top-level directory (and its index rows) is touched;
+    rows under subfolders that cannot be read are left unchanged.
+    `progress(done, total)` is called as changed files are parsed. Returns
+    the number of rows added, updated, renamed or removed.
+    """
+    skipped: List[str] = []
+    found = _scan(root, recursive, skipped)
+    # Rows under folders that could not be read are kept as they are
+    unreadable = tuple(d + os.sep for d in skipped)
+    with closing(_connect(root)) as conn:
+        scope = "" if recursive else " WHERE dir = ''"
+        known = {
+            r["relpath"]: (r["size"], r["mtime_ns"])
+            for r in conn.execute(f"SELECT relpath, size, mtime_ns FROM tracks{scope}")
+            if not r["relpath"].startswith(unreadable)
+        }
+        gone = {sig: relpath for relpath, sig in known.items() if relpath not in found}
+        renamed = []
+        for relpath, st in found.items():
+            if relpath not in known and (st.st_size, st.st_mtime_ns) in gone:
+                renamed.append((gone.pop((st.st_size, st.st_mtime_ns)), relpath))
+        moved_to = {new for _, new in renamed}
+        with conn:
+            for old, new in renamed:
+                _rename(conn, old, new)
+            conn.executemany("DELETE FROM tracks WHERE relpath = ?", [(r,) for r in gone.values()])
+        for old, new in renamed:
+            _notify(root, "rename", (old, new))
+        for relpath in gone.values():
+            _notify(root, "delete", relpath)
+        todo = [
+            (relpath, st.st_size, st.st_mtime_ns)
+            for relpath, st in found.items()
+            if relpath not in moved_to and known.get(relpath) != (st.st_size, st.st_mtime_ns)
+        ]
+        # Unchanged and renamed files keep their indexed tags
+        metrics.cache("metadata", hit=True, amount=len(found) - len(todo))
+        metrics.cache("metadata", hit=False, amount=len(todo))
+        _parse_many(root, todo, conn, progress)
+    return len(todo) + len(renamed) + len(gone)
+
+
+def _rename(conn: sqlite3.Connection, old: str, new: str) -> bool:
+    """Move the row of `old` to `new`; False (and no change) if `old` is not indexed.
+
+    Renames are often reported twice (by the page that renamed the file and
+    again by the watcher), so a second call must leave the row alone.
+    """
+    if old == new or conn.execute("SELECT 1 FROM tracks WHERE relpath = ?", (old,)).fetchone() is None:
+        return False
+    name = os.path.basename(new)
+    conn.execute("DELETE FROM tracks WHERE relpath = ?", (new,))
+    conn.execute(
+        "UPDATE tracks SET relpath = ?, dir = ?, name = ?, ext = ? WHERE relpath = ?",
+        (new, os.path.dirname(new), name, os.path.splitext(name)[1].lower(), old),
+    )
+    return True
+
+
+def update_file(root: str, relpath: str) -> Optional[dict]:
+    """Re-read a single file into the index (e.g. after editing its tags)."""
+    try:
+        st = os.stat(os.path.join(root, relpath))
+    except FileNotFoundError:
+        remove_file(root, relpath)
+        return None
+    row = _row(root, relpath, st)
+    with closing(_connect(root)) as conn, conn:
+        conn.execute(_UPSERT, row)
+    _notify(root, "upsert", dict(zip(_COLUMNS, row)))
+    return dict(zip(_COLUMNS, row))
+
+
+def remove_file(root: str, relpath: str) -> None:
+    with closing(_connect(root)) as conn, conn:
+        conn.execute("DELETE FROM tracks WHERE relpath = ?", (relpath,))
+    _notify(root, "delete", relpath)
+
+
+def rename_file(root: str, old: str, new: str) -> None:
+    """Move the indexed row of `old` to `new` without re-reading its tags.
+
+    Does nothing if `old` is not indexed (e.g. the rename was already applied).
+    """
+    with closing(_connect(root)) as conn, conn:
+        renamed = _rename(conn, old, new)
+    if renamed:
+        _notify(root, "rename", (old, new))
+
+
+def count_tracks(root: str, recursive: bool = True) -> int:
+    """Return how many tracks of `root` are indexed."""
+    where = "" if recursive else " WHERE dir = ''"
+    with closing(_connect(root)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM tracks{where}").fetchone()[0]
+
+
+def list_tracks(root: str, limit: Optional[int] = None, offset: int = 0,
+                recursive: bool = True) -> List[dict]:
+    """Return indexed tracks of `root`, sorted by folder and file name.
+
+    `limit`/`offset` select a page so callers never materialize more rows
+    than they display. Without `recursive` only tracks directly inside
+    `root` are returned. Text search is done by `search_index`.
+    """
+    where = "" if recursive else " WHERE dir = ''"
+    sql = f"SELECT * FROM tracks{where} ORDER BY dir COLLATE NOCASE, name COLLATE NOCASE"
+    params: list = []
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    with closing(_connect(root)) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_tracks(root: str, relpaths: List[str]) -> List[dict]:
+    """Return the indexed rows for `relpaths`, in the given order."""
+    rows = {}
+    with closing(_connect(root)) as conn:
+        # Stay below SQLite's bound-parameter limit
+        for i in range(0, len(relpaths), 500):
+            chunk = relpaths[i:i + 500]
+            sql = f"SELECT * FROM tracks WHERE relpath IN ({', '.join('?' * len(chunk))})"
+            rows.update((r["relpath"], dict(r)) for r in conn.execute(sql, chunk))
+    return [rows[r] for r in relpaths if r in rows]
+
+
+def find_tracks(root: str, **equals: str) -> List[dict]:
+    """Return tracks whose columns equal the given values (case-insensitive).
+
+    E.g. `find_tracks(root, dir="Artist/Album")`; sorted like `list_tracks`.
+    """
+    unknown = set(equals) - set(_COLUMNS)
+    if unknown:
+        raise ValueError(f"unknown columns: {', '.join(sorted(unknown))}")
+    where = " AND ".join(f"{c} = ? COLLATE NOCASE" for c in equals) or "1"
+    sql = f"SELECT * FROM tracks WHERE {where} ORDER BY dir COLLATE NOCASE, name COLLATE NOCASE"
+    with closing(_connect(root)) as conn:
+        return [dict(r) for r in conn.execute(sql, list(equals.values()))]
+
+
+def has_source(root: str, source_id: str) -> bool:
+    """True if any indexed track of `root` was downloaded from `source_id`.
+
+    Folders without an index are not indexed here: the database is not
+    created just to answer this.
+    """
+    if not os.path.exists(db_path(root)):
+        return False
+    with closing(_connect(root)) as conn:
+        row = conn.execute("SELECT 1 FROM tracks WHERE source_id = ? LIMIT 1", (source_id,)).fetchone()
+    return row is not None
+
+
+def get_track(root: str, relpath: str, refresh: bool = True) -> Optional[dict]:
+    """Return the indexed metadata of one track.
+
+    With `refresh` the file is re-read when it is missing from the index or
+    its size/mtime no longer match, so callers always see current tags.
+    """
+    with closing(_connect(root)) as conn:
+        row = conn.execute("SELECT * FROM tracks WHERE relpath = ?", (relpath,)).fetchone()
+    if not refresh:
+        return dict(row) if row else None
+    try:
+        st = os.stat(os.path.join(root, relpath))
+    except FileNotFoundError:
+        return None
+    if row is None or (row["size"], row["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+        return update_file(root, relpath)
+    return dict(row)
@@ -0,0 +1,220 @@
+"""Process-wide, in-memory copy of each library, shared by all sessions.
+
+Every browser session keeps its own library path, but the data behind a path
+is the same for everyone: `get(root)` returns one `Library` per directory
+for the whole server process, loaded once from `library_index` and then
+kept current through its change listener (watcher syncs, tag edits, renames
+and removals from any session are applied incrementally). Ten sessions on
+the same library share one scan (see `library_watcher`) and one copy of its
+rows.
+
+Reads (`count`, `page`, `tracks`, `track`, `find`) run concurrently under a
+shared lock; applying index changes and `edit` (tag writes and renames) take
+it exclusively, so readers never see an edit half applied. Returned rows are
+shared between sessions and must be treated as read-only.
+"""
+from __future__ import annotations
+
+import os
+import string
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import library_index
+import tag_writer
+
+_libraries: Dict[str, "Library"] = {}
+_lock = threading.Lock()
+
+
+class RWLock:
+    """Many readers or one writer; writers waiting block new readers.
+
+    The writing thread may re-acquire the write lock and read while holding
+    it (an edit applies its own index changes through the listener).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._depth = 0
+        self._waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        me = threading.get_ident()
+        if self._writer == me:
+            yield
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# SQLite's NOCASE folds ASCII letters only
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _sort_key(row: dict) -> Tuple[str, str, str]:
+    # Same order as library_index.list_tracks (folder, then file name, both
+    # COLLATE NOCASE); code point order matches SQLite's UTF-8 byte order
+    return row["dir"].translate(_NOCASE), row["name"].translate(_NOCASE), row["relpath"]
+
+
+class Library:
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = RWLock()
+        self._rows: Dict[str, dict] = {}
+        # Sorted relpaths (all, top level only); rebuilt on the first read
+        # after tracks were added, removed or renamed
+        self._order: Optional[Tuple[List[str], List[str]]] = None
+        self._sort_lock = threading.Lock()
+
+    def _apply(self, event: str, data) -> None:
+        with self.lock.write():
+            if event == "upsert":
+                if data["relpath"] not in self._rows:
+                    self._order = None
+                self._rows[data["relpath"]] = data
+            elif event == "delete":
+                if self._rows.pop(data, None) is not None:
+                    self._order = None
+            elif event == "rename":
+                old, new = data
+                row = self._rows.pop(old, None)
+                if row is not None:
+                    name = os.path.basename(new)
+                    self._rows[new] = {
+                        **row, "relpath": new, "dir": os.path.dirname(new),
+                        "name": name, "ext": os.path.splitext(name)[1].lower(),
+                    }
+                    self._order = None
+
+    def _sorted(self, recursive: bool) -> List[str]:
+        # Called with the read lock held; concurrent readers sort only once
+        order = self._order
+        if order is None:
+            with self._sort_lock:
+                order = self._order
+                if order is None:
+                    everything = [r["relpath"] for r in sorted(self._rows.values(), key=_sort_key)]
+                    order = self._order = (everything, [r for r in everything if not self._rows[r]["dir"]])
+        return order[0] if recursive else order[1]
+
+    def count(self, recursive: bool = True) -> int:
+        with self.lock.read():
+            if recursive:
+                return len(self._rows)
+            return len(self._sorted(False))
+
+    def page(self, limit: Optional[int] = None, offset: int = 0, recursive: bool = True) -> List[dict]:
+        """Tracks sorted by folder and file name, like `library_index.list_tracks`."""
+        with self.lock.read():
+            order = self._sorted(recursive)
+            selected = order[offset:] if limit is None else order[offset:offset + limit]
+            return [self._rows[r] for r in selected]
+
+    def tracks(self, relpaths: List[str]) -> List[dict]:
+        """The rows of `relpaths` that exist, in the given order."""
+        with self.lock.read():
+            return [self._rows[r] for r in relpaths if r in self._rows]
+
+    def track(self, relpath: str, refresh: bool = False) -> Optional[dict]:
+        """One row; with `refresh`, re-read the file first if it changed on disk."""
+        with self.lock.read():
+            row = self._rows.get(relpath)
+        if not refresh:
+            return row
+        try:
+            st = os.stat(os.path.join(self.root, relpath))
+        except FileNotFoundError:
+            return None
+        if row is None or (row["size"], row["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            # Applied to this copy through the listener
+            return library_index.update_file(self.root, relpath)
+        return row
+
+    def find(self, **equals: str) -> List[dict]:
+        """Tracks whose columns equal the given values (case-insensitive), sorted."""
+        wanted = {c: v.casefold() for c, v in equals.items()}
+        with self.lock.read():
+            return [
+                self._rows[r] for r in self._sorted(True)
+                if all(self._rows[r][c].casefold() == v for c, v in wanted.items())
+            ]
+
+    def edit(self, relpath: str, fields: Dict[str, str], rename_to: Optional[str] = None) -> str:
+        """`tag_writer.apply_edit` with the library locked for writing."""
+        with self.lock.write():
+            return tag_writer.apply_edit(self.root, relpath, fields, rename_to=rename_to)
+
+
+def _on_change(root: str, event: str, data) -> None:
+    library = _libraries.get(_key(root))
+    if library is not None:
+        library._apply(event, data)
+
+
+def _key(root: str) -> str:
+    return os.path.normcase(os.path.abspath(root))
+
+
+def get(root: str) -> Library:
+    """Return the shared library for `root`, loading it on first use.
+
+    Only registering a new library holds the module lock; its rows are then
+    loaded under the library's own write lock, so loading one large library
+    does not block `get` for the others (its readers wait for the load).
+    """
+    key = _key(root)
+    with ExitStack() as loading:
+        with _lock:
+            library = _libraries.get(key)
+            if library is not None:
+                return library
+            library_index.add_listener(_on_change)
+            library = _libraries[key] = Library(root)
+            # Locked before other threads can see it; registered before
+            # loading so changes during the load are not lost
+            loading.enter_context(library.lock.write())
+        try:
+            for row in library_index.list_tracks(root):
+                library._rows[row["relpath"]] = row
+        except BaseException:
+            with _lock:
+                _libraries.pop(key, None)
+            raise
+        return library
@@ -0,0 +1,226 @@
+"""Background watcher that keeps library indexes current.
+
+One daemon thread per library directory is started the first time a page asks
+for it (`ensure_watching`) and then lives for the rest of the server process.
+It performs the initial `library_index.sync` and afterwards applies changes
+incrementally: with the optional `inotify_simple` package (Linux) it reacts to
+create/write/delete/rename events for individual files, otherwise it falls
+back to polling with `library_index.sync`, which only re-reads changed files.
+
+In recursive mode every subdirectory gets its own inotify watch and newly
+created folders are picked up as they appear. A recursive watcher also serves
+pages that only list the top folder; a page asking for recursion where a
+flat watcher runs replaces (and stops) that watcher.
+
+The polling interval is `MUSICDOM_POLL_INTERVAL` seconds (default 5), or
+`POLL_LOAD_FACTOR` times the duration of the last sync if that is longer, so
+walking a large or slow library never keeps the thread busy. Pages never scan the directory
+themselves; they read the index and use the watcher only to know whether the
+first indexing pass has finished (`progress` reports how far it got).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import library_index
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# Minimum seconds between full syncs in polling mode
+POLL_INTERVAL = float(os.getenv("MUSICDOM_POLL_INTERVAL", 5))
+# In polling mode, wait at least this many times as long as the last sync took
+POLL_LOAD_FACTOR = 10.0
+# Seconds between safety syncs in inotify mode (catches changes made on
+# network shares, where the kernel does not deliver events)
+RESYNC_INTERVAL = 300.0
+# Seconds before a watcher that died (e.g. permission error) is restarted
+RETRY_INTERVAL = 30.0
+
+log = logging.getLogger(__name__)
+
+_watchers: Dict[str, "LibraryWatcher"] = {}
+_lock = threading.Lock()
+
+
+class LibraryWatcher(threading.Thread):
+    def __init__(self, root: str, recursive: bool = False):
+        super().__init__(name=f"musicdom-watcher:{root}", daemon=True)
+        self.root = root
+        self.recursive = recursive
+        # (parsed, total) files of the sync in progress
+        self.progress: Tuple[int, int] = (0, 0)
+        self.mode = "inotify" if INotify else "polling"
+        self.ready = threading.Event()
+        # Why the watcher thread stopped; failures of single events or
+        # periodic syncs are only logged, the next sync retries them
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self._stopping = threading.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def run(self) -> None:
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _on_progress(self, done: int, total: int) -> None:
+        self.progress = (done, total)
+
+    def _sync(self) -> None:
+        library_index.sync(self.root, recursive=self.recursive, progress=self._on_progress)
+
+    def _run(self) -> None:
+        try:
+            self._sync()
+        finally:
+            self.ready.set()
+
+        if INotify:
+            try:
+                self._watch_inotify()
+                return
+            except OSError:
+                # Watch limit reached or inotify unsupported on this filesystem
+                self.mode = "polling"
+        self._watch_polling()
+
+    def _resync(self) -> None:
+        try:
+            self._sync()
+        except Exception:
+            log.warning("Sync of %s failed", self.root, exc_info=True)
+
+    def _watch_polling(self) -> None:
+        took = 0.0
+        while not self._stopping.wait(max(POLL_INTERVAL, POLL_LOAD_FACTOR * took)):
+            start = time.monotonic()
+            self._resync()
+            took = time.monotonic() - start
+
+    def _add_watches(self, inotify, reldir: str, mask: int) -> None:
+        wd = inotify.add_watch(os.path.join(self.root, reldir), mask)
+        self._dirs[wd] = reldir
+        if not self.recursive:
+            return
+        with os.scandir(os.path.join(self.root, reldir)) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                    self._add_watches(inotify, os.path.join(reldir, entry.name), mask)
+
+    def _watch_inotify(self) -> None:
+        mask = (
+            flags.CLOSE_WRITE | flags.CREATE | flags.DELETE
+            | flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE_SELF | flags.MOVE_SELF
+        )
+        # Watch descriptor -> directory relative to the library root
+        self._dirs: Dict[int, str] = {}
+        with INotify() as inotify:
+            self._add_watches(inotify, "", mask)
+            last_sync = time.monotonic()
+            while not self._stopping.is_set():
+                events = inotify.read(timeout=1000)
+                if events:
+                    if not self._apply(inotify, events, mask):
+                        return
+                if time.monotonic() - last_sync > RESYNC_INTERVAL:
+                    self._resync()
+                    last_sync = time.monotonic()
+
+    def _apply(self, inotify, events, mask: int) -> bool:
+        """Apply one batch of inotify events; returns False if the root is gone."""
+        moved_from = {}
+        resync = False
+        for event in events:
+            if event.mask & flags.Q_OVERFLOW:
+                resync = True
+                continue
+            reldir = self._dirs.get(event.wd)
+            if reldir is None:
+                continue
+            if event.mask & (flags.DELETE_SELF | flags.MOVE_SELF | flags.IGNORED):
+                del self._dirs[event.wd]
+                if reldir == "":
+                    self.error = FileNotFoundError(self.root)
+                    return False
+                resync = True
+                continue
+            if not event.name:
+                continue
+            relpath = os.path.join(reldir, event.name)
+            if event.mask & flags.ISDIR:
+                # A folder appeared or moved: watch it and let the sync index
+                # (or drop) whatever it contains.
+                if self.recursive and event.mask & (flags.CREATE | flags.MOVED_TO):
+                    try:
+                        self._add_watches(inotify, relpath, mask)
+                    except OSError:
+                        pass
+                resync = resync or self.recursive
+                continue
+            self._apply_file_event(event, relpath, moved_from)
+        # Files moved out of the library
+        for old in moved_from.values():
+            library_index.remove_file(self.root, old)
+        if resync:
+            self._resync()
+        return True
+
+    def _apply_file_event(self, event, relpath: str, moved_from: dict) -> None:
+        mask = event.mask
+        is_audio = library_index.is_audio_file(relpath)
+        try:
+            if mask & flags.MOVED_FROM:
+                if is_audio:
+                    moved_from[event.cookie] = relpath
+            elif mask & flags.MOVED_TO:
+                old = moved_from.pop(event.cookie, None)
+                if old and is_audio:
+                    library_index.rename_file(self.root, old, relpath)
+                elif old:
+                    library_index.remove_file(self.root, old)
+                elif is_audio:
+                    library_index.update_file(self.root, relpath)
+            elif mask & flags.DELETE:
+                if is_audio:
+                    library_index.remove_file(self.root, relpath)
+            elif mask & (flags.CLOSE_WRITE | flags.CREATE):
+                if is_audio:
+                    library_index.update_file(self.root, relpath)
+        except Exception:
+            log.warning("Could not apply change to %s", relpath, exc_info=True)
+
+
+def ensure_watching(root: str, recursive: bool = False) -> LibraryWatcher:
+    """Return a watcher covering `root`, starting it on first use.
+
+    The returned watcher may be recursive even if `recursive` is False.
+    """
+    key = os.path.normcase(os.path.abspath(root))
+    with _lock:
+        watcher = _watchers.get(key)
+        if watcher is not None and recursive and not watcher.recursive:
+            # Upgrade: the recursive watcher covers everything the flat one did
+            watcher.stop()
+        elif watcher is not None and (
+            watcher.finished_at is None
+            or time.monotonic() - watcher.finished_at <= RETRY_INTERVAL
+        ):
+            return watcher
+        else:
+            recursive = recursive or (watcher is not None and watcher.recursive)
+        watcher = LibraryWatcher(root, recursive)
+        _watchers[key] = watcher
+        watcher.start()
+        return watcher
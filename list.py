@@ -1,22 +1,27 @@
 import os
 import re
-import mutagen
+import math
+import importlib.util
 import streamlit as st
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3NoHeaderError
+import cover_prefetch
+import duplicates
+import library_service
+import library_watcher
+import loudness
+import metrics
+import search_index
+import tag_writer
 import streamlit.components.v1 as components
 
-# Tenta importar tkinter (disponível em execução local)
-try:
-    import tkinter as tk
-    from tkinter import filedialog
-    TKINTER_AVAILABLE = True
-except ImportError:
-    TKINTER_AVAILABLE = False
+# tkinter (disponível em execução local) só é importado ao abrir o seletor
+TKINTER_AVAILABLE = importlib.util.find_spec("_tkinter") is not None
 
 st.set_page_config(layout="wide")
 st.title('MusicDom')
 
+# Opções de quantidade de músicas exibidas por página
+PAGE_SIZES = [25, 50, 100, 200]
+
 # Inicializa o path se não existir
 if "path" not in st.session_state:
     st.session_state["path"] = ""
@@ -33,6 +38,9 @@ def is_local_execution():
 
 # Função para seletor nativo (tkinter)
 def select_folder_native():
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
     root.wm_attributes('-topmost', 1)
@@ -253,101 +261,296 @@ if not path or not os.path.exists(path):
     
     st.stop()
 
+# Aviso exibido enquanto a primeira indexação da biblioteca não termina
+@st.fragment(run_every=1)
+def indexing_status(watcher):
+    if watcher.ready.is_set():
+        st.rerun()
+    done, total = watcher.progress
+    if total:
+        st.progress(done / total, text=f"Indexando biblioteca em segundo plano... {done}/{total} arquivos")
+    else:
+        st.info("Indexando biblioteca em segundo plano...", icon=":material/hourglass_top:")
+
+def toggle_selection(relpath):
+    selecionadas = st.session_state.setdefault("selecionadas", set())
+    if st.session_state.get(f"sel_{relpath}"):
+        selecionadas.add(relpath)
+    else:
+        selecionadas.discard(relpath)
+    # O editor em lote fica fora da linha: a página inteira precisa ser redesenhada
+    st.session_state["selecao_alterada"] = True
+
+# Progresso da edição em lote; recarrega a lista quando terminar
+@st.fragment(run_every=1)
+def batch_progress():
+    lote = st.session_state.get("lote")
+    if lote is None:
+        return
+    if lote.finished.is_set():
+        st.session_state["lote"] = None
+        st.session_state["lote_erros"] = lote.errors
+        st.rerun()
+    st.progress(lote.done / lote.total, text=f"Salvando alterações... {lote.done}/{lote.total}")
+
+# Painel para editar várias músicas selecionadas de uma vez
+def bulk_editor(path, selecionadas):
+    with st.expander(f"Editar {len(selecionadas)} música{'s' if len(selecionadas) != 1 else ''} selecionada{'s' if len(selecionadas) != 1 else ''}", icon=":material/edit_note:"):
+        st.caption("Campos em branco são mantidos. MP3, FLAC, OGG e M4A são suportados.")
+        cols = st.columns(4)
+        fields = {
+            "artist": cols[0].text_input("Artista", key="lote_artist"),
+            "album": cols[1].text_input("Álbum", key="lote_album"),
+            "date": cols[2].text_input("Ano", key="lote_date"),
+            "genre": cols[3].text_input("Gênero", key="lote_genre"),
+        }
+        number = st.checkbox("Numerar faixas na ordem da lista", key="lote_number")
+        rename = st.checkbox("Renomear arquivos a partir do título", key="lote_rename")
+
+        action_cols = st.columns(2)
+        if action_cols[0].button("Aplicar", icon=":material/save:", use_container_width=True,
+                                 disabled=st.session_state.get("lote") is not None):
+            tracks = library_service.get(path).tracks(list(selecionadas))
+            tracks.sort(key=lambda t: (t["dir"].lower(), t["name"].lower()))
+            # Cada edição do lote segura a trava de escrita da biblioteca compartilhada
+            st.session_state["lote"] = tag_writer.start_batch(
+                path, tag_writer.plan_batch(tracks, fields, number=number, rename=rename),
+                apply=library_service.get(path).edit,
+            )
+            selecionadas.clear()
+            for key in [k for k in st.session_state if str(k).startswith("sel_")]:
+                del st.session_state[key]
+        if action_cols[1].button("Limpar seleção", use_container_width=True):
+            selecionadas.clear()
+            for key in [k for k in st.session_state if str(k).startswith("sel_")]:
+                del st.session_state[key]
+            st.rerun()
+
+# Músicas com o mesmo áudio (cópias renomeadas ou com tags diferentes)
+def duplicates_panel(path, recursive):
+    with st.expander("Músicas duplicadas", icon=":material/content_copy:"):
+        st.caption("Compara apenas o áudio dos arquivos, ignorando nomes e tags. Só arquivos novos ou alterados são lidos novamente.")
+        if st.button("Procurar duplicatas", icon=":material/search:"):
+            with st.spinner("Comparando arquivos..."):
+                st.session_state["duplicadas"] = (path, recursive, duplicates.find_duplicates(path, recursive=recursive))
+        resultado = st.session_state.get("duplicadas")
+        if not resultado or resultado[:2] != (path, recursive):
+            return
+        grupos = resultado[2]
+        if not grupos:
+            st.success("Nenhuma duplicata encontrada.", icon=":material/check_circle:")
+            return
+        copias = sum(len(g) - 1 for g in grupos)
+        st.write(f"{len(grupos)} grupo{'s' if len(grupos) != 1 else ''} com áudio idêntico ({copias} cópia{'s' if copias != 1 else ''} a mais)")
+        for grupo in grupos:
+            st.markdown("\n".join(
+                f"- `{t['relpath']}` — {t['artist'] or 'Desconhecido'} · {t['title'] or t['name']}" for t in grupo
+            ))
+
+# Análise de volume em segundo plano, para o player normalizar as faixas
+@st.fragment(run_every=1)
+def loudness_progress(path):
+    analise = loudness.running(path)
+    if analise is None:
+        return
+    st.progress(
+        analise.done / analise.total,
+        text=f"Analisando volume... {analise.done}/{analise.total} "
+             f"({analise.tracks_per_second_per_core:.1f} faixas/s por núcleo)",
+    )
+
+def loudness_panel(path, recursive):
+    with st.expander("Normalização de volume", icon=":material/volume_up:"):
+        if not loudness.available():
+            st.caption("Requer FFmpeg no PATH e o pacote 'numpy' ('pip install numpy').")
+            return
+        st.caption("Mede o volume de cada música para o player tocar todas no mesmo nível. Só arquivos novos ou alterados são analisados.")
+        if st.button("Analisar volume da biblioteca", icon=":material/equalizer:",
+                     disabled=loudness.running(path) is not None):
+            if loudness.start_analysis(path, recursive=recursive) is None:
+                st.success("Todas as músicas já foram analisadas.", icon=":material/check_circle:")
+        loudness_progress(path)
+
+# Abre o player; a lista atual (busca e subpastas) pode virar a fila
+def abrir_player(relpath, autoplay, busca, recursive):
+    st.session_state["musica_selecionada"] = relpath
+    st.session_state["autoplay"] = autoplay
+    st.session_state["contexto_lista"] = {"busca": busca, "recursive": recursive}
+    st.switch_page("player.py")
+
+# Uma linha da lista. Como fragmento, abrir o editor, digitar nos campos ou
+# salvar executa só esta linha: nada da página (busca, paginação, as outras
+# linhas) é refeito.
+@st.fragment
+def track_row(path, track, busca, recursive):
+    if st.session_state.pop("selecao_alterada", False):
+        st.rerun()
+    # Reexecuções do fragmento recebem os argumentos da última execução da
+    # página; depois de salvar, a linha segue a versão atual (e o novo nome)
+    original = track["relpath"]
+    editadas = st.session_state.setdefault("editadas", {})
+    if original in editadas:
+        track = library_service.get(path).track(editadas[original]) or track
+    relpath = track["relpath"]
+    selecionadas = st.session_state.setdefault("selecionadas", set())
+
+    song_cols = st.columns([0.3, 3, 2, 1, 0.5])
+
+    # ───────── Metadados ─────────
+    # Desenhado antes do nome e do artista para que já mostrem o que foi salvo
+    with song_cols[3]:
+        with st.expander(icon=":material/edit:", label="...", expanded=False):
+            titulo = st.text_input("Título", track["title"], key=f"title_{relpath}")
+            artista = st.text_input("Artista", track["artist"], key=f"artist_{relpath}")
+            album = st.text_input("Álbum", track["album"], key=f"album_{relpath}")
+            year = st.text_input("Ano", track["date"], key=f"date_{relpath}")
+            genre = st.text_input("Gênero", track["genre"], key=f"genre_{relpath}")
+
+            if st.button(icon=":material/save:", label="",  key=f"save_{relpath}", use_container_width=True):
+                try:
+                    with metrics.phase("tag_save"):
+                        novo = library_service.get(path).edit(
+                            relpath,
+                            {"title": titulo, "artist": artista, "album": album, "date": year, "genre": genre},
+                            rename_to=titulo or None,
+                        )
+                    editadas[original] = novo
+                    track = library_service.get(path).track(novo) or track
+                    st.success("Dados salvos.", icon=":material/check_circle:")
+                except FileExistsError as e:
+                    track = library_service.get(path).track(relpath) or track
+                    st.warning(str(e))
+                except ValueError as e:
+                    st.warning(str(e))
+                except OSError as e:
+                    st.error(f"Erro ao salvar: {e}")
+    relpath = track["relpath"]
+
+    # ───────── Seleção (edição em lote) ─────────
+    with song_cols[0]:
+        st.checkbox(
+            "Selecionar", value=relpath in selecionadas, key=f"sel_{relpath}",
+            label_visibility="collapsed", on_change=toggle_selection, args=(relpath,),
+        )
+
+    # ───────── Nome / Navegação ─────────
+    with song_cols[1]:
+        name_no_ext = re.sub(r'\.[^.]+$', '', track["name"])
+        if st.button(name_no_ext, key=f"name_{relpath}", help=track["dir"] or None, use_container_width=True):
+            abrir_player(relpath, autoplay=False, busca=busca, recursive=recursive)
+
+    # ───────── Artista ─────────
+    with song_cols[2]:
+        st.text(track["artist"] or "Desconhecido")
+
+    # ───────── Play ─────────
+    with song_cols[4]:
+        if st.button(icon=":material/play_circle:", label="", key=f'play_{relpath}', help="Reproduzir", use_container_width=True):
+            abrir_player(relpath, autoplay=True, busca=busca, recursive=recursive)
+
 # ===== LISTA DE MÚSICAS =====
 try:
-    obj = os.scandir(path)
+    # O índice é mantido por um observador em segundo plano (um por processo);
+    # a página apenas lê o estado atual, sem varrer o diretório.
+    recursive = st.toggle(
+        "Incluir subpastas", key="recursive",
+        help="Lista também as músicas em subpastas (ex: Artista/Álbum/)",
+        on_change=lambda: st.session_state.update(pagina=1),
+    )
+    watcher = library_watcher.ensure_watching(path, recursive=recursive)
+    if watcher.error:
+        raise watcher.error
+    if not watcher.ready.is_set():
+        indexing_status(watcher)
+
     st.subheader(f"Músicas disponíveis em '{os.path.basename(path)}'")
 
-    def sanitize_filename(nome):
-        return re.sub(r'[\\/:*?"<>|]', '', nome).strip()
-
-    music_count = 0
-    for entry in obj:
-        if entry.is_file() and not entry.name.lower().endswith("desktop.ini"):
-            arquivo = os.path.join(path, entry.name)
-            ext = os.path.splitext(entry.name)[1].lower()
-            
-            # Conta apenas arquivos de música
-            if ext not in ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma']:
-                continue
-            
-            music_count += 1
-
-            meta_read = mutagen.File(arquivo, easy=True)
-            meta_artist = meta_read.get("artist", ["Desconhecido"])[0] if meta_read else "Desconhecido"
-
-            song_cols = st.columns([3, 2, 1, 0.5])
-            name_no_ext = re.sub(r'\.[^.]+$', '', entry.name)
-
-            # ───────── Nome / Navegação ─────────
-            with song_cols[0]:
-                if st.button(name_no_ext, key=f"name_{entry.name}", use_container_width=True):
-                    st.session_state["musica_selecionada"] = entry.name
-                    st.session_state["autoplay"] = False
-                    st.switch_page("player.py")
-
-            # ───────── Artista ─────────
-            with song_cols[1]:
-                st.text(meta_artist)
-
-            # ───────── Metadados ─────────
-            with song_cols[2]:
-                with st.expander(icon=":material/edit:", label="...", expanded=False):
-                    titulo = st.text_input("Título", meta_read.get("title", [""])[0] if meta_read else "", key=f"title_{entry.name}")
-                    artista = st.text_input("Artista", meta_read.get("artist", [""])[0] if meta_read else "", key=f"artist_{entry.name}")
-                    album = st.text_input("Álbum", meta_read.get("album", [""])[0] if meta_read else "", key=f"album_{entry.name}")
-                    year = st.text_input("Ano", meta_read.get("date", [""])[0] if meta_read else "", key=f"date_{entry.name}")
-                    genre = st.text_input("Gênero", meta_read.get("genre", [""])[0] if meta_read else "", key=f"genre_{entry.name}")
-
-                    if st.button(icon=":material/save:", label="",  key=f"save_{entry.name}", use_container_width=True):
-                        if titulo:
-                            titulo_limpo = sanitize_filename(titulo)
-                            novo_nome = f"{titulo_limpo}{ext}"
-                            destino = os.path.join(path, novo_nome)
-                            if destino != arquivo and not os.path.exists(destino):
-                                try:
-                                    os.rename(arquivo, destino)
-                                    arquivo = destino
-                                except OSError as e:
-                                    st.error(f"Erro ao renomear: {e}")
-
-                        if ext == ".mp3":
-                            try:
-                                meta = EasyID3(arquivo)
-                            except ID3NoHeaderError:
-                                meta = EasyID3()
-                                meta.save(arquivo)
-                                meta = EasyID3(arquivo)
-
-                            for k, v in {
-                                "title": titulo,
-                                "artist": artista,
-                                "album": album,
-                                "date": year,
-                                "genre": genre
-                            }.items():
-                                if v:
-                                    meta[k] = [v]
-                                else:
-                                    meta.pop(k, None)
-
-                            meta.save()
-                            st.success("Dados salvos.", icon=":material/check_circle:")
-                        else:
-                            st.warning("Modifcações suportadads apenas em MP3 no momento.")
-
-            # ───────── Play ─────────
-            with song_cols[3]:
-                if st.button(icon=":material/play_circle:", label="", key=f'play_{entry.name}', help="Reproduzir", use_container_width=True):
-                    st.session_state["musica_selecionada"] = entry.name
-                    st.session_state["autoplay"] = True
-                    st.switch_page("player.py")
-    
-    if music_count == 0:
+    # ───────── Busca / Paginação ─────────
+    # O filtro e a paginação são feitos nos índices, antes de criar qualquer
+    # widget: o número de linhas desenhadas depende só do tamanho da página.
+    # A busca ignora acentos e aceita prefixos e erros de digitação.
+    busca_cols = st.columns([4, 1, 1])
+    with busca_cols[0]:
+        busca = st.text_input(
+            "Buscar",
+            placeholder="Buscar por título, artista, álbum, gênero ou arquivo",
+            key="busca",
+            label_visibility="collapsed",
+            on_change=lambda: st.session_state.update(pagina=1),
+        )
+    with busca_cols[1]:
+        page_size = st.selectbox(
+            "Por página", PAGE_SIZES, index=1, key="page_size",
+            label_visibility="collapsed", format_func=lambda n: f"{n} por página",
+            on_change=lambda: st.session_state.update(pagina=1),
+        )
+
+    # Biblioteca compartilhada por todas as sessões abertas neste diretório
+    biblioteca = library_service.get(path)
+    with metrics.phase("index_query"):
+        library_total = biblioteca.count(recursive=recursive)
+        resultados = search_index.get(path).search(busca, recursive=recursive) if busca.strip() else None
+    music_count = library_total if resultados is None else len(resultados)
+    n_pages = max(1, math.ceil(music_count / page_size))
+    if st.session_state.get("pagina", 1) > n_pages:
+        st.session_state["pagina"] = n_pages
+
+    with busca_cols[2]:
+        pagina = st.number_input(
+            "Página", min_value=1, max_value=n_pages, step=1, key="pagina",
+            label_visibility="collapsed", help=f"Página (de {n_pages})",
+        )
+
+    inicio = (pagina - 1) * page_size
+    with metrics.phase("index_query"):
+        if resultados is None:
+            tracks = biblioteca.page(limit=page_size, offset=inicio, recursive=recursive)
+        else:
+            tracks = biblioteca.tracks(resultados[inicio:inicio + page_size])
+
+    # Resolve as capas da página em segundo plano para o player abrir sem espera
+    cover_prefetch.prefetch(path, tracks)
+
+    # ───────── Edição em lote ─────────
+    selecionadas = st.session_state.setdefault("selecionadas", set())
+    if selecionadas:
+        bulk_editor(path, selecionadas)
+    batch_progress()
+    for erro in st.session_state.pop("lote_erros", []):
+        st.error(erro)
+
+    # Tempo de construção dos widgets das linhas (painel de desempenho)
+    st.session_state["editadas"] = {}
+    with metrics.phase("widgets"):
+        for track in tracks:
+            track_row(path, track, busca, recursive)
+
+    if library_total == 0:
         st.warning("Nenhum arquivo de música encontrado neste diretório")
         st.info("Formatos suportados: MP3, WAV, OGG, M4A, FLAC, AAC, WMA")
+    elif music_count == 0:
+        st.info(f"Nenhuma música corresponde a '{busca}'")
     else:
-        st.caption(f"Total: {music_count} música{'s' if music_count != 1 else ''}")
+        st.caption(
+            f"Exibindo {inicio + 1}–{inicio + len(tracks)} de {music_count} "
+            f"música{'s' if music_count != 1 else ''} · página {pagina} de {n_pages}"
+        )
+        if st.button(
+            icon=":material/image:", label="Pré-carregar capas de todos os resultados",
+            help="Busca em segundo plano as capas de todas as músicas listadas (ex: um álbum ou pasta filtrado pela busca)",
+        ):
+            if resultados is None:
+                todas = biblioteca.page(recursive=recursive)
+            else:
+                todas = biblioteca.tracks(resultados)
+            st.toast(f"{cover_prefetch.prefetch(path, todas)} capas adicionadas à fila")
+        if cover_prefetch.pending():
+            st.caption(f"Capas sendo carregadas em segundo plano: {cover_prefetch.pending()}")
+
+    if library_total > 1:
+        duplicates_panel(path, recursive)
+    if library_total:
+        loudness_panel(path, recursive)
 
 except PermissionError:
     st.error("Sem permissão de acesso ao diretório")
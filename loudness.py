@@ -0,0 +1,350 @@
+"""Loudness analysis (ReplayGain 2.0 style) for library tracks.
+
+Each track is decoded once by ffmpeg to 48 kHz float PCM in its own channel
+layout (mono and stereo as they are, anything else as 5.1), so mono tracks
+are not measured as two loud channels. The filter graph also produces a
+K-weighted copy of the signal (the ITU-R BS.1770 pre-filter and RLB
+high-pass as ffmpeg biquads), so a single pipe carries the K-weighted
+channels for loudness and the raw ones for the sample peak. The PCM is
+consumed in chunks with NumPy: mean squares are computed per 100 ms segment
+and weighted per channel as in BS.1770 (surrounds +1.5 dB, LFE left out),
+400 ms blocks (75 % overlap) are formed from four consecutive segments, and
+the absolute (-70 LUFS) and relative (-10 LU) gates give the integrated
+loudness.
+
+`start_analysis` measures tracks in the background, `LOUDNESS_WORKERS` at a
+time. The workers are threads: decoding and K-weighting run in the ffmpeg
+processes and NumPy releases the GIL for the block math, so nothing is
+gained by forking the server process. Results are stored per
+file in the library index database, keyed by path, size and mtime, so only
+new or changed files are analyzed again; a file ffmpeg cannot decode is
+stored with its error and is not retried until it changes. `gain` turns a result into the linear playback gain towards
+`REFERENCE_LUFS`, limited so the track's peak does not clip.
+
+NumPy and ffmpeg are optional: without them `available()` is False and no
+analysis is started.
+"""
+from __future__ import annotations
+
+import importlib.util
+import math
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import library_index
+import transcode
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# numpy is only imported where audio is measured; the pages import this
+# module for the stored results
+_HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+LOUDNESS_WORKERS = int(os.getenv("MUSICDOM_LOUDNESS_WORKERS", os.cpu_count() or 1))
+# ReplayGain 2.0 reference level
+REFERENCE_LUFS = float(os.getenv("MUSICDOM_LOUDNESS_REFERENCE", -18.0))
+
+SAMPLE_RATE = 48000
+_SEGMENT = SAMPLE_RATE // 10  # 100 ms
+# Segments decoded per read (10 s of audio)
+_READ_SEGMENTS = 100
+
+# ffmpeg layout and BS.1770 channel weights by source channel count; other
+# counts (and unknown ones) are measured as 5.1 (FL FR FC LFE BL BR), which
+# keeps mono in the center and stereo in front without changing levels
+_LAYOUTS = {
+    1: ("mono", (1.0,)),
+    2: ("stereo", (1.0, 1.0)),
+}
+_SURROUND = ("5.1", (1.0, 1.0, 1.0, 0.0, 1.41, 1.41))
+
+# BS.1770 K-weighting as two RBJ biquads at 48 kHz
+_FILTER_GRAPH = (
+    "[0:a:0]aresample={rate},aformat=sample_fmts=flt:channel_layouts={layout},"
+    "asplit=2[k][raw];"
+    "[k]highshelf=f=1681.974:g=3.999843:t=q:w=0.7071752,"
+    "highpass=f=38.13547:t=q:w=0.5003271[kw];"
+    "[kw][raw]amerge=inputs=2[out]"
+)
+
+# Bump whenever the measurement changes; stored results are then discarded
+_METHOD_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loudness_version (version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS loudness (
+    relpath    TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    integrated REAL,
+    peak       REAL NOT NULL,
+    error      TEXT
+);
+"""
+
+_running: Dict[str, "Analysis"] = {}
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    return _HAS_NUMPY and transcode.ffmpeg_available()
+
+
+def integrated_loudness(segments: "np.ndarray") -> Optional[float]:
+    """Gated loudness (LUFS) from per-100 ms mean squares of shape (n, channels).
+
+    The mean squares must already carry the BS.1770 channel weights.
+    Returns None for silence.
+    """
+    import numpy as np
+
+    if len(segments) >= 4:
+        # 400 ms blocks, one every 100 ms
+        csum = np.cumsum(np.vstack([np.zeros((1, segments.shape[1])), segments]), axis=0)
+        blocks = ((csum[4:] - csum[:-4]) / 4).sum(axis=1)
+    else:
+        blocks = segments.mean(axis=0, keepdims=True).sum(axis=1)
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > -70.0]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * math.log10(gated.mean()) - 10.0
+    gated = blocks[levels > max(-70.0, relative)]
+    return float(-0.691 + 10 * math.log10(gated.mean()))
+
+
+def _layout(filepath: str) -> Tuple[str, Tuple[float, ...]]:
+    try:
+        channels = library_index.load_mutagen().File(filepath).info.channels
+    except Exception:
+        channels = None
+    return _LAYOUTS.get(channels, _SURROUND)
+
+
+def measure(filepath: str) -> Tuple[Optional[float], float]:
+    """Decode `filepath` and return (integrated loudness in LUFS, sample peak)."""
+    import numpy as np
+
+    layout, weights = _layout(filepath)
+    width = len(weights)
+    channels = 2 * width
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-threads", "1",
+        "-i", filepath, "-filter_complex", _FILTER_GRAPH.format(rate=SAMPLE_RATE, layout=layout),
+        "-map", "[out]", "-f", "f32le", "-",
+    ]
+    weights = np.array(weights)
+    segment_bytes = _SEGMENT * channels * 4
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    energies, peak, pending = [], 0.0, b""
+    try:
+        while True:
+            chunk = proc.stdout.read(segment_bytes * _READ_SEGMENTS)
+            if not chunk:
+                break
+            pending += chunk
+            whole = len(pending) // segment_bytes * segment_bytes
+            if not whole:
+                continue
+            pcm = np.frombuffer(pending[:whole], dtype="<f4").reshape(-1, _SEGMENT, channels)
+            pending = pending[whole:]
+            energies.append(np.square(pcm[:, :, :width], dtype=np.float64).mean(axis=1) * weights)
+            peak = max(peak, float(np.abs(pcm[:, :, width:]).max()))
+        if pending:
+            # A trailing partial segment counts for the peak only
+            tail = np.frombuffer(pending[:len(pending) // (channels * 4) * channels * 4], dtype="<f4")
+            if len(tail):
+                peak = max(peak, float(np.abs(tail.reshape(-1, channels)[:, width:]).max()))
+        stderr = proc.stderr.read().decode(errors="replace")
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        returncode = proc.wait()
+    if returncode != 0 or not energies:
+        raise RuntimeError(f"FFmpeg falhou: {stderr.strip()[-500:] or 'sem áudio'}")
+    return integrated_loudness(np.concatenate(energies)), peak
+
+
+def gain(result: Optional[dict], reference: float = REFERENCE_LUFS) -> float:
+    """Linear playback gain for a stored result (1.0 when unknown)."""
+    if not result or result["integrated"] is None:
+        return 1.0
+    factor = 10 ** ((reference - result["integrated"]) / 20)
+    if result["peak"] > 0:
+        factor = min(factor, 1.0 / result["peak"])
+    return factor
+
+
+def _connect(root: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(library_index.db_path(root), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    if "error" not in {r["name"] for r in conn.execute("PRAGMA table_info(loudness)")}:
+        conn.execute("ALTER TABLE loudness ADD COLUMN error TEXT")
+    version = conn.execute("SELECT version FROM loudness_version").fetchone()
+    if version is None or version[0] != _METHOD_VERSION:
+        with conn:
+            conn.execute("DELETE FROM loudness")
+            conn.execute("DELETE FROM loudness_version")
+            conn.execute("INSERT INTO loudness_version VALUES (?)", (_METHOD_VERSION,))
+    return conn
+
+
+def get(root: str, relpath: str) -> Optional[dict]:
+    """Stored result for a track, or None if missing or out of date.
+
+    A failed analysis is a result too: `error` is set and `integrated` is
+    None, so `gain` leaves the track as it is.
+    """
+    try:
+        st = os.stat(os.path.join(root, relpath))
+    except OSError:
+        return None
+    with closing(_connect(root)) as conn:
+        row = conn.execute("SELECT * FROM loudness WHERE relpath = ?", (relpath,)).fetchone()
+    if row is None or (row["size"], row["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+        return None
+    return dict(row)
+
+
+def get_many(root: str, tracks: List[dict]) -> Dict[str, dict]:
+    """Up-to-date stored results for index rows, by relpath.
+
+    Freshness is checked against the rows' size and mtime, without a stat.
+    """
+    wanted = {t["relpath"]: (t["size"], t["mtime_ns"]) for t in tracks}
+    results = {}
+    relpaths = list(wanted)
+    with closing(_connect(root)) as conn:
+        for i in range(0, len(relpaths), 500):
+            chunk = relpaths[i:i + 500]
+            sql = f"SELECT * FROM loudness WHERE relpath IN ({', '.join('?' * len(chunk))})"
+            for row in conn.execute(sql, chunk):
+                if (row["size"], row["mtime_ns"]) == wanted[row["relpath"]]:
+                    results[row["relpath"]] = dict(row)
+    return results
+
+
+class Analysis:
+    """Progress of a background run started with `start_analysis`."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.errors: List[str] = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.workers = 1
+        self.finished = threading.Event()
+
+    @property
+    def tracks_per_second_per_core(self) -> float:
+        elapsed = self.elapsed or (time.monotonic() - self.started)
+        return self.done / elapsed / self.workers if elapsed > 0 else 0.0
+
+
+def _pending(tracks: List[dict], conn: sqlite3.Connection, whole_library: bool) -> List[dict]:
+    known = {
+        r["relpath"]: (r["size"], r["mtime_ns"])
+        for r in conn.execute("SELECT relpath, size, mtime_ns FROM loudness")
+    }
+    # Results of files no longer in the index, by (size, mtime)
+    vanished = {}
+    if whole_library:
+        current = {t["relpath"] for t in tracks}
+        vanished = {sig: relpath for relpath, sig in known.items() if relpath not in current}
+    todo = []
+    for t in tracks:
+        signature = (t["size"], t["mtime_ns"])
+        if known.get(t["relpath"]) == signature:
+            continue
+        old = vanished.get(signature)
+        if old is not None:
+            # Renamed file: keep its result under the new path
+            conn.execute(
+                "INSERT OR REPLACE INTO loudness SELECT ?, size, mtime_ns, integrated, peak, error "
+                "FROM loudness WHERE relpath = ?", (t["relpath"], old),
+            )
+            continue
+        todo.append(t)
+    conn.commit()
+    return todo
+
+
+def _run(root: str, todo: List[dict], analysis: Analysis) -> None:
+    workers = max(1, min(LOUDNESS_WORKERS, len(todo)))
+    analysis.workers = workers
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="loudness") if workers > 1 else None
+    try:
+        with closing(_connect(root)) as conn:
+            if pool:
+                futures = {pool.submit(measure, os.path.join(root, t["relpath"])): t for t in todo}
+                results = ((futures[f], f.result) for f in as_completed(futures))
+            else:
+                # A single track (e.g. the one the player asked for) or a
+                # single worker: measured on this thread
+                results = ((t, lambda t=t: measure(os.path.join(root, t["relpath"]))) for t in todo)
+            for t, result in results:
+                integrated, peak, error = None, 0.0, None
+                try:
+                    integrated, peak = result()
+                except Exception as e:
+                    error = str(e)
+                    analysis.errors.append(f"{t['relpath']}: {e}")
+                # Failures are stored as well, so the player does not start
+                # ffmpeg on a broken file again until it changes
+                try:
+                    with conn:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?)",
+                            (t["relpath"], t["size"], t["mtime_ns"], integrated, peak, error),
+                        )
+                except sqlite3.Error as e:
+                    analysis.errors.append(f"{t['relpath']}: {e}")
+                analysis.done += 1
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        analysis.elapsed = time.monotonic() - analysis.started
+        analysis.finished.set()
+        with _lock:
+            _running.pop(os.path.normcase(os.path.abspath(root)), None)
+
+
+def start_analysis(root: str, relpaths: Optional[List[str]] = None,
+                   recursive: bool = True) -> Optional[Analysis]:
+    """Analyze the indexed tracks of `root` (or only `relpaths`) in the background.
+
+    Tracks with an up-to-date result are skipped. Returns the running
+    analysis for `root` if one is already in progress, or None when there is
+    nothing to do or analysis is not available.
+    """
+    if not available():
+        return None
+    key = os.path.normcase(os.path.abspath(root))
+    with _lock:
+        if key in _running:
+            return _running[key]
+        if relpaths is None:
+            tracks = library_index.list_tracks(root, recursive=recursive)
+        else:
+            tracks = library_index.get_tracks(root, relpaths)
+        with closing(_connect(root)) as conn:
+            todo = _pending(tracks, conn, whole_library=relpaths is None)
+        if not todo:
+            return None
+        analysis = _running[key] = Analysis(len(todo))
+    threading.Thread(target=_run, args=(root, todo, analysis), name="musicdom-loudness", daemon=True).start()
+    return analysis
+
+
+def running(root: str) -> Optional[Analysis]:
+    return _running.get(os.path.normcase(os.path.abspath(root)))
@@ -0,0 +1,195 @@
+"""In-process instrumentation for MusicDom.
+
+Hot paths record into a process-wide registry:
+
+- `phase(name)`: a context manager timing one phase of the work
+  (`scandir`, `tag_parse`, `widgets`, `player_payload`, ...);
+- `count(name, **labels)`: counters; `cache(name, hit)` counts cache hits
+  and misses (metadata, covers, thumbnails);
+- `observe(name, seconds, **labels)`: latency summaries, e.g. the per-host
+  HTTP latency of `image_search`.
+
+Totals live for the whole server process (all sessions). A page run can
+also be recorded on its own: `begin_rerun(page)` starts a `Rerun` on the
+calling thread, every phase and counter recorded on that thread until
+`end_rerun()` is added to it too, and the finished rerun is appended to
+the JSON-lines log given in `MUSICDOM_METRICS_LOG` (if any). Work done on
+background threads (the library watcher, scan threads) only shows in the
+process totals; worker processes (`MUSICDOM_SCAN_EXECUTOR=process`) are not
+recorded.
+
+The registry can be exported as Prometheus text (`prometheus_text`, also
+served by `audio_server` at `/metrics`) or as JSON (`snapshot`).
+Set `MUSICDOM_METRICS=0` to turn recording off.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ENABLED = os.getenv("MUSICDOM_METRICS", "1") != "0"
+LOG_PATH = os.getenv("MUSICDOM_METRICS_LOG")
+
+PREFIX = "musicdom_"
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+# key -> [count, sum, max]
+_summaries: Dict[_Key, List[float]] = {}
+_local = threading.local()
+_started = time.time()
+
+
+def _key(name: str, labels: Dict[str, object]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Rerun:
+    """Phases and counters recorded during one run of a page script."""
+
+    def __init__(self, page: str):
+        self.page = page
+        self.started = time.time()
+        self.duration = 0.0
+        # phase -> [calls, seconds]
+        self.phases: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "page": self.page,
+            "started": self.started,
+            "duration_s": self.duration,
+            "phases": {name: {"calls": int(c), "seconds": s} for name, (c, s) in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+
+def count(name: str, amount: float = 1, **labels) -> None:
+    """Add `amount` to the counter `name` with `labels`."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        label = ",".join(f"{k}={v}" for k, v in key[1])
+        rerun_key = f"{name}{{{label}}}" if label else name
+        rerun.counters[rerun_key] = rerun.counters.get(rerun_key, 0) + amount
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record one duration in the summary `name` with `labels`."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += seconds
+        summary[2] = max(summary[2], seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time the enclosed block as phase `name`."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("phase_seconds", elapsed, phase=name)
+        rerun = getattr(_local, "rerun", None)
+        if rerun is not None:
+            entry = rerun.phases.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+
+def cache(name: str, hit: bool, amount: float = 1) -> None:
+    """Count `amount` hits or misses of cache `name`."""
+    count("cache_lookups_total", amount, cache=name, result="hit" if hit else "miss")
+
+
+def begin_rerun(page: str) -> Rerun:
+    """Start recording a page run on the calling thread."""
+    rerun = _local.rerun = Rerun(page)
+    return rerun
+
+
+def end_rerun() -> Optional[Rerun]:
+    """Finish the calling thread's page run and log it."""
+    rerun = getattr(_local, "rerun", None)
+    _local.rerun = None
+    if rerun is None:
+        return None
+    rerun.duration = time.time() - rerun.started
+    observe("rerun_seconds", rerun.duration, page=rerun.page)
+    if LOG_PATH:
+        try:
+            with open(LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rerun.as_dict()) + "\n")
+        except OSError:
+            pass
+    return rerun
+
+
+def snapshot() -> dict:
+    """All process totals as a JSON-serializable dict."""
+    with _lock:
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        summaries = [
+            {"name": name, "labels": dict(labels), "count": int(c), "sum": s, "max": m}
+            for (name, labels), (c, s, m) in sorted(_summaries.items())
+        ]
+    return {"started": _started, "time": time.time(), "counters": counters, "summaries": summaries}
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def prometheus_text() -> str:
+    """Process totals in the Prometheus text exposition format."""
+    data = snapshot()
+    lines: List[str] = []
+    typed = set()
+    for c in data["counters"]:
+        name = PREFIX + c["name"]
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(c['labels'])} {c['value']:g}")
+    families: Dict[str, List[dict]] = {}
+    for s in data["summaries"]:
+        families.setdefault(PREFIX + s["name"], []).append(s)
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} summary")
+        for s in samples:
+            lines.append(f"{name}_count{_labels(s['labels'])} {s['count']}")
+            lines.append(f"{name}_sum{_labels(s['labels'])} {s['sum']:.6f}")
+        lines.append(f"# TYPE {name}_max gauge")
+        for s in samples:
+            lines.append(f"{name}_max{_labels(s['labels'])} {s['max']:.6f}")
+    lines.append(f"# TYPE {PREFIX}start_time_seconds gauge")
+    lines.append(f"{PREFIX}start_time_seconds {data['started']:.3f}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,224 @@
+"""Precomputed waveform peaks for the player.
+
+A track is decoded once by ffmpeg (mono, `SAMPLE_RATE`) and reduced to
+min/max pairs at a few resolutions (`LEVELS`, samples per pair). The pairs
+are stored as int8 in a small binary file under the MusicDom cache directory,
+so drawing a waveform at any zoom only reads a few KB, never the audio.
+
+File layout (little endian):
+
+    header   magic "MDPK", version u16, level count u16, sample rate u32,
+             total samples u64, source size u64, source mtime_ns u64
+    levels   per level: samples per pair u32, pair count u32, data offset u64
+    data     per level: pair count x (min i8, max i8)
+
+Every level can be mapped with `numpy.memmap` as an (n, 2) int8 array. The
+file is stale once the source's size or mtime changes; `request` then
+regenerates it in the background (`PEAK_WORKERS`).
+
+NumPy and ffmpeg are optional: without them no peaks are generated.
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
+
+import storage
+import transcode
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# numpy is imported on first decode or load, not by the pages that only
+# build peaks URLs
+_HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+SAMPLE_RATE = 22050
+LEVELS = (128, 512, 2048, 8192)
+PEAK_WORKERS = int(os.getenv("MUSICDOM_PEAK_WORKERS", 2))
+
+_MAGIC = b"MDPK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHIQQQ")
+_LEVEL = struct.Struct("<IIQ")
+
+_pool = ThreadPoolExecutor(max_workers=PEAK_WORKERS, thread_name_prefix="musicdom-peaks")
+_in_flight: Set[str] = set()
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    return _HAS_NUMPY and transcode.ffmpeg_available()
+
+
+def peaks_path(filepath: str) -> str:
+    return os.path.join(storage.data_dir("peaks"), f"{storage.path_key(filepath)}.peaks")
+
+
+def _read_header(path: str) -> Optional[tuple]:
+    try:
+        with open(path, "rb") as f:
+            header = _HEADER.unpack(f.read(_HEADER.size))
+            levels = [_LEVEL.unpack(f.read(_LEVEL.size)) for _ in range(header[2])]
+    except (OSError, struct.error):
+        return None
+    if header[0] != _MAGIC or header[1] != _VERSION:
+        return None
+    return header, levels
+
+
+def is_current(filepath: str) -> bool:
+    parsed = _read_header(peaks_path(filepath))
+    if parsed is None:
+        return False
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return False
+    header = parsed[0]
+    return (header[5], header[6]) == (st.st_size, st.st_mtime_ns)
+
+
+def _decode_minmax(filepath: str) -> Tuple["np.ndarray", int]:
+    """Level-0 (min, max) pairs and the total sample count."""
+    import numpy as np
+
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-threads", "1",
+        "-i", filepath, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-",
+    ]
+    step = LEVELS[0]
+    chunk_bytes = step * 2 * 2048
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    parts, total, pending = [], 0, b""
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            pending += chunk
+            whole = len(pending) // (step * 2) * step * 2
+            if not whole:
+                continue
+            samples = np.frombuffer(pending[:whole], dtype="<i2").reshape(-1, step)
+            pending = pending[whole:]
+            total += samples.size
+            parts.append(np.stack([samples.min(axis=1), samples.max(axis=1)], axis=1))
+        tail = np.frombuffer(pending[:len(pending) // 2 * 2], dtype="<i2")
+        if len(tail):
+            total += len(tail)
+            parts.append(np.array([[tail.min(), tail.max()]], dtype="<i2"))
+        stderr = proc.stderr.read().decode(errors="replace")
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        returncode = proc.wait()
+    if returncode != 0 or not parts:
+        raise RuntimeError(f"FFmpeg falhou: {stderr.strip()[-500:] or 'sem áudio'}")
+    return np.concatenate(parts), total
+
+
+def _coarsen(pairs: "np.ndarray", factor: int) -> "np.ndarray":
+    import numpy as np
+
+    pad = -len(pairs) % factor
+    if pad:
+        pairs = np.concatenate([pairs, np.repeat(pairs[-1:], pad, axis=0)])
+    grouped = pairs.reshape(-1, factor, 2)
+    return np.stack([grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)], axis=1)
+
+
+def generate(filepath: str) -> str:
+    """Decode `filepath` and write its peaks file; returns the file's path."""
+    import numpy as np
+
+    st = os.stat(filepath)
+    pairs, total = _decode_minmax(filepath)
+    levels = [pairs]
+    for prev, step in zip(LEVELS, LEVELS[1:]):
+        levels.append(_coarsen(levels[-1], step // prev))
+    # int16 -> int8, keeping the sign of small values
+    levels = [(lvl >> 8).astype(np.int8) for lvl in levels]
+
+    offset = _HEADER.size + _LEVEL.size * len(LEVELS)
+    table = []
+    for step, data in zip(LEVELS, levels):
+        table.append(_LEVEL.pack(step, len(data), offset))
+        offset += data.nbytes
+    path = peaks_path(filepath)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(LEVELS), SAMPLE_RATE, total, st.st_size, st.st_mtime_ns))
+        f.writelines(table)
+        for data in levels:
+            f.write(data.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def _generate_job(filepath: str) -> None:
+    try:
+        generate(filepath)
+    except Exception:
+        pass
+    finally:
+        with _lock:
+            _in_flight.discard(filepath)
+
+
+def request(filepath: str) -> bool:
+    """True if current peaks exist; otherwise queue their generation."""
+    if is_current(filepath):
+        return True
+    if not available():
+        return False
+    with _lock:
+        if filepath not in _in_flight:
+            _in_flight.add(filepath)
+            _pool.submit(_generate_job, filepath)
+    return False
+
+
+def duration(filepath: str) -> Optional[float]:
+    parsed = _read_header(peaks_path(filepath))
+    if parsed is None:
+        return None
+    header = parsed[0]
+    return header[4] / header[3]
+
+
+def load(filepath: str, columns: int, start: float = 0.0, end: Optional[float] = None) -> Optional[List[Tuple[float, float]]]:
+    """Return `columns` (min, max) pairs in -1..1 for the [start, end) seconds.
+
+    The coarsest level with at least one pair per column is memory-mapped;
+    None if there is no current peaks file.
+    """
+    if not _HAS_NUMPY or not is_current(filepath):
+        return None
+    import numpy as np
+
+    path = peaks_path(filepath)
+    header, levels = _read_header(path)
+    rate, total = header[3], header[4]
+    end = total / rate if end is None else min(end, total / rate)
+    if end <= start or columns <= 0:
+        return []
+    span = (end - start) * rate
+    step, count, offset = levels[0]
+    for candidate in reversed(levels):
+        if span / candidate[0] >= columns:
+            step, count, offset = candidate
+            break
+    data = np.memmap(path, dtype=np.int8, mode="r", offset=offset, shape=(count, 2))
+    first = min(count - 1, int(start * rate / step))
+    last = max(first + 1, min(count, int(np.ceil(end * rate / step))))
+    window = np.asarray(data[first:last], dtype=np.float32) / 128.0
+    bounds = np.linspace(0, len(window), min(columns, len(window)) + 1).astype(int)[:-1]
+    mins = np.minimum.reduceat(window[:, 0], bounds)
+    maxs = np.maximum.reduceat(window[:, 1], bounds)
+    return [(round(float(a), 3), round(float(b), 3)) for a, b in zip(mins, maxs)]
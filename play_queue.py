@@ -0,0 +1,96 @@
+"""Play queues for the player page.
+
+A queue is an ordered list of relpaths built around the track the user
+picked: the rest of its album, its folder, or the list/search results it
+was picked from, optionally shuffled (the picked track always plays first).
+The player hands the whole queue to the browser at once, so moving to the
+next track never needs a Streamlit rerun.
+"""
+from __future__ import annotations
+
+import os
+import random
+import re
+from typing import List, Mapping, Optional, Tuple
+
+import audio_server
+import library_service
+import loudness
+import search_index
+import stream_cache
+
+SINGLE = "single"
+ALBUM = "album"
+FOLDER = "folder"
+LIST = "list"
+SOURCES = (SINGLE, ALBUM, FOLDER, LIST)
+
+# Longest queue sent to the browser
+MAX_QUEUE = int(os.getenv("MUSICDOM_MAX_QUEUE", 500))
+
+
+def _list_results(root: str, query: str, recursive: bool) -> List[str]:
+    """The relpaths the list page shows for `query`, in its order."""
+    if query.strip():
+        return search_index.get(root).search(query, recursive=recursive)
+    return [t["relpath"] for t in library_service.get(root).page(recursive=recursive)]
+
+
+def build(root: str, track: dict, source: str = SINGLE, shuffle: bool = False,
+          query: str = "", recursive: bool = True) -> Tuple[List[str], int]:
+    """Return (relpaths, index of `track`) for a queue from `source`.
+
+    `query` and `recursive` describe the list the track was picked from
+    (used by `LIST`). Tracks without an album fall back to their folder.
+    """
+    relpath = track["relpath"]
+    if source == ALBUM and track["album"]:
+        # Albums sharing a title ("Greatest Hits") are told apart by folder
+        # or artist
+        relpaths = [
+            t["relpath"] for t in library_service.get(root).find(album=track["album"])
+            if t["dir"] == track["dir"] or t["artist"].casefold() == track["artist"].casefold()
+        ]
+    elif source in (ALBUM, FOLDER):
+        relpaths = [t["relpath"] for t in library_service.get(root).find(dir=track["dir"])]
+    elif source == LIST:
+        relpaths = _list_results(root, query, recursive)
+    else:
+        relpaths = [relpath]
+    if relpath not in relpaths:
+        relpaths.insert(0, relpath)
+
+    if shuffle:
+        rest = [r for r in relpaths if r != relpath]
+        random.shuffle(rest)
+        relpaths = [relpath] + rest
+    start = relpaths.index(relpath)
+    # Keep a window around the picked track
+    first = max(0, min(start - MAX_QUEUE // 2, len(relpaths) - MAX_QUEUE))
+    relpaths = relpaths[first:first + MAX_QUEUE]
+    return relpaths, start - first
+
+
+def entries(root: str, rows: List[dict], normalize: bool = True,
+            profile: str = stream_cache.ORIGINAL,
+            headers: Optional[Mapping[str, str]] = None) -> List[dict]:
+    """Browser-side description of queued index rows.
+
+    Each entry carries the stream (in streaming `profile`), peaks and cover
+    URLs, display text and the loudness gain (1.0 without `normalize` or a
+    stored measurement). URLs are built for the browser that sent `headers`
+    (see `audio_server.base_url`, which raises `audio_server.Unreachable`).
+    """
+    measured = loudness.get_many(root, rows) if normalize else {}
+    return [
+        {
+            "url": audio_server.track_url(root, r["relpath"], profile, headers),
+            "peaks": audio_server.peaks_url(root, r["relpath"], headers),
+            "cover": audio_server.cover_url(root, r["relpath"], headers),
+            "title": r["title"] or re.sub(r"\.[^.]+$", "", r["name"]),
+            "artist": r["artist"] or "Desconhecido",
+            "details": " · ".join(filter(None, [r["album"], r["date"], r["genre"]])),
+            "gain": loudness.gain(measured.get(r["relpath"])),
+        }
+        for r in rows
+    ]
@@ -1,16 +1,16 @@
 import os
 import re
-import mutagen
 import streamlit as st
-import base64
-import image_search
+import json
+import audio_server
+import library_service
+import loudness
+import metrics
+import peaks
+import play_queue
+import stream_cache
 import streamlit.components.v1 as components
 
-
-@st.cache_data(ttl=3600)
-def cached_fetch_image(query: str) -> str | None:
-    return image_search.fetch_image_url(query, min_size=40 * 1024)
-
 st.set_page_config(layout="wide")
 
 # Garante que as variáveis estão inicializadas
@@ -35,7 +35,7 @@ if not path or not os.path.exists(path):
         st.switch_page("list.py")
     st.stop()
 
-display_name = re.sub(r'\.[^.]+$', '', selected) if selected else None
+display_name = re.sub(r'\.[^.]+$', '', os.path.basename(selected)) if selected else None
 
 if not selected:
     st.info("Nenhuma música selecionada. Volte para a lista e escolha uma música.")
@@ -51,68 +51,265 @@ if not os.path.exists(musica_play):
         st.switch_page("list.py")
     st.stop()
 
-# Carrega metadados
-meta = mutagen.File(musica_play, easy=True)
-
-title = meta.get("title", [display_name or selected])[0] if meta else (display_name or selected)
-artist = meta.get("artist", ["Desconhecido"])[0] if meta else "Desconhecido"
-album = meta.get("album", [""])[0] if meta else ""
-year = meta.get("date", [""])[0] if meta else ""
-genre = meta.get("genre", [""])[0] if meta else ""
-
-player_cols = st.columns(2)
-image_placeholder = player_cols[0].empty()
-
-with player_cols[1]:
-    st.subheader(title)
-
-    st.write(f"**Artista:** {artist}")
-    st.write(f"**Álbum:** {album}")
-    st.write(f"**Ano:** {year}")
-    st.write(f"**Gênero:** {genre}")
-
-    try:
-        with open(musica_play, "rb") as f:
-            data = f.read()
-        b64 = base64.b64encode(data).decode("utf-8")
-        ext = os.path.splitext(musica_play)[1].lower()
-        mime = "audio/mpeg"
-        if ext == ".wav":
-            mime = "audio/wav"
-        elif ext in [".ogg", ".oga"]:
-            mime = "audio/ogg"
-        elif ext in [".mp4", ".m4a"]:
-            mime = "audio/mp4"
-        audio_html = f"""
-        <audio id="player" controls {"autoplay" if autoplay else ""} style="width:100%">
-            <source src="data:{mime};base64,{b64}">
-            Seu navegador não suporta o elemento de áudio.
-        </audio>
-        <script>
-        setTimeout(function() {{
-            const p = document.getElementById('player');
-            if (p) {{
-                p.play().catch(function() {{}});
-            }}
-        }}, 100);
-        </script>
-        """
-        components.html(audio_html, height=120, scrolling=False)
-    except Exception as e:
-        st.warning("Não foi possível embutir áudio para autoplay; exibindo controle de áudio padrão.")
-        st.audio(musica_play)
-
-# Busca capa do álbum
-search_query = " ".join(filter(None, [title, artist, album, year])) + " album cover"
-with st.spinner("Buscando capa..."):
-    image_url = cached_fetch_image(search_query)
-
-if image_url:
-    image_placeholder.image(image_url, width=350)
+# Player com fila: dois elementos <audio> alternados (o próximo já
+# carregado), ganho via WebAudio, forma de onda e lista da fila
+PLAYER_HTML = """
+<div style="display:flex;gap:16px;font-family:sans-serif;color:#31333f">
+    <img id="capa" alt="" style="width:220px;height:220px;object-fit:cover;border-radius:6px;background:#f0f2f6">
+    <div style="flex:1;min-width:0">
+        <div id="posicao" style="font-size:12px;color:#808495"></div>
+        <h3 id="titulo" style="margin:4px 0"></h3>
+        <div id="artista"></div>
+        <div id="detalhes" style="font-size:13px;color:#808495;margin-bottom:8px"></div>
+        <audio id="a0" controls preload="auto" style="width:100%">Seu navegador não suporta o elemento de áudio.</audio>
+        <audio id="a1" controls preload="auto" style="width:100%;display:none"></audio>
+        <div id="botoes" style="margin:4px 0">
+            <button id="anterior">⏮ Anterior</button>
+            <button id="proxima">Próxima ⏭</button>
+        </div>
+        <canvas id="onda" style="width:100%;height:70px;cursor:pointer;display:none"
+                title="Clique para ir ao ponto · role para zoom · duplo clique para ver tudo"></canvas>
+    </div>
+</div>
+<ol id="lista" style="max-height:150px;overflow:auto;font-size:13px;font-family:sans-serif;color:#31333f"></ol>
+<script>
+(function() {
+    const dados = __DADOS__;
+    const fila = dados.fila;
+    const els = [document.getElementById('a0'), document.getElementById('a1')];
+    const $ = function(id) { return document.getElementById(id); };
+    const onda = $('onda'), lista = $('lista');
+    let pos = dados.inicio, atual = 0;
+
+    // Ganho por música (normalização de volume)
+    const ganhos = [null, null];
+    if (dados.normalizar) {
+        els.forEach(function(el) { el.crossOrigin = 'anonymous'; });
+        try {
+            const ctx = new AudioContext();
+            els.forEach(function(el, i) {
+                ganhos[i] = ctx.createGain();
+                ctx.createMediaElementSource(el).connect(ganhos[i]).connect(ctx.destination);
+                el.addEventListener('play', function() { ctx.resume(); });
+            });
+        } catch (e) {}
+    }
+
+    function carregar(i, k) {
+        const el = els[i];
+        if (el.dataset.k !== String(k)) {
+            el.dataset.k = k;
+            el.src = fila[k].url;
+            el.load();
+        }
+        if (ganhos[i]) ganhos[i].gain.value = fila[k].gain;
+        else el.volume = Math.min(1, fila[k].gain);
+    }
+
+    // Pré-carrega a próxima no elemento que não está tocando
+    function preparar() {
+        if (pos + 1 < fila.length) carregar(1 - atual, pos + 1);
+    }
+
+    function tocar(k, iniciar) {
+        if (k < 0 || k >= fila.length) return;
+        els[atual].pause();
+        if (els[1 - atual].dataset.k === String(k)) atual = 1 - atual;
+        else carregar(atual, k);
+        pos = k;
+        const el = els[atual];
+        el.currentTime = 0;
+        els.forEach(function(e, i) { e.style.display = i === atual ? 'block' : 'none'; });
+        mostrar();
+        if (el.readyState >= 4) preparar();
+        if (iniciar) el.play().catch(function() {});
+    }
+
+    els.forEach(function(el) {
+        el.addEventListener('canplaythrough', function() { if (el === els[atual]) preparar(); });
+        el.addEventListener('ended', function() { if (el === els[atual]) tocar(pos + 1, true); });
+        el.addEventListener('timeupdate', function() { if (el === els[atual]) desenhar(); });
+    });
+    $('anterior').onclick = function() { tocar(pos - 1, true); };
+    $('proxima').onclick = function() { tocar(pos + 1, true); };
+
+    if (fila.length > 1) {
+        fila.forEach(function(t, i) {
+            const li = document.createElement('li');
+            li.textContent = t.title + ' — ' + t.artist;
+            li.style.cursor = 'pointer';
+            li.onclick = function() { tocar(i, true); };
+            lista.appendChild(li);
+        });
+    } else {
+        lista.style.display = 'none';
+        $('botoes').style.display = 'none';
+    }
+    $('capa').onerror = function() { if (this.src !== dados.icone) this.src = dados.icone; };
+
+    function mostrar() {
+        const t = fila[pos];
+        $('capa').src = t.cover;
+        $('titulo').textContent = t.title;
+        $('artista').textContent = t.artist;
+        $('detalhes').textContent = t.details;
+        $('posicao').textContent = fila.length > 1 ? 'Faixa ' + (pos + 1) + ' de ' + fila.length : '';
+        $('anterior').disabled = pos === 0;
+        $('proxima').disabled = pos >= fila.length - 1;
+        Array.from(lista.children).forEach(function(li, i) {
+            li.style.fontWeight = i === pos ? 'bold' : 'normal';
+            if (i === pos) lista.scrollTop = li.offsetTop - lista.offsetTop - 40;
+        });
+        view.start = 0; view.end = null;
+        carregarOnda();
+    }
+
+    // Forma de onda (picos pré-calculados; zoom sem recarregar a página)
+    const view = {start: 0, end: null};
+    let picos = [], duracao = 0;
+    function desenhar() {
+        if (!picos.length) return;
+        const dpr = window.devicePixelRatio || 1;
+        const w = onda.clientWidth, h = onda.clientHeight;
+        onda.width = w * dpr; onda.height = h * dpr;
+        const c = onda.getContext('2d');
+        c.scale(dpr, dpr);
+        const span = view.end - view.start;
+        const tocado = span > 0 ? (els[atual].currentTime - view.start) / span * w : 0;
+        const col = w / picos.length;
+        picos.forEach(function(par, i) {
+            const x = i * col;
+            c.fillStyle = x < tocado ? '#ff4b4b' : '#a3a8b8';
+            const y1 = (1 - par[1]) * h / 2, y2 = (1 - par[0]) * h / 2;
+            c.fillRect(x, y1, Math.max(1, col - 0.5), Math.max(1, y2 - y1));
+        });
+    }
+    function carregarOnda() {
+        const k = pos;
+        let q = '?columns=' + Math.max(1, onda.clientWidth || 600) + '&start=' + view.start;
+        if (view.end !== null) q += '&end=' + view.end;
+        fetch(fila[k].peaks + q).then(function(r) {
+            if (!r.ok) throw new Error(r.status);
+            return r.json();
+        }).then(function(d) {
+            if (k !== pos) return;
+            picos = d.peaks; duracao = d.duration;
+            if (view.end === null) view.end = duracao;
+            onda.style.display = 'block';
+            desenhar();
+        }).catch(function() {
+            if (k === pos) { picos = []; onda.style.display = 'none'; }
+        });
+    }
+    onda.addEventListener('click', function(e) {
+        els[atual].currentTime = view.start + e.offsetX / onda.clientWidth * (view.end - view.start);
+    });
+    onda.addEventListener('wheel', function(e) {
+        e.preventDefault();
+        const span = view.end - view.start;
+        const centro = view.start + e.offsetX / onda.clientWidth * span;
+        const novo = Math.min(duracao, Math.max(1, span * (e.deltaY > 0 ? 1.25 : 0.8)));
+        view.start = Math.max(0, Math.min(duracao - novo, centro - novo * e.offsetX / onda.clientWidth));
+        view.end = view.start + novo;
+        carregarOnda();
+    }, {passive: false});
+    onda.addEventListener('dblclick', function() {
+        view.start = 0; view.end = duracao; carregarOnda();
+    });
+    window.addEventListener('resize', carregarOnda);
+
+    carregar(0, pos);
+    mostrar();
+    if (dados.autoplay) {
+        setTimeout(function() { els[atual].play().catch(function() {}); }, 100);
+    }
+})();
+</script>
+"""
+
+
+# Carrega metadados do índice da biblioteca
+track = library_service.get(path).track(selected, refresh=True) or {}
+
+FILA_ROTULOS = {
+    play_queue.SINGLE: "Só esta música",
+    play_queue.ALBUM: "Álbum",
+    play_queue.FOLDER: "Pasta",
+    play_queue.LIST: "Resultados da lista",
+}
+PERFIL_ROTULOS = {
+    stream_cache.ORIGINAL: "Original",
+    "high": "Alta (Opus 160 kbps)",
+    "low": "Baixa (Opus 64 kbps)",
+    "mp3": "Compatível (MP3 128 kbps)",
+}
+ICONE_PADRAO = "https://cdn-icons-png.flaticon.com/512/727/727245.png"
+
+# ───────── Fila de reprodução ─────────
+controles = st.columns([2, 2, 1, 1])
+origem = controles[0].selectbox(
+    "Fila", play_queue.SOURCES, format_func=FILA_ROTULOS.get, key="fila_origem",
+    help="Músicas tocadas em sequência a partir da selecionada",
+)
+# Perfis recodificados (pelo FFmpeg) começam a tocar antes em conexões lentas
+perfil = controles[1].selectbox(
+    "Qualidade", list(stream_cache.PROFILES), format_func=PERFIL_ROTULOS.get, key="perfil_stream",
+    disabled=not stream_cache.available(),
+    help="Arquivos grandes (FLAC, WAV) são recodificados durante a transmissão e guardados em cache"
+    if stream_cache.available() else "Requer FFmpeg no PATH",
+)
+aleatorio = controles[2].toggle("Aleatório", key="fila_aleatoria")
+normalizar = controles[3].toggle("Normalizar volume", value=True, key="normalizar")
+
+# A fila inteira vai para o navegador de uma vez: a próxima música é
+# pré-carregada enquanto a atual toca e a troca não passa pelo Streamlit.
+contexto = st.session_state.get("contexto_lista", {})
+if track:
+    with metrics.phase("player_queue"):
+        relpaths, inicio = play_queue.build(
+            path, track, origem, shuffle=aleatorio,
+            query=contexto.get("busca", ""), recursive=contexto.get("recursive", True),
+        )
+        rows = library_service.get(path).tracks(relpaths)
+    inicio = next((i for i, r in enumerate(rows) if r["relpath"] == selected), 0)
 else:
-    image_placeholder.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=150)
-    image_placeholder.caption("Capa não encontrada – exibindo ícone padrão")
+    rows, inicio = [], 0
+
+# Análise de volume e forma de onda das próximas músicas, em segundo plano
+proximas = rows[inicio:inicio + 3]
+if normalizar:
+    medidas = loudness.get_many(path, proximas)
+    faltando = [r["relpath"] for r in proximas if r["relpath"] not in medidas]
+    if faltando:
+        loudness.start_analysis(path, faltando)
+for r in proximas:
+    peaks.request(os.path.join(path, r["relpath"]))
+
+try:
+    # O navegador busca os arquivos por partes (HTTP Range) no servidor
+    # local de streaming; nada do áudio passa pela página do Streamlit.
+    # As URLs usam o endereço pelo qual este navegador acessa o Streamlit.
+    with metrics.phase("player_payload"):
+        fila = play_queue.entries(
+            path, rows, normalize=normalizar, profile=perfil, headers=st.context.headers,
+        )
+        if not fila:
+            raise ValueError("música fora do índice")
+        dados = {
+            "fila": fila, "inicio": inicio, "autoplay": autoplay,
+            "normalizar": normalizar, "icone": ICONE_PADRAO,
+        }
+        player_html = PLAYER_HTML.replace("__DADOS__", json.dumps(dados).replace("</", "<\\/"))
+    components.html(player_html, height=470 if len(fila) > 1 else 320, scrolling=False)
+except audio_server.Unreachable:
+    # Navegador em outra máquina e servidor de streaming só local
+    st.subheader(track.get("title") or display_name)
+    st.audio(musica_play)
+except Exception as e:
+    st.warning("Não foi possível iniciar o streaming do áudio; exibindo controle de áudio padrão.")
+    st.subheader(track.get("title") or display_name)
+    st.audio(musica_play)
 
 # Botão para voltar
 if st.button("← Voltar para lista"):
-    st.switch_page("list.py")
\ No newline at end of file
+    st.switch_page("list.py")
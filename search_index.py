@@ -0,0 +1,216 @@
+"""In-memory full-text search over the library index.
+
+Each library root gets a `SearchIndex` holding, for every track, the folded
+text of its title, artist, album, genre and file name (lowercase, accents
+removed, so "coracao" finds "Coração") and an inverted index from trigrams
+to tracks. Queries are split into words and every word must match a track:
+
+- exact word, word-prefix and substring matches ("day" in "Yesterday")
+  are found by intersecting the posting sets of the word's trigrams and
+  confirming against the folded text; whole words rank above prefixes and
+  prefixes above substrings;
+- words with no such match fall back to fuzzy matching, ranking tracks by how
+  many of the word's trigrams they share (typos, missing letters).
+
+The index is built once per root from `library_index` and then kept current
+through its change listener, so edits, renames and watcher updates are
+applied incrementally.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import ExitStack
+from typing import Dict, List, Set
+
+import library_index
+
+SEARCH_FIELDS = ("title", "artist", "album", "genre")
+# Fuzzy matches must share at least this fraction of a word's trigrams
+FUZZY_THRESHOLD = 0.5
+
+_indexes: Dict[str, "SearchIndex"] = {}
+_lock = threading.Lock()
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents; punctuation becomes spaces."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    # Words are padded so prefixes have their own trigrams (" co", "cor")
+    grams = set()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _query_trigrams(word: str) -> Set[str]:
+    # Unpadded: the word may appear anywhere inside an indexed word
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _fuzzy_trigrams(word: str) -> Set[str]:
+    # Leading space: a matching start of word counts towards the score
+    padded = f" {word}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, root: str):
+        self.root = root
+        # relpath -> folded tag text, and tag text plus file name padded
+        # with spaces (so " word " finds whole words)
+        self._tags: Dict[str, str] = {}
+        self._text: Dict[str, str] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+
+    def _insert(self, relpath: str, tags: str) -> None:
+        name = fold(os.path.splitext(os.path.basename(relpath))[0])
+        text = " " + " ".join(f"{tags} {name}".split()) + " "
+        self._tags[relpath] = tags
+        self._text[relpath] = text
+        for gram in _trigrams(text):
+            self._postings.setdefault(gram, set()).add(relpath)
+
+    def add(self, row: dict) -> None:
+        tags = fold(" ".join(row.get(f) or "" for f in SEARCH_FIELDS))
+        with self._lock:
+            self.remove(row["relpath"])
+            self._insert(row["relpath"], tags)
+
+    def remove(self, relpath: str) -> None:
+        with self._lock:
+            text = self._text.pop(relpath, None)
+            if text is None:
+                return
+            del self._tags[relpath]
+            for gram in _trigrams(text):
+                docs = self._postings.get(gram)
+                if docs is not None:
+                    docs.discard(relpath)
+                    if not docs:
+                        del self._postings[gram]
+
+    def rename(self, old: str, new: str) -> None:
+        with self._lock:
+            tags = self._tags.get(old)
+            if tags is None:
+                return
+            self.remove(old)
+            self.remove(new)
+            self._insert(new, tags)
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def _match_word(self, word: str) -> Dict[str, float]:
+        """Score tracks for one query word (higher is better)."""
+        grams = _query_trigrams(word)
+        if grams:
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        else:
+            # One- and two-letter words: scan every track
+            candidates = self._text.keys()
+        scores = {}
+        exact, prefix = f" {word} ", f" {word}"
+        for relpath in candidates:
+            text = self._text[relpath]
+            if exact in text:
+                scores[relpath] = 3.0
+            elif prefix in text:
+                scores[relpath] = 2.0
+            elif word in text:
+                scores[relpath] = 1.0
+        if scores or len(grams) < 2:
+            return scores
+
+        # Fuzzy fallback: share enough trigrams with the word
+        grams = _fuzzy_trigrams(word)
+        counts = Counter()
+        for g in grams:
+            counts.update(self._postings.get(g, ()))
+        needed = max(2, FUZZY_THRESHOLD * len(grams))
+        return {r: c / len(grams) for r, c in counts.items() if c >= needed}
+
+    def search(self, query: str, recursive: bool = True) -> List[str]:
+        """Return matching relpaths, best matches first.
+
+        Without `recursive` only tracks directly inside the root are kept.
+        """
+        words = fold(query).split()
+        if not words:
+            return []
+        with self._lock:
+            total: Dict[str, float] = {}
+            for i, word in enumerate(words):
+                scores = self._match_word(word)
+                if i == 0:
+                    total = scores
+                else:
+                    total = {r: total[r] + s for r, s in scores.items() if r in total}
+                if not total:
+                    return []
+        if not recursive:
+            total = {r: s for r, s in total.items() if not os.path.dirname(r)}
+        # Few distinct scores: sort each group by path with a C-level key
+        groups: Dict[float, List[str]] = {}
+        for relpath, score in total.items():
+            groups.setdefault(score, []).append(relpath)
+        ranked = []
+        for score in sorted(groups, reverse=True):
+            ranked.extend(sorted(groups[score], key=str.lower))
+        return ranked
+
+
+def _on_change(root: str, event: str, data) -> None:
+    index = _indexes.get(_key(root))
+    if index is None:
+        return
+    if event == "upsert":
+        index.add(data)
+    elif event == "delete":
+        index.remove(data)
+    elif event == "rename":
+        index.rename(*data)
+
+
+def _key(root: str) -> str:
+    return os.path.normcase(os.path.abspath(root))
+
+
+def get(root: str) -> SearchIndex:
+    """Return the search index for `root`, building it on first use.
+
+    As in `library_service.get`, only registering a new index holds the
+    module lock; it is filled under its own lock, which searches and change
+    events on it wait for, so building one index does not block the others.
+    """
+    key = _key(root)
+    with ExitStack() as loading:
+        with _lock:
+            index = _indexes.get(key)
+            if index is not None:
+                return index
+            library_index.add_listener(_on_change)
+            index = _indexes[key] = SearchIndex(root)
+            # Locked before other threads can see it; registered before
+            # loading so changes during the load are not lost
+            loading.enter_context(index._lock)
+        try:
+            for row in library_index.list_tracks(root):
+                index.add(row)
+        except BaseException:
+            with _lock:
+                _indexes.pop(key, None)
+            raise
+        return index
@@ -0,0 +1,24 @@
+"""Filesystem locations used by MusicDom for caches and indexes.
+
+Everything MusicDom persists outside the music library itself lives under a
+single base directory, `~/.cache/musicdom` by default or the directory given
+in the `MUSICDOM_CACHE_DIR` environment variable.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+
+
+def data_dir(*parts: str) -> str:
+    """Return (and create) a directory under the MusicDom cache base."""
+    base = os.getenv("MUSICDOM_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "musicdom")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def path_key(path: str) -> str:
+    """Stable short identifier for a filesystem path, usable as a file name."""
+    norm = os.path.normcase(os.path.abspath(path))
+    return hashlib.sha1(norm.encode("utf-8", "surrogateescape")).hexdigest()[:16]
@@ -0,0 +1,240 @@
+"""Transcoded streaming profiles for the player.
+
+Large lossless files (FLAC, WAV) take long to start over a slow link, so
+`audio_server` can send a track re-encoded to one of `PROFILES` instead of
+the original file. The first request for a (track, profile) starts one
+ffmpeg process that encodes to a pipe; its output is written to a temporary
+file in the cache directory (`storage.data_dir("streams")`), sent from there
+to that client and to any other request for the same stream as it is
+produced, and kept as the cache entry once the encode succeeds. Later plays are served
+from the cached file, with `Range` support, without encoding again.
+
+Cache entries are keyed by file, size and mtime, so an edited track is
+encoded again. The cache is capped by size and evicted least recently used
+first (reads refresh an entry's mtime).
+
+Tracks whose bitrate is already close to the profile's are not re-encoded
+(`should_transcode`); the original file is sent instead.
+
+Configuration (environment variables):
+- `MUSICDOM_STREAM_CACHE_MB`: cache size cap (default 1024).
+- `MUSICDOM_STREAM_WORKERS`: concurrent encodes (default half the cores).
+"""
+from __future__ import annotations
+
+import glob
+import os
+import subprocess
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import library_index
+import metrics
+import storage
+import transcode
+
+MAX_BYTES = int(float(os.getenv("MUSICDOM_STREAM_CACHE_MB", 1024)) * 1024 * 1024)
+STREAM_WORKERS = int(os.getenv("MUSICDOM_STREAM_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+# ffmpeg output read per chunk
+_READ_SIZE = 64 * 1024
+
+
+class Profile(NamedTuple):
+    codec_args: Tuple[str, ...]
+    format: str
+    ext: str
+    mime: str
+    bitrate: int
+
+
+ORIGINAL = "original"
+PROFILES: Dict[str, Optional[Profile]] = {
+    ORIGINAL: None,
+    "high": Profile(("-c:a", "libopus", "-b:a", "160k"), "ogg", ".opus", "audio/ogg", 160_000),
+    "low": Profile(("-c:a", "libopus", "-b:a", "64k"), "ogg", ".opus", "audio/ogg", 64_000),
+    # For browsers without Opus support (older Safari)
+    "mp3": Profile(("-c:a", "libmp3lame", "-b:a", "128k"), "mp3", ".mp3", "audio/mpeg", 128_000),
+}
+# Re-encode only when the source is at least this much larger
+_MIN_RATIO = 1.5
+
+_encodings: Dict[str, "Encoding"] = {}
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(STREAM_WORKERS)
+_decisions: Dict[Tuple[str, int, str], bool] = {}
+
+
+def available() -> bool:
+    return transcode.ffmpeg_available()
+
+
+def cache_path(filepath: str, profile: str) -> str:
+    st = os.stat(filepath)
+    key = f"{storage.path_key(filepath)}-{st.st_mtime_ns:x}-{st.st_size:x}-{profile}"
+    return os.path.join(storage.data_dir("streams"), key + PROFILES[profile].ext)
+
+
+def should_transcode(filepath: str, profile: str) -> bool:
+    """Whether `filepath` is worth re-encoding for `profile`.
+
+    Compares the source's average bitrate with the profile's; files whose
+    bitrate cannot be read are re-encoded.
+    """
+    target = PROFILES.get(profile)
+    if target is None or not available():
+        return False
+    st = os.stat(filepath)
+    key = (filepath, st.st_mtime_ns, profile)
+    decision = _decisions.get(key)
+    if decision is None:
+        try:
+            info = library_index.load_mutagen().File(filepath).info
+            bitrate = st.st_size * 8 / info.length if info.length else 0
+        except Exception:
+            bitrate = 0
+        decision = not bitrate or bitrate > target.bitrate * _MIN_RATIO
+        if len(_decisions) > 4096:
+            _decisions.clear()
+        _decisions[key] = decision
+    return decision
+
+
+class Encoding:
+    """One ffmpeg encode in progress; readers follow its output.
+
+    The output is written straight to a temporary file next to the cache
+    entry, which readers follow by offset, and renamed into place when the
+    encode succeeds. Nothing is kept in memory.
+    """
+
+    def __init__(self, filepath: str, profile: str, target: str):
+        self.filepath = filepath
+        self.profile = PROFILES[profile]
+        self.target = target
+        self.error: Optional[str] = None
+        self.finished = False
+        # File readers open (the temporary file until it is renamed) and how
+        # much of it has been written
+        self._path = f"{target}.{os.getpid()}.tmp"
+        self._size = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="musicdom-stream-encode", daemon=True).start()
+
+    def _run(self) -> None:
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-threads", "1",
+            "-i", self.filepath, "-map", "0:a:0", "-vn", "-map_metadata", "-1",
+            *self.profile.codec_args, "-f", self.profile.format, "pipe:1",
+        ]
+        tmp = self._path
+        try:
+            with _slots, metrics.phase("stream_encode"), open(tmp, "wb") as out:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                try:
+                    while True:
+                        chunk = proc.stdout.read(_READ_SIZE)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        out.flush()
+                        with self._cond:
+                            self._size += len(chunk)
+                            self._cond.notify_all()
+                    stderr = proc.stderr.read().decode(errors="replace")
+                finally:
+                    proc.stdout.close()
+                    proc.stderr.close()
+                    returncode = proc.wait()
+                if returncode != 0 or not self._size:
+                    raise RuntimeError(f"FFmpeg falhou: {stderr.strip()[-500:] or 'sem áudio'}")
+            # Readers only open the file while holding the condition, so the
+            # rename never races with an open handle (Windows)
+            with self._cond:
+                os.replace(tmp, self.target)
+                self._path = self.target
+            _evict()
+        except Exception as e:
+            self.error = str(e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        finally:
+            with _lock:
+                _encodings.pop(self.target, None)
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield the encoded stream from the start, waiting for new output."""
+        sent = 0
+        while True:
+            with self._cond:
+                while self._size == sent and not self.finished:
+                    self._cond.wait()
+                if self.error:
+                    raise RuntimeError(self.error)
+                if self._size == sent:
+                    return
+                try:
+                    with open(self._path, "rb") as f:
+                        f.seek(sent)
+                        chunk = f.read(min(_READ_SIZE, self._size - sent))
+                except OSError as e:
+                    raise RuntimeError(str(e)) from e
+            if not chunk:
+                raise RuntimeError("stream truncated")
+            sent += len(chunk)
+            yield chunk
+
+
+def cached(filepath: str, profile: str) -> Optional[str]:
+    """Return the cached file for (filepath, profile) if it exists, without encoding."""
+    target = cache_path(filepath, profile)
+    return target if os.path.exists(target) else None
+
+
+def open_stream(filepath: str, profile: str) -> Union[str, Encoding]:
+    """Return the cached file for (filepath, profile) or its running encode."""
+    target = cache_path(filepath, profile)
+    with _lock:
+        encoding = _encodings.get(target)
+        if encoding is not None:
+            metrics.cache("stream", hit=False)
+            return encoding
+        if os.path.exists(target):
+            metrics.cache("stream", hit=True)
+            try:
+                os.utime(target)
+            except OSError:
+                pass
+            return target
+        metrics.cache("stream", hit=False)
+        # Drop encodes of older versions of this file
+        prefix = os.path.join(storage.data_dir("streams"), storage.path_key(filepath))
+        for stale in glob.glob(f"{glob.escape(prefix)}-*-{profile}{PROFILES[profile].ext}"):
+            if stale != target:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        encoding = _encodings[target] = Encoding(filepath, profile, target)
+        return encoding
+
+
+def _evict() -> None:
+    entries: List[Tuple[float, int, str]] = []
+    for entry in os.scandir(storage.data_dir("streams")):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
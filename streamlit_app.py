@@ -1,4 +1,8 @@
+import os
+import json
 import streamlit as st
+import metrics
+import warmup
 
 if "path" not in st.session_state:
     st.session_state["path"] = ""
@@ -14,6 +18,70 @@ if "go_to_player" not in st.session_state:
 
 st.sidebar.image("./assets/MusicDomLogo.png")
 
+# Guarda a execução da página nos totais da sessão
+def registrar_execucao(execucao):
+    sessao = st.session_state.setdefault("metricas", {"execucoes": 0, "fases": {}, "historico": []})
+    sessao["execucoes"] += 1
+    for fase, (chamadas, segundos) in execucao.phases.items():
+        total = sessao["fases"].setdefault(fase, [0, 0.0])
+        total[0] += chamadas
+        total[1] += segundos
+    sessao["historico"] = (sessao["historico"] + [execucao.as_dict()])[-50:]
+
+# Painel opcional com o tempo de cada fase, caches e latência HTTP
+def painel_desempenho():
+    sessao = st.session_state.get("metricas")
+    if not sessao or not sessao["historico"]:
+        st.caption("Nenhuma execução registrada ainda.")
+        return
+    ultima = sessao["historico"][-1]
+    st.caption(f"Última execução: {ultima['page']} em {ultima['duration_s'] * 1000:.0f} ms")
+    st.dataframe(
+        [{"fase": f, "chamadas": p["calls"], "ms": round(p["seconds"] * 1000, 1)} for f, p in ultima["phases"].items()],
+        hide_index=True, use_container_width=True,
+    )
+    st.caption(f"Sessão: {sessao['execucoes']} execuções")
+    st.dataframe(
+        [{"fase": f, "chamadas": c, "ms": round(t * 1000, 1)} for f, (c, t) in sessao["fases"].items()],
+        hide_index=True, use_container_width=True,
+    )
+
+    processo = metrics.snapshot()
+    caches = {}
+    for c in processo["counters"]:
+        if c["name"] == "cache_lookups_total":
+            caches.setdefault(c["labels"]["cache"], {"cache": c["labels"]["cache"], "acertos": 0, "faltas": 0})[
+                "acertos" if c["labels"]["result"] == "hit" else "faltas"] += int(c["value"])
+    if caches:
+        st.caption("Caches (processo)")
+        st.dataframe(list(caches.values()), hide_index=True, use_container_width=True)
+    hosts = [
+        {"host": s["labels"]["host"], "req": s["count"], "média ms": round(s["sum"] / s["count"] * 1000),
+         "máx ms": round(s["max"] * 1000)}
+        for s in processo["summaries"] if s["name"] == "http_request_seconds" and s["count"]
+    ]
+    if hosts:
+        st.caption("Busca de imagens: latência por host (processo)")
+        st.dataframe(hosts, hide_index=True, use_container_width=True)
+
+    cols = st.columns(2)
+    cols[0].download_button("Prometheus", metrics.prometheus_text(), file_name="musicdom-metrics.txt",
+                            mime="text/plain", use_container_width=True)
+    cols[1].download_button("JSON", json.dumps({"process": processo, "session": sessao["historico"]}),
+                            file_name="musicdom-metrics.json", mime="application/json", use_container_width=True)
+    # O servidor de streaming só é carregado aqui, fora do caminho da primeira página
+    import audio_server
+    try:
+        st.caption(f"Coleta contínua: {audio_server.metrics_url()}")
+    except OSError:
+        pass
+
+# O painel é desenhado depois da página, para já incluir a execução atual
+with st.sidebar:
+    mostrar_painel = st.toggle("Painel de desempenho", value=os.getenv("MUSICDOM_DEBUG") == "1",
+                               key="painel_desempenho")
+    painel = st.empty()
+
 pg = st.navigation(
     [
         st.Page("list.py", title="Lista de músicas", icon=":material/list:"),
@@ -22,4 +90,16 @@ pg = st.navigation(
     ],
 )
 
-pg.run()
\ No newline at end of file
+metrics.begin_rerun(pg.title)
+try:
+    pg.run()
+finally:
+    execucao = metrics.end_rerun()
+    if execucao is not None:
+        registrar_execucao(execucao)
+    if mostrar_painel:
+        with painel.container():
+            painel_desempenho()
+    # Depois da primeira página desenhada, importa em segundo plano o que as
+    # outras funções vão precisar (uma vez por processo)
+    warmup.start()
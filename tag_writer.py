@@ -0,0 +1,181 @@
+"""Tag editing for MP3, FLAC, OGG and M4A files.
+
+`apply_edit` writes tag fields through mutagen's format-independent "easy"
+interface, optionally renames the file after its title and updates the
+library index for that one file, so the list never needs a rescan after an
+edit. `start_batch` runs many edits on a shared worker pool and exposes their
+progress through the returned `BatchEdit`.
+"""
+from __future__ import annotations
+
+import functools
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import library_index
+
+EDITABLE_EXTENSIONS = (".mp3", ".flac", ".ogg", ".m4a")
+TAG_WORKERS = int(os.getenv("MUSICDOM_TAG_WORKERS", 4))
+
+_pool = ThreadPoolExecutor(max_workers=TAG_WORKERS, thread_name_prefix="musicdom-tags")
+# Held across the "target exists" check and the rename, one per directory,
+# so two edits renaming to the same name never overwrite each other
+_rename_locks: Dict[str, threading.Lock] = {}
+_rename_locks_guard = threading.Lock()
+
+
+def is_editable(relpath: str) -> bool:
+    return os.path.splitext(relpath)[1].lower() in EDITABLE_EXTENSIONS
+
+
+def sanitize_filename(nome: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]', '', nome).strip()
+
+
+def write_tags(filepath: str, fields: Dict[str, str]) -> None:
+    """Set (or, for empty values, remove) easy tag fields and save."""
+    audio = library_index.load_mutagen().File(filepath, easy=True)
+    if audio is None:
+        raise ValueError(f"Formato não suportado: {os.path.basename(filepath)}")
+    if audio.tags is None:
+        audio.add_tags()
+    for k, v in fields.items():
+        if v:
+            audio[k] = [v]
+        else:
+            audio.pop(k, None)
+    audio.save()
+
+
+def _rename_no_replace(src: str, dst: str) -> bool:
+    """Rename `src` to `dst` unless another file is `dst`; True if renamed.
+
+    A case-only rename on a case-insensitive filesystem, where `dst` exists
+    but is `src` itself, goes ahead.
+    """
+    directory = os.path.normcase(os.path.dirname(os.path.abspath(dst)))
+    with _rename_locks_guard:
+        lock = _rename_locks.setdefault(directory, threading.Lock())
+    with lock:
+        if os.path.exists(dst) and not os.path.samefile(src, dst):
+            return False
+        os.rename(src, dst)
+    return True
+
+
+def apply_edit(root: str, relpath: str, fields: Dict[str, str], rename_to: Optional[str] = None) -> str:
+    """Edit one track and update its index row; returns its (new) relpath.
+
+    `rename_to` is a file name without extension (names left empty by
+    `sanitize_filename` are ignored). An existing file is never replaced:
+    if another file already has the new name, the tags are still saved and
+    `FileExistsError` is raised.
+    """
+    if not is_editable(relpath):
+        raise ValueError("Modificações suportadas apenas em MP3, FLAC, OGG e M4A.")
+    arquivo = os.path.join(root, relpath)
+    ocupado = None
+    nome = sanitize_filename(rename_to or "")
+    if nome:
+        novo_nome = nome + os.path.splitext(relpath)[1]
+        novo_relpath = os.path.join(os.path.dirname(relpath), novo_nome)
+        destino = os.path.join(root, novo_relpath)
+        if destino == arquivo:
+            pass
+        elif _rename_no_replace(arquivo, destino):
+            library_index.rename_file(root, relpath, novo_relpath)
+            arquivo, relpath = destino, novo_relpath
+        else:
+            ocupado = novo_nome
+
+    if fields:
+        write_tags(arquivo, fields)
+    library_index.update_file(root, relpath)
+    if ocupado:
+        raise FileExistsError(f"Tags salvas, mas o arquivo não foi renomeado: '{ocupado}' já existe.")
+    return relpath
+
+
+class BatchEdit:
+    """Progress of a batch started with `start_batch`."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        if not total:
+            self.finished.set()
+
+    def _record(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.done += 1
+            if error:
+                self.errors.append(error)
+            if self.done >= self.total:
+                self.finished.set()
+
+
+def start_batch(root: str, edits: List[dict],
+                apply: Optional[Callable[[str, Dict[str, str], Optional[str]], str]] = None) -> BatchEdit:
+    """Apply `edits` ({"relpath", "fields", "rename_to"}) in the background.
+
+    Each edit goes through `apply(relpath, fields, rename_to)`, by default
+    `apply_edit` on `root`; pass `library_service.Library.edit` to hold the
+    shared library's write lock around every edit.
+    """
+    batch = BatchEdit(len(edits))
+    apply = apply or functools.partial(apply_edit, root)
+
+    def run(edit: dict) -> None:
+        try:
+            apply(edit["relpath"], edit.get("fields") or {}, edit.get("rename_to"))
+            batch._record()
+        except Exception as e:
+            batch._record(f"{edit['relpath']}: {e}")
+
+    for edit in edits:
+        _pool.submit(run, edit)
+    return batch
+
+
+def plan_batch(tracks: List[dict], fields: Dict[str, str], number: bool = False,
+               rename: bool = False) -> List[dict]:
+    """Build the edit list for a bulk change over `tracks` (in list order).
+
+    Only non-empty `fields` are applied. `number` sets tracknumber to
+    "i/n"; `rename` renames files from their title (prefixed with the track
+    number when numbering). Tracks of one folder that would get the same
+    name are told apart with " (2)", " (3)", ...
+    """
+    fields = {k: v for k, v in fields.items() if v}
+    edits = []
+    taken = set()
+    width = max(2, len(str(len(tracks))))
+    for i, track in enumerate(tracks, 1):
+        track_fields = dict(fields)
+        if number:
+            track_fields["tracknumber"] = f"{i}/{len(tracks)}"
+        rename_to = None
+        title = track_fields.get("title") or track["title"]
+        if rename and title:
+            rename_to = _unique_name(
+                taken, track["relpath"], f"{i:0{width}d} - {title}" if number else title
+            )
+        edits.append({"relpath": track["relpath"], "fields": track_fields, "rename_to": rename_to})
+    return edits
+
+
+def _unique_name(taken: set, relpath: str, rename_to: str) -> str:
+    """`rename_to`, suffixed if another edit in the batch already uses it."""
+    folder, ext = os.path.dirname(relpath), os.path.splitext(relpath)[1]
+    name, n = rename_to, 1
+    while (folder, (sanitize_filename(name) + ext).casefold()) in taken:
+        n += 1
+        name = f"{rename_to} ({n})"
+    taken.add((folder, (sanitize_filename(name) + ext).casefold()))
+    return name
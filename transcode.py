@@ -0,0 +1,109 @@
+"""FFmpeg post-processing of downloaded audio.
+
+Two output formats are supported:
+- `NATIVE`: keep the source codec and only remux the audio stream into a
+  matching audio container (`.ogg` for Opus/Vorbis, `.m4a` for AAC, ...).
+  Nothing is re-encoded, so this costs a fraction of a second per track.
+- `MP3`: re-encode to MP3 at 192 kbps, skipped when the source already is MP3.
+
+Encodes are CPU-bound, so they run on a bounded pool (`TRANSCODE_WORKERS`,
+one single-threaded ffmpeg per core by default) that is shared by every
+download worker: batch downloads keep all cores busy without oversubscribing
+them, and downloads continue while earlier tracks are still being encoded.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+NATIVE = "native"
+MP3 = "mp3"
+
+TRANSCODE_WORKERS = int(os.getenv("MUSICDOM_TRANSCODE_WORKERS", os.cpu_count() or 1))
+MP3_BITRATE = "192k"
+
+# Normalized codec -> container extension used when remuxing
+CONTAINERS = {
+    "opus": ".ogg",
+    "vorbis": ".ogg",
+    "aac": ".m4a",
+    "alac": ".m4a",
+    "mp3": ".mp3",
+    "flac": ".flac",
+}
+# Container extension -> the codec it usually carries, when yt-dlp does not say
+_EXT_CODECS = {".webm": "opus", ".opus": "opus", ".ogg": "vorbis", ".m4a": "aac", ".mp3": "mp3", ".flac": "flac"}
+
+_pool = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="musicdom-transcode")
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def normalize_codec(acodec: Optional[str], path: str = "") -> Optional[str]:
+    """Map a yt-dlp `acodec` value (e.g. 'mp4a.40.2') to a short codec name."""
+    acodec = (acodec or "").lower()
+    if acodec.startswith("mp4a") or acodec == "aac":
+        return "aac"
+    for codec in CONTAINERS:
+        if acodec.startswith(codec):
+            return codec
+    return _EXT_CODECS.get(os.path.splitext(path)[1].lower())
+
+
+def _target(src: str, ext: str) -> str:
+    base = os.path.splitext(src)[0]
+    dst, n = base + ext, 1
+    while os.path.exists(dst) and dst != src:
+        dst = f"{base} ({n}){ext}"
+        n += 1
+    return dst
+
+
+def _ffmpeg(src: str, dst: str, codec_args: list) -> None:
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+        "-i", src, "-vn", "-map_metadata", "0", *codec_args, dst,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        raise RuntimeError(f"FFmpeg falhou: {result.stderr.strip()[-500:]}")
+
+
+def convert(src: str, audio_format: str = MP3, acodec: Optional[str] = None) -> str:
+    """Post-process a downloaded file and return the final path.
+
+    The source file is removed once the output has been written.
+    """
+    codec = normalize_codec(acodec, src)
+    if audio_format == NATIVE and codec in CONTAINERS:
+        ext = CONTAINERS[codec]
+        if os.path.splitext(src)[1].lower() == ext:
+            return src
+        args = ["-c:a", "copy"]
+    elif codec == "mp3":
+        ext, args = ".mp3", ["-c:a", "copy"]
+        if os.path.splitext(src)[1].lower() == ext:
+            return src
+    else:
+        ext, args = ".mp3", ["-c:a", "libmp3lame", "-b:a", MP3_BITRATE, "-threads", "1"]
+
+    if not ffmpeg_available():
+        raise RuntimeError("FFmpeg não encontrado no PATH; instale FFmpeg para converter o áudio.")
+    dst = _target(src, ext)
+    _ffmpeg(src, dst, args)
+    os.remove(src)
+    return dst
+
+
+def submit(src: str, audio_format: str = MP3, acodec: Optional[str] = None) -> Future:
+    """Run `convert` on the shared transcode pool."""
+    return _pool.submit(convert, src, audio_format, acodec)
@@ -0,0 +1,57 @@
+"""Background import of the heavy dependencies, after the first page is drawn.
+
+The pages import only what their first paint needs; tag parsing (mutagen),
+web image search (requests, BeautifulSoup) and downloads (yt-dlp) load their
+libraries on first use. `start()` imports them on a daemon thread once per
+server process, so the first click on such a feature does not pay for the
+import either. Modules that are not installed are skipped.
+
+Configuration (environment variables):
+- `MUSICDOM_WARMUP=0`: turn the warm-up off (e.g. to measure cold imports).
+- `MUSICDOM_WARMUP_DELAY`: seconds to wait before starting (default 1), so
+  the imports do not compete with the first page for the GIL.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import threading
+import time
+
+import library_index
+import metrics
+
+ENABLED = os.getenv("MUSICDOM_WARMUP", "1") != "0"
+DELAY = float(os.getenv("MUSICDOM_WARMUP_DELAY", 1.0))
+
+# In the order features are usually reached from the list page
+MODULES = (
+    "mutagen.id3", "mutagen.flac", "mutagen.mp4", "mutagen.oggvorbis",
+    "requests", "bs4",
+    "yt_dlp",
+)
+
+_started = False
+_lock = threading.Lock()
+
+
+def _run() -> None:
+    time.sleep(DELAY)
+    with metrics.phase("warmup"):
+        library_index.load_mutagen()
+        for name in MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass
+
+
+def start() -> bool:
+    """Start the warm-up thread unless it already ran; True if started now."""
+    global _started
+    with _lock:
+        if _started or not ENABLED:
+            return False
+        _started = True
+    threading.Thread(target=_run, name="musicdom-warmup", daemon=True).start()
+    return True